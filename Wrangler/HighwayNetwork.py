@@ -270,7 +270,15 @@ class HighwayNetwork(Network):
                         print file_name,fr_node,th_node,to_node,from_street,to_street,new_fr,new_th,new_to
                         outfile.write('%s,%d,%d,%d,%s,%s,%d,%d,%d,note\n' % (file_name,fr_node,th_node,to_node,from_street,to_street,new_fr if new_fr else -1,new_th,new_to if new_to else -1))
                 
-    def write(self, path='.', name='FREEFLOW.NET', writeEmptyFiles=True, suppressQuery=False, suppressValidation=False):
+    def write(self, path='.', name='FREEFLOW.NET', writeEmptyFiles=True, suppressQuery=False, suppressValidation=False,
+              skipUnchanged=False):
+        """
+        Write out this highway network (``FREEFLOW.BLD`` as *name*, and the turn penalty files) to
+        the directory *path*.
+
+        If *skipUnchanged*, then output files that already exist with the same contents are left
+        untouched, and the files are recorded in the manifest (see :py:meth:`Network.updateManifest`).
+        """
         if not os.path.exists(path):
             WranglerLogger.debug("\nPath [%s] doesn't exist; creating." % path)
             os.mkdir(path)
@@ -288,11 +296,14 @@ class HighwayNetwork(Network):
                 if response != "Y" and response != "y":
                     exit(0)
 
-        shutil.copyfile("FREEFLOW.BLD",os.path.join(path,name))
+        digests = {}
+        digests[name] = self.copyFile("FREEFLOW.BLD",os.path.join(path,name),skipUnchanged)
         WranglerLogger.info("Writing into %s\\%s" % (path, name))
         WranglerLogger.info("")
 
         for filename in ["turnsam.pen",         "turnspm.pen",          "turnsop.pen"]:
-            shutil.copyfile(filename, os.path.join(path, filename))
+            digests[filename] = self.copyFile(filename, os.path.join(path, filename), skipUnchanged)
+
+        if skipUnchanged: self.updateManifest(path, digests)
             
         if not suppressValidation: self.validateTurnPens(netfile,'turnPenValidations.csv')
\ No newline at end of file
@@ -0,0 +1,113 @@
+# SFCTA NetworkWrangler: Wrangles transit and road networks from SF-CHAMP
+# Copyright (C) 2018 San Francisco County Transportation Authority
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import array, cPickle, os
+from .NetworkException import NetworkException
+from .TransitLine import TransitLine
+
+__all__ = ['MSAState']
+
+class MSAState(object):
+    """
+    The node delays of each transit line from the previous iteration of the model loop, which
+    :py:meth:`TransitNetwork.addDelay` blends with the new delays when *MSAweight* < 1.0.
+
+    Build one from the previous iteration's :py:class:`TransitNetwork` once per iteration, and
+    :py:meth:`write` it so that the next iteration's process can :py:meth:`read` it instead of
+    parsing the whole previous network again::
+
+        net.addDelay(..., MSAweight=0.5, previousNet=MSAState.read("msa.state"))
+        MSAState(net).write("msa.state")
+
+    """
+
+    FILE_VERSION = 1
+
+    def __init__(self, transitNetwork=None):
+        #: line name => ``array('i')`` of the line's signed node numbers (negative for non-stops)
+        self.nodeIds = {}
+        #: line name => ``array('d')`` of the line's node delays, NaN for nodes without a DELAY
+        self.delays  = {}
+        if transitNetwork: self.update(transitNetwork)
+
+    def __len__(self):
+        return len(self.delays)
+
+    def __contains__(self, name):
+        return name in self.delays
+
+    def update(self, transitNetwork):
+        """
+        Replaces the delays with those of the lines in *transitNetwork*.  As with
+        :py:meth:`TransitNetwork.line`, the first line with a given name wins.
+        """
+        self.nodeIds = {}
+        self.delays  = {}
+        nan = float("nan")
+        for line in transitNetwork.lines:
+            if not isinstance(line, TransitLine) or line.name in self.delays: continue
+
+            delays = array.array('d')
+            for node in line.n:
+                try:
+                    delays.append(float(node.attr["DELAY"]))
+                except (KeyError, TypeError, ValueError):
+                    delays.append(nan)
+            self.nodeIds[line.name] = array.array('i', line.listNodeIds(ignoreStops=False))
+            self.delays[line.name]  = delays
+
+    def lineDelays(self, name):
+        """
+        Returns ``(nodeIds, delays)`` for the line called *name*; see :py:attr:`nodeIds`
+        and :py:attr:`delays`.
+        """
+        if name not in self.delays:
+            raise NetworkException('Line name not found: %s' % (name,))
+        return (self.nodeIds[name], self.delays[name])
+
+    def write(self, filename):
+        """
+        Saves the delays to *filename*, replacing it.  The arrays are stored as raw machine
+        values, so read it back on the same kind of machine.
+        """
+        tmpfile = "%s.%d.tmp" % (filename, os.getpid())
+        lines = [(name, self.nodeIds[name].tostring(), self.delays[name].tostring())
+                 for name in sorted(self.delays.keys())]
+        f = open(tmpfile, 'wb')
+        cPickle.dump((MSAState.FILE_VERSION, lines), f, cPickle.HIGHEST_PROTOCOL)
+        f.close()
+        # os.rename won't replace an existing file on Windows
+        if os.path.exists(filename): os.remove(filename)
+        os.rename(tmpfile, filename)
+
+    @staticmethod
+    def read(filename):
+        """
+        Returns the :py:class:`MSAState` saved in *filename* by :py:meth:`write`.
+        """
+        f = open(filename, 'rb')
+        (version, lines) = cPickle.load(f)
+        f.close()
+        if version != MSAState.FILE_VERSION:
+            raise NetworkException("MSA state file %s has version %s; expected %d" %
+                                   (filename, str(version), MSAState.FILE_VERSION))
+
+        state = MSAState()
+        for (name, nodeIds, delays) in lines:
+            state.nodeIds[name] = array.array('i')
+            state.nodeIds[name].fromstring(nodeIds)
+            state.delays[name]  = array.array('d')
+            state.delays[name].fromstring(delays)
+        return state
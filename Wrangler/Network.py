@@ -1,4 +1,4 @@
-import os, re, string, subprocess, sys, tempfile
+import hashlib, os, re, shutil, string, subprocess, sys, tempfile
 from .Logger import WranglerLogger
 from .NetworkException import NetworkException
 from .Regexes import git_commit_pattern
@@ -15,6 +15,12 @@ class Network(object):
     # static variable
     allNetworks = {}
 
+    # Buffer size for the files written by :py:meth:`writeFile`
+    WRITE_BUFFER_SIZE = 1024*1024
+    # :py:meth:`write` with *skipUnchanged* lists the sha1 of each output in this file in the
+    # output directory, in the format of ``sha1sum``
+    MANIFEST_FILENAME = "wrangler.sha1"
+
     def __init__(self, champVersion, networkBaseDir=None, networkProjectSubdir=None,
                  networkSeedSubdir=None, networkPlanSubdir=None, networkName=None):
         """
@@ -410,8 +416,110 @@ class Network(object):
         
         return commitstr
                 
-    def write(self, path='.', name='network', writeEmptyFiles=True, suppressQuery=False, suppressValidation=False):
+    @staticmethod
+    def hashFile(filename):
+        """
+        Returns the sha1 hex digest of the contents of *filename*.
+        """
+        sha = hashlib.sha1()
+        f = open(filename, 'rb')
+        while True:
+            chunk = f.read(Network.WRITE_BUFFER_SIZE)
+            if not chunk: break
+            sha.update(chunk)
+        f.close()
+        return sha.hexdigest()
+
+    @staticmethod
+    def writeFile(filename, records, skipUnchanged=False):
+        """
+        Writes the strings in *records* to *filename*.  They go to a temporary file first, which
+        then replaces *filename*, so nothing ever sees a partially written file.
+
+        If *skipUnchanged*, then an existing *filename* with exactly the same contents is left
+        alone (so its modification time doesn't change either), and the sha1 hex digest of the
+        contents is returned.  Otherwise, returns None.
+        """
+        tmpfile = "%s.%d.tmp" % (filename, os.getpid())
+        f = open(tmpfile, 'w', Network.WRITE_BUFFER_SIZE)
+        try:
+            f.writelines(records)
+            f.close()
+        except:
+            f.close()
+            os.remove(tmpfile)
+            raise
+
+        digest = None
+        if skipUnchanged:
+            digest = Network.hashFile(tmpfile)
+            if os.path.exists(filename) and os.path.getsize(filename) == os.path.getsize(tmpfile) and \
+               Network.hashFile(filename) == digest:
+                WranglerLogger.debug("Leaving unchanged %s" % filename)
+                os.remove(tmpfile)
+                return digest
+
+        try:
+            os.rename(tmpfile, filename)
+        except OSError:
+            # os.rename won't replace an existing file on Windows
+            os.remove(filename)
+            os.rename(tmpfile, filename)
+        return digest
+
+    @staticmethod
+    def copyFile(srcfile, destfile, skipUnchanged=False):
+        """
+        Copies *srcfile* to *destfile*.  *skipUnchanged* and the return value are as
+        for :py:meth:`writeFile`.
         """
-        Implemented by subclass
+        if not skipUnchanged:
+            shutil.copyfile(srcfile, destfile)
+            return None
+
+        digest = Network.hashFile(srcfile)
+        if os.path.exists(destfile) and os.path.getsize(destfile) == os.path.getsize(srcfile) and \
+           Network.hashFile(destfile) == digest:
+            WranglerLogger.debug("Leaving unchanged %s" % destfile)
+        else:
+            shutil.copyfile(srcfile, destfile)
+        return digest
+
+    @staticmethod
+    def readManifest(path):
+        """
+        Returns the manifest in directory *path* (see :py:attr:`MANIFEST_FILENAME`) as a
+        dictionary of filename => sha1 hex digest.  It's empty if there's no manifest.
+        """
+        manifest = {}
+        manifestfile = os.path.join(path, Network.MANIFEST_FILENAME)
+        if not os.path.exists(manifestfile): return manifest
+
+        f = open(manifestfile, 'r')
+        for line in f:
+            (digest, filename) = line.rstrip("\n").split("  ", 1)
+            manifest[filename] = digest
+        f.close()
+        return manifest
+
+    @staticmethod
+    def updateManifest(path, digests):
+        """
+        Updates the manifest in directory *path* with *digests*, a dictionary of
+        filename (relative to *path*) => sha1 hex digest.
+        """
+        manifest = Network.readManifest(path)
+        manifest.update(digests)
+        Network.writeFile(os.path.join(path, Network.MANIFEST_FILENAME),
+                          ["%s  %s\n" % (manifest[filename], filename) for filename in sorted(manifest.keys())],
+                          skipUnchanged=True)
+
+    def write(self, path='.', name='network', writeEmptyFiles=True, suppressQuery=False, suppressValidation=False,
+              skipUnchanged=False):
+        """
+        Implemented by subclass.
+
+        If *skipUnchanged*, then output files that already exist with the same contents are left
+        untouched, and the outputs are recorded in the manifest (see :py:meth:`updateManifest`).
         """
         pass
\ No newline at end of file
@@ -8,43 +8,74 @@ class Node(object):
     
     * *num* is the string representation of the node number with stop-status (e.g. '-24322')
     * *stop* is True or False
+    * *number* is the (unsigned) node number as an int (e.g. 24322)
     
     All other attributes stored as a dictionary. e.g::
 
         thisnode["DELAY"]="0.5"
 
+    Networks hold a great many of these, so the node is kept compact: the number is stored as
+    an int next to the stop flag, the string *num* is only formatted when asked for, and the
+    attribute dictionary isn't allocated until something is put in it.
     """
-    
+    __slots__ = ('number', 'stop', 'comment', '_attr', '_numText')
+
     # static variables for nodes.xls
     descriptions        = {}
     descriptions_read   = False
 
     def __init__(self, n):
-        self.attr = {}
+        self._attr = None
+        self.comment = None
         if isinstance(n,int):
-            self.num = str(n)
+            self.number   = abs(n)
+            self.stop     = (n >= 0)
+            self._numText = None
         else:
-            self.num = n            
-        self.stop=(self.num.find('-')<0 and True or False)
-        self.comment = None
+            self.num = n
+
+    def _getNum(self):
+        if self._numText: return self._numText
+        if self.stop: return "%d" % self.number
+        return "-%d" % self.number
+
+    def _setNum(self, n):
+        n = str(n)
+        self.number = abs(int(n))
+        self.stop   = (n.find('-')<0 and True or False)
+        # remember text that wouldn't format back the same way (e.g. '+24322') so it's written as read
+        self._numText = None
+        if self._getNum() != n: self._numText = n
+
+    num = property(_getNum, _setNum)
+
+    def _getAttr(self):
+        if self._attr is None: self._attr = {}
+        return self._attr
+
+    def _setAttr(self, attr):
+        self._attr = attr
+
+    attr = property(_getAttr, _setAttr)
+
+    def __getstate__(self):
+        return (self.number, self.stop, self.comment, self._attr, self._numText)
+
+    def __setstate__(self, state):
+        (self.number, self.stop, self.comment, self._attr, self._numText) = state
 
     def setStop(self, isStop=True):
         """
         Changes to stop-status of this node to *isStop*
         """
-        n = abs(int(self.num))
         self.stop = isStop
-
-        if not self.stop:
-            n = -n
-
-        self.num = str(n)
+        self._numText = None
 
     def isStop(self):
         """
         Returns True if this node is a stop, False if not.
         """
-        if int(self.num)>0: return True
+        if self.stop and self.number>0: return True
         return False
 
     def boardsDisallowed(self):
@@ -53,9 +84,9 @@ class Node(object):
         """
         if not self.isStop(): return False
         
-        if "ACCESS" not in self.attr: return False
+        if not self._attr or "ACCESS" not in self._attr: return False
         
-        if int(self.attr["ACCESS"]) == 2: return True
+        if int(self._attr["ACCESS"]) == 2: return True
         
         return False
 
@@ -64,28 +95,29 @@ class Node(object):
         String representation for line file
         """
 
-        if prependNEquals: s=" N="
-        else:              s="   "
-
         # node number
-        if self.stop: s+= " "
-        s += self.num
+        parts = [" N=" if prependNEquals else "   "]
+        if self.stop: parts.append(" ")
+        parts.append(self.num)
         # attributes
-        for k,v in sorted(self.attr.items()):
-            if k=="DELAY" and float(v)==0: continue  # NOP
-            s +=", %s=%s" % (k,v) 
+        if self._attr:
+            for k,v in sorted(self._attr.items()):
+                if k=="DELAY" and float(v)==0: continue  # NOP
+                parts.append(", %s=%s" % (k,v))
         # comma
-        if not lastNode: s+= ","
+        if not lastNode: parts.append(",")
         # comment
-        if self.comment: s+=' %s' % (self.comment,)
+        if self.comment: parts.append(' %s' % (self.comment,))
         # eol
-        s += "\n"
-        return s
+        parts.append("\n")
+        return "".join(parts)
 
     # Dictionary methods
     def __getitem__(self,key): return self.attr[key]
     def __setitem__(self,key,value): self.attr[key]=value
-    def __cmp__(self,other): return cmp(int(self.num),other)
+    def __cmp__(self,other):
+        if self.stop: return cmp(self.number,other)
+        return cmp(-self.number,other)
 
     def description(self):
         """
@@ -93,8 +125,8 @@ class Node(object):
         """
         Node.getDescriptions()
         
-        if abs(int(self.num)) in Node.descriptions:
-            return Node.descriptions[abs(int(self.num))]
+        if self.number in Node.descriptions:
+            return Node.descriptions[self.number]
         
         return None
 
@@ -0,0 +1,381 @@
+# SFCTA NetworkWrangler: Wrangles transit and road networks from SF-CHAMP
+# Copyright (C) 2018 San Francisco County Transportation Authority
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import array, collections
+from UserDict import DictMixin
+from .NetworkException import NetworkException
+from .Node import Node
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__all__ = ['NodeSequence', 'NodeView', 'sequenceMatches']
+
+def sequenceMatches(nodeids, sequence, ignoreStops=False):
+    """
+    Generates every position at which the list *sequence* appears in the list *nodeids*, in
+    order and including overlapping matches.  This uses Knuth-Morris-Pratt, so it takes
+    O(len(nodeids)+len(sequence)) regardless of how much partial matching there is.
+    *nodeids* can be anything indexable, like an ``array('i')``.  If *ignoreStops*, the signs
+    of the numbers in *nodeids* are ignored, so they can be signed node numbers.
+
+    An empty *sequence* matches once, at 0, if *nodeids* isn't empty.
+    """
+    seqlen = len(sequence)
+    if seqlen == 0:
+        if len(nodeids) > 0: yield 0
+        return
+
+    # fallback[i] is the length of the longest proper prefix of sequence[:i+1] that's also a suffix of it
+    fallback = [0]*seqlen
+    matched  = 0
+    for idx in xrange(1, seqlen):
+        while matched > 0 and sequence[idx] != sequence[matched]: matched = fallback[matched-1]
+        if sequence[idx] == sequence[matched]: matched += 1
+        fallback[idx] = matched
+
+    matched = 0
+    for idx in xrange(len(nodeids)):
+        nodeid = nodeids[idx]
+        if ignoreStops and nodeid < 0: nodeid = -nodeid
+        while matched > 0 and nodeid != sequence[matched]: matched = fallback[matched-1]
+        if nodeid == sequence[matched]:
+            matched += 1
+            if matched == seqlen:
+                yield idx - seqlen + 1
+                matched = fallback[matched-1]
+
+class NodeSequence(collections.MutableSequence):
+    """
+    Columnar storage for the nodes of a :py:class:`TransitLine`, which can be used in place of
+    the usual list of :py:class:`Node` objects (see :py:meth:`TransitLine.compactNodes`).
+
+    * *ids* is an ``array('i')`` of signed node numbers (negative for non-stops)
+    * *columns* maps a node attribute name (typically ``DELAY``, ``ACCESS``, ``XYSPEED`` or ``TIMEFAC``)
+      to a list holding each node's value, or None for nodes without it.  A column only exists
+      once some node in the sequence has that attribute.
+    * *comments* is a list of node comments, or None if no node has one.
+
+    It behaves like a list; indexing returns :py:class:`NodeView` objects, which act like
+    :py:class:`Node` but read and write the columns.  A view refers to a position in the
+    sequence, so refetch views after inserting or removing nodes.
+    """
+
+    def __init__(self, nodes=[]):
+        self.ids      = array.array('i')
+        self.columns  = {}
+        self.comments = None
+        self.extend(nodes)
+
+    @staticmethod
+    def _unpack(node):
+        """
+        Returns (signed node number, attribute dict or None, comment) for the given
+        :py:class:`Node` (or int node number).
+        """
+        if not isinstance(node, Node): node = Node(node)
+        if node._numText or (node.number == 0 and not node.stop):
+            raise NetworkException("Node %s can't be stored in a NodeSequence" % node.num)
+        attrs = node._attr
+        if attrs: attrs = dict(attrs.items())
+        else:     attrs = None
+        if node.stop: return (node.number, attrs, node.comment)
+        return (-node.number, attrs, node.comment)
+
+    def _index(self, idx):
+        if idx < 0: idx += len(self.ids)
+        if idx < 0 or idx >= len(self.ids):
+            raise IndexError("NodeSequence index out of range")
+        return idx
+
+    def _idArray(self):
+        """
+        Returns the node numbers (stop-insensitive) as a numpy array.
+        """
+        if len(self.ids) == 0: return numpy.zeros(0, dtype=numpy.intc)
+        return numpy.abs(numpy.frombuffer(self.ids, dtype=numpy.intc))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [NodeView(self, i) for i in xrange(*idx.indices(len(self.ids)))]
+        return NodeView(self, self._index(idx))
+
+    def __setitem__(self, idx, value):
+        if not isinstance(idx, slice):
+            self._setNode(self._index(idx), self._unpack(value))
+            return
+
+        # unpack everything first; the new nodes may be views into this sequence
+        unpacked = [self._unpack(node) for node in value]
+        (start, stop, step) = idx.indices(len(self.ids))
+        if step != 1:
+            positions = range(start, stop, step)
+            if len(positions) != len(unpacked):
+                raise ValueError("attempt to assign sequence of size %d to extended slice of size %d" %
+                                 (len(unpacked), len(positions)))
+            for (pos, data) in zip(positions, unpacked): self._setNode(pos, data)
+            return
+        stop = max(start, stop)
+
+        self.ids[start:stop] = array.array('i', [data[0] for data in unpacked])
+        names = set(self.columns.keys())
+        for data in unpacked:
+            if data[1]: names.update(data[1].keys())
+        for name in names:
+            column = self.columns.get(name)
+            if column is None:
+                column = [None]*(len(self.ids) - len(unpacked) + (stop - start))
+                self.columns[name] = column
+            column[start:stop] = [data[1].get(name) if data[1] else None for data in unpacked]
+        if self.comments is None and [data for data in unpacked if data[2]]:
+            self.comments = [None]*(len(self.ids) - len(unpacked) + (stop - start))
+        if self.comments is not None:
+            self.comments[start:stop] = [data[2] for data in unpacked]
+
+    def _setNode(self, idx, (nodeid, attrs, comment)):
+        self.ids[idx] = nodeid
+        self.setAttributes(idx, attrs)
+        if comment and self.comments is None: self.comments = [None]*len(self.ids)
+        if self.comments is not None: self.comments[idx] = comment
+
+    def __delitem__(self, idx):
+        if not isinstance(idx, slice): idx = self._index(idx)
+        del self.ids[idx]
+        for column in self.columns.itervalues(): del column[idx]
+        if self.comments is not None: del self.comments[idx]
+
+    def insert(self, idx, node):
+        self[idx:idx] = [node]
+
+    def append(self, node):
+        self[len(self.ids):] = [node]
+
+    def extend(self, nodes):
+        self[len(self.ids):] = list(nodes)
+
+    def reverse(self):
+        self.ids.reverse()
+        for column in self.columns.itervalues(): column.reverse()
+        if self.comments is not None: self.comments.reverse()
+
+    def index(self, value):
+        """
+        Like list.index(); an int *value* is stop-sensitive, as it is for a list of :py:class:`Node`.
+        """
+        if isinstance(value, (int, long)) and not isinstance(value, bool):
+            try:
+                return self.ids.index(value)
+            except (ValueError, OverflowError):
+                raise ValueError("%s is not in list" % str(value))
+        for idx in xrange(len(self.ids)):
+            if NodeView(self, idx) == value: return idx
+        raise ValueError("%s is not in list" % str(value))
+
+    def __iter__(self):
+        for idx in xrange(len(self.ids)):
+            yield NodeView(self, idx)
+
+    def __contains__(self, value):
+        try:
+            self.index(value)
+        except ValueError:
+            return False
+        return True
+
+    def nodes(self):
+        """
+        Returns the nodes as a list of (detached) :py:class:`Node` objects.
+        """
+        return [NodeView(self, idx).detach() for idx in xrange(len(self.ids))]
+
+    def setAttribute(self, idx, key, value):
+        if value is None:
+            raise NetworkException("NodeSequence can't store a None value for node attribute %s" % key)
+        column = self.columns.get(key)
+        if column is None:
+            column = [None]*len(self.ids)
+            self.columns[key] = column
+        column[idx] = value
+
+    def setAttributes(self, idx, attrs):
+        """
+        Replaces all attributes of the node at *idx* with those in the dictionary *attrs*.
+        """
+        for column in self.columns.itervalues(): column[idx] = None
+        if attrs:
+            for (key, value) in attrs.items(): self.setAttribute(idx, key, value)
+
+    def nodeIds(self, ignoreStops=True):
+        """
+        Returns a list of the node numbers, see :py:meth:`TransitLine.listNodeIds`.
+        """
+        if not ignoreStops: return self.ids.tolist()
+        if numpy: return self._idArray().tolist()
+        return [abs(nodeid) for nodeid in self.ids]
+
+    def hasNode(self, nodeNumber):
+        """
+        Stop-insensitive; see :py:meth:`TransitLine.hasNode`.
+        """
+        nodeNumber = abs(nodeNumber)
+        return (nodeNumber in self.ids) or (-nodeNumber in self.ids)
+
+    def hasLink(self, nodeA, nodeB):
+        """
+        Stop-insensitive; see :py:meth:`TransitLine.hasLink`.
+        """
+        if len(self.ids) < 2: return False
+        (nodeA, nodeB) = (abs(nodeA), abs(nodeB))
+        if numpy:
+            nodeids = self._idArray()
+            return bool(numpy.any((nodeids[:-1] == nodeA) & (nodeids[1:] == nodeB)))
+        nodeids = self.nodeIds()
+        for idx in xrange(1, len(nodeids)):
+            if nodeids[idx] == nodeB and nodeids[idx-1] == nodeA: return True
+        return False
+
+    def findSequence(self, sequence):
+        """
+        Stop-insensitive; returns every index at which the list *sequence* of node numbers
+        appears, like :py:meth:`TransitLine.findSequence`.  With numpy, the candidates are the
+        positions matching the first node, narrowed by comparing each further node in turn.
+        """
+        seqlen = len(sequence)
+        if not numpy or seqlen == 0: return list(sequenceMatches(self.ids, sequence, True))
+        if seqlen > len(self.ids): return []
+        nodeids    = self._idArray()
+        candidates = numpy.flatnonzero(nodeids[:len(nodeids)-seqlen+1] == sequence[0])
+        for offset in xrange(1, seqlen):
+            if len(candidates) == 0: break
+            candidates = candidates[nodeids[candidates+offset] == sequence[offset]]
+        return candidates.tolist()
+
+
+class _NodeAttributes(DictMixin, object):
+    """
+    Dictionary interface to the attributes of one node in a :py:class:`NodeSequence`.
+    """
+    __slots__ = ('_seq', '_idx')
+
+    def __init__(self, seq, idx):
+        self._seq = seq
+        self._idx = idx
+
+    def __getitem__(self, key):
+        column = self._seq.columns.get(key)
+        if column is None or column[self._idx] is None: raise KeyError(key)
+        return column[self._idx]
+
+    def __setitem__(self, key, value):
+        self._seq.setAttribute(self._idx, key, value)
+
+    def __delitem__(self, key):
+        self[key] # raises KeyError if it isn't there
+        self._seq.columns[key][self._idx] = None
+
+    def __contains__(self, key):
+        column = self._seq.columns.get(key)
+        return column is not None and column[self._idx] is not None
+
+    def keys(self):
+        return [key for (key, column) in self._seq.columns.iteritems() if column[self._idx] is not None]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+class NodeView(Node):
+    """
+    A :py:class:`Node` backed by a position in a :py:class:`NodeSequence`.
+    Copying or pickling one produces a plain :py:class:`Node`.
+    """
+    __slots__ = ('_seq', '_idx')
+
+    def __init__(self, seq, idx):
+        self._seq = seq
+        self._idx = idx
+
+    def _getNumber(self):
+        return abs(self._seq.ids[self._idx])
+
+    def _setNumber(self, number):
+        if self._seq.ids[self._idx] < 0: number = -number
+        self._seq.ids[self._idx] = number
+
+    number = property(_getNumber, _setNumber)
+
+    def _getStopFlag(self):
+        return self._seq.ids[self._idx] >= 0
+
+    def _setStopFlag(self, isStop):
+        number = abs(self._seq.ids[self._idx])
+        if not isStop:
+            if number == 0: raise NetworkException("Node 0 can't be a non-stop in a NodeSequence")
+            number = -number
+        self._seq.ids[self._idx] = number
+
+    stop = property(_getStopFlag, _setStopFlag)
+
+    def _getComment(self):
+        if self._seq.comments is None: return None
+        return self._seq.comments[self._idx]
+
+    def _setComment(self, comment):
+        if self._seq.comments is None:
+            if not comment: return
+            self._seq.comments = [None]*len(self._seq.ids)
+        self._seq.comments[self._idx] = comment
+
+    comment = property(_getComment, _setComment)
+
+    def _getAttributes(self):
+        return _NodeAttributes(self._seq, self._idx)
+
+    def _setAttributes(self, attr):
+        self._seq.setAttributes(self._idx, dict(attr.items()) if attr else None)
+
+    _attr = property(_getAttributes, _setAttributes)
+
+    def _getNumText(self):
+        return None
+
+    def _setNumText(self, numText):
+        if numText: raise NetworkException("Node %s can't be stored in a NodeSequence" % numText)
+
+    _numText = property(_getNumText, _setNumText)
+
+    def detach(self):
+        """
+        Returns a plain :py:class:`Node` copy of this node.
+        """
+        node = Node(self._seq.ids[self._idx])
+        node.comment = self.comment
+        attrs = self._attr
+        if attrs: node.attr = dict(attrs.items())
+        return node
+
+    def __reduce_ex__(self, protocol):
+        return self.detach().__reduce_ex__(protocol)
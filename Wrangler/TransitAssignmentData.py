@@ -17,8 +17,8 @@
 # Original revision: Lisa Zorn 2010-8-5
 # based on old "combineTransitDBFs.py"
 #
-import csv,os,logging,string,sys,xlrd
-from dataTable import DataTable, dbfTableReader, FieldType
+import copy,csv,itertools,multiprocessing,numpy,os,logging,string,sys,xlrd
+from dataTable import DataTable, DataTableKeyError, dbfTableReader, FieldType
 from .TransitCapacity import TransitCapacity
 from .TransitLine import TransitLine
 from .Logger import WranglerLogger
@@ -27,14 +27,93 @@ from collections import defaultdict
 
 print "Importing ", __file__
 
-__all__ = ['TransitAssignmentData', 'TransitAssignmentDataException']
+__all__ = ['TransitAssignmentData', 'TransitAssignmentDataException',
+           'MultiPeriodTransitAssignmentData', 'DailyTransitAssignmentData']
 
 class TransitAssignmentDataException(Exception): pass
 
+def _csvColumn(rows, colnum, convert=None, dtype=None):
+    """
+    Returns the column *colnum* of the csv *rows*, as a list of strings, or converted by *convert*
+    into a numpy array of *dtype*.
+    """
+    if not convert: return [row[colnum] for row in rows]
+    if not dtype: return [convert(row[colnum]) for row in rows]
+    return numpy.fromiter((convert(row[colnum]) for row in rows), dtype=dtype, count=len(rows))
+
+def _intOrZero(text):
+    if text=="": return 0
+    return int(text)
+
+def _floatOrZero(text):
+    if text=="": return 0.0
+    return float(text)
+
+def _hundredthsOrZero(text):
+    # backwards compatibility - dbfs were 100ths of a mile/min
+    if text=="": return 0.0
+    return float(text)*100.0
+
+def _codesIn(sortedValues, values):
+    """
+    Returns a numpy array of the position of each of *values* in the sorted numpy array of unique
+    *sortedValues*, or -1 where it isn't there.
+    """
+    values = numpy.asarray(values, dtype=numpy.int64)
+    if len(sortedValues) == 0: return numpy.zeros(len(values), dtype=numpy.int64) - 1
+    pos = numpy.minimum(numpy.searchsorted(sortedValues, values), len(sortedValues)-1)
+    return numpy.where(sortedValues[pos] == values, pos, -1)
+
+def _pairCodesIn(sortedCodes, firstCodes, secondCodes, numSecond):
+    """
+    Combines the codes *firstCodes* and *secondCodes* (each -1 or less than *numSecond*) into one
+    and returns their position in *sortedCodes* with :py:func:`_codesIn`.
+    """
+    codes = numpy.where((firstCodes >= 0) & (secondCodes >= 0), firstCodes*numSecond + secondCodes, -1)
+    return _codesIn(sortedCodes, codes)
+
+def _linkColumnsFromKeys(keys):
+    """
+    Returns the :py:attr:`TransitAssignmentData.linkColumns` for the rows with ABNAMESEQ *keys*, for
+    tables that only have those (the NAME field is truncated).
+    """
+    (avalues, bvalues, linenames, seqs, hasSeqs) = ([], [], [], [], [])
+    for key in keys:
+        (a, b, linename, seq, hasSeq) = (0, 0, "", 0, False)
+        parts = key.split(" ", 2)
+        if len(parts) == 3:
+            nameseq = parts[2].rsplit(" ", 1)
+            try:
+                (a, b, linename) = (int(parts[0]), int(parts[1]), parts[2])
+                if len(nameseq) == 2: (linename, seq, hasSeq) = (nameseq[0], int(nameseq[1]), True)
+            except ValueError:
+                pass
+        # only the keys that TransitAssignmentData.linkKey() can make have a SEQ
+        hasSeq = hasSeq and ("%d %d %s %d" % (a, b, linename, seq) == key)
+        avalues.append(a)
+        bvalues.append(b)
+        linenames.append(linename)
+        seqs.append(seq)
+        hasSeqs.append(hasSeq)
+    return (numpy.array(avalues, dtype=numpy.int64), numpy.array(bvalues, dtype=numpy.int64),
+            numpy.array(linenames, dtype=object), numpy.array(seqs, dtype=numpy.int64),
+            numpy.array(hasSeqs, dtype=bool))
+
+def _readAdditiveColumns((tad, filename, mode)):
+    """
+    Process pool worker for :py:meth:`TransitAssignmentData.readAdditiveCsvs`.
+    Lives at module level so that it can be pickled.
+    """
+    return tad.readAdditiveColumns(filename, mode)
+
 class TransitAssignmentData:
     
     TIMEPERIOD_TO_VEHTYPIDX = { "AM":2, "MD": 4, "PM":3, "EV":4, "EA":4 }
 
+    # Number of processes used to read the assignment csvs after the first one, which only
+    # contribute their additive fields.  They're still added in mode order, so the result
+    # is the same as reading them one after another (the default, 1).
+    readerProcesses = 1
     
     def __init__(self, directory=".", timeperiod="AM", champtype="champ4", muniTEP=True, ignoreModes=[], 
                  system=[], profileNode=False,tpfactor="quickboards",grouping=None,
@@ -51,6 +130,8 @@ class TransitAssignmentData:
            * pass *profileNode* to only look at links to or from that node
            * *tpfactor* determines the time period peak hour factor.  Must be one of ```quickboards```
              or ```constant``` or ```constant_with_peaked_muni```.
+           * *grouping* is ```RAPID``` for the Muni rapid lines, or a transit line groupings workbook,
+             or a dict of line name => group that has already been read from one.
            * Uses *transitLineToVehicle* and *transitVehicleToCapacity* to map transit lines to vehicle types, 
              and vehicle types to capacities.
            * If *lineLevelAggregateFilename* or *linkLevelAggregateFilename* are passed in, then
@@ -96,6 +177,9 @@ class TransitAssignmentData:
         else:
             self.capacity   = TransitCapacity()
         self.csvColnames= None # uninitialized           
+        #: (A, B, line name, SEQ, has SEQ) numpy arrays for the trnAsgnTable rows, as in their ABNAMESEQ keys
+        #: (where *has SEQ* is False if the key doesn't end with the SEQ); see buildLinkIndex()
+        self.linkColumns    = None
 
         if self.timeperiod not in ["AM", "MD", "PM", "EV", "EA"]:
             raise TransitAssignmentDataException("Invalid timeperiod "+str(timeperiod))
@@ -103,7 +187,9 @@ class TransitAssignmentData:
             raise TransitAssignmentDataException("Invalid champtypte "+str(champtype))
 
         # supplementary workbooks
-        if grouping and (grouping.upper() == "RAPID"):
+        if isinstance(grouping, dict):
+            self.lineToGroup = grouping
+        elif grouping and (grouping.upper() == "RAPID"):
             self.lineToGroup = self.assignMuniRapid()
         else:
             self.lineToGroup = self.readTransitLineGrouping(mapfile=grouping)
@@ -241,312 +327,454 @@ class TransitAssignmentData:
 
     def readTransitAssignmentCsvs(self):
         """
-        Read the transit assignment dbfs, the direct output of Cube's transit assignment.
+        Read the transit assignment csvs, the direct output of Cube's transit assignment.
+
+        Each csv is read in a single pass into columns; the first one (along with the SFWBW dbf,
+        for the FREQ and SEQ fields) fills in the *trnAsgnTable*, and the additive fields of
+        the subsequent ones are summed into it by row.  See :py:attr:`readerProcesses`.
         """
         self.trnAsgnTable   = False
         self.aggregateTable = False
         warnline = {}
-        ABNameSeq_List = []  # (A,B,NAME,SEQ) from the dbf/csvs
-                
-        # open the input assignment files
-        for mode in self.MODES:
-            if mode == "WMWVIS":
-                filename = os.path.join(self.assigndir, "VISWMW" + self.timeperiod + ".csv")
-            elif mode[1]=="T":
-                filename = os.path.join(self.assigndir, "NS" + mode + self.timeperiod + ".csv")
-            else:
-                filename = os.path.join(self.assigndir, "SF" + mode + self.timeperiod + ".csv")
                 
-            # Read the DBF file into datatable
-            WranglerLogger.info("Reading "+filename)
+        # open the first input assignment file
+        mode     = self.MODES[0]
+        filename = self.assignmentCsvFilename(mode)
 
-            # Create our table data structure once
-            if mode == self.MODES[0]:
-                # figure out how many records
-                numrecs = 0
-                totalrows = 0
-                                
-                filereader = csv.reader(open(filename, 'rb'), delimiter=',', quoting=csv.QUOTE_NONE)
-                for row in filereader:
-                    
-                    # header row?
-                    if row[0]=="A": 
-                        self.initializeFields(row)
-                        continue
-                    elif totalrows==0 and not self.csvColnames:
-                        self.initializeFields()
-
-                    
-                    totalrows += 1
-                    if self.profileNode and \
-                       (int(row[self.colnameToCsvIndex["A"]]) != self.profileNode and
-                        int(row[self.colnameToCsvIndex["B"]]) != self.profileNode): continue
-                    
-                    if int(row[self.colnameToCsvIndex["MODE"]]) in self.ignoreModes: continue
-                    
-                    linename = row[self.colnameToCsvIndex["NAME"]].strip()
-
-                    # exclude this system?
-                    (system, vehicletype) = self.capacity.getSystemAndVehicleType(linename, self.timeperiod)
-
-                    if len(self.system)>0 and system not in self.system: continue
-
-                    numrecs += 1
-                WranglerLogger.info("Keeping %d records out of %d" % (numrecs, totalrows))
-                
-                self.trnAsgnTable = DataTable(numRecords=numrecs,
-                                              fieldNames=self.trnAsgnFields.keys(),
-                                              numpyFieldTypes=self.trnAsgnFields.values())
-                ABNameSeqSet = set()
-            
-            
-            # Go through the records
-            newrownum = 0  # row number in the trnAsgnTable,ABNameSeq_List -- rows we're keeping
-            oldrownum = 0  # row number in the csv,dbf -- all input rows
-            
-            filereader = csv.reader(open(filename, 'rb'), delimiter=',', quoting=csv.QUOTE_NONE)
-            
-            # for the first csv only, also read the dbf for the freq and seq fields
-            if mode == self.MODES[0]:
-                indbf = dbfTableReader(os.path.join(self.assigndir, "SFWBW" + self.timeperiod + ".dbf"))
-            else:
-                indbf = None
-            
-            for row in filereader:
-                # header row?
-                if row[0]=="A": continue
-                                                       
-                if self.profileNode:
-                    if (int(row[self.colnameToCsvIndex["A"]]) != self.profileNode and
-                        int(row[self.colnameToCsvIndex["B"]]) != self.profileNode): continue
-                    elif int(row[self.colnameToCsvIndex["AB_VOL"]]) > 0:
-                        WranglerLogger.info("Link %s %s for mode %s has AB_VOL %s" % 
-                                     (row[self.colnameToCsvIndex["A"]], 
-                                      row[self.colnameToCsvIndex["B"]], mode, 
-                                      row[self.colnameToCsvIndex["AB_VOL"]]))
-            
-                if int(row[self.colnameToCsvIndex["MODE"]]) in self.ignoreModes:
-                    oldrownum += 1
-                    continue
-                     
-                linename = row[self.colnameToCsvIndex["NAME"]].strip()
-                
-                # exclude this system?
-                (system, vehicletype) = self.capacity.getSystemAndVehicleType(linename, self.timeperiod)
-                if len(self.system)>0 and system not in self.system: continue
-            
-                # Initial table fill: Special stuff for the first time through
-                if mode == self.MODES[0]:
+        # Read the csv file into columns
+        WranglerLogger.info("Reading "+filename)
+        (rows, linenames, systems, dbfRowNums, totalrows) = self.readAssignmentCsv(filename, mode, initialize=True)
+        WranglerLogger.info("Keeping %d records out of %d" % (len(rows), totalrows))
 
-                    # ------------ these fields just get used directly
-                    for field in self.trnAsgnCopyFields:
-                        
-                        try:
-                            
-                            # integer fields
-                            if self.trnAsgnFields[field][0] in ['u','b']:
-                                if row[self.colnameToCsvIndex[field]]=="":
-                                    self.trnAsgnTable[newrownum][field] = 0
-                                elif field in ['TIME','DIST']:
-                                    # backwards compatibility - dbfs were 100ths of a mile/min
-                                    self.trnAsgnTable[newrownum][field] = float(row[self.colnameToCsvIndex[field]])*100.0
-                                else:
-                                    self.trnAsgnTable[newrownum][field] = int(row[self.colnameToCsvIndex[field]])                               
-                            # float fields
-                            elif self.trnAsgnFields[field][0] == 'f':
-                                if row[self.colnameToCsvIndex[field]]=="":
-                                    self.trnAsgnTable[newrownum][field] = 0.0
-                                else:
-                                    self.trnAsgnTable[newrownum][field] = float(row[self.colnameToCsvIndex[field]])
-                            # text fields
-                            else:
-                                self.trnAsgnTable[newrownum][field] = row[self.colnameToCsvIndex[field]]
-                        
-                        except:
-                            WranglerLogger.fatal("Error intepreting field %s: [%s]" % (field, str(self.colnameToCsvIndex[field])))
-                            WranglerLogger.fatal("row=%s" % str(row))
-                            WranglerLogger.fatal(sys.exc_info()[0])
-                            WranglerLogger.fatal(sys.exc_info()[1])                        
-                            sys.exit(2)  
-                    # ------------ these fields come from the dbf because they're missing in the csv (sigh)
-                    dbfRow = indbf.__getitem__(oldrownum)
-                    if int(row[self.colnameToCsvIndex["A"]])<100000:
-                        if dbfRow["A"]!=int(row[self.colnameToCsvIndex["A"]]):
-                            raise NetworkException("Assertion error for A on row %d: %s != %s" % (oldrownum, str(dbfRow["A"]), str(row[self.colnameToCsvIndex["A"]])))
-                    if int(row[self.colnameToCsvIndex["B"]])<100000:
-                        if dbfRow["B"]!=int(row[self.colnameToCsvIndex["B"]]):
-                            raise NetworkException("Assertion error for B on row %d: %s != %s" % (oldrownum, str(dbfRow["B"]), str(row[self.colnameToCsvIndex["B"]])))
-                    self.trnAsgnTable[newrownum]["FREQ"] = dbfRow["FREQ"]
-                    self.trnAsgnTable[newrownum]["SEQ"]  = dbfRow["SEQ"]
-
-                    trySeq = dbfRow["SEQ"]
-                    # ------------ special one-time computed fields
-                    
-                    # ABNameSeq is more complicated because we want it to be unique 
-                    AB = row[self.colnameToCsvIndex["A"]] + " " + row[self.colnameToCsvIndex["B"]]
-                    self.trnAsgnTable[newrownum]["AB"] = AB
-                    
-                    ABNameSeq = AB + " " + linename
-                    if trySeq>0:
-                        tryABNameSeq = ABNameSeq + " " + str(trySeq)
-                    
-                        # This line seems to be a problem... A/B/NAME/SEQ are not unique
-                        if tryABNameSeq in ABNameSeqSet:
-                            WranglerLogger.warn("Non-Unique A/B/Name/Seq: " + tryABNameSeq + "; faking SEQ!")
-                        # Find one that works
-                        while tryABNameSeq in ABNameSeqSet:
-                            trySeq += 1
-                            tryABNameSeq = ABNameSeq + " " + str(trySeq)
-                        ABNameSeq = tryABNameSeq
-                    self.trnAsgnTable[newrownum]["ABNAMESEQ"] = ABNameSeq
-                    ABNameSeqSet.add(ABNameSeq)
-                    
-                    ABNameSeq_List.append((int(row[self.colnameToCsvIndex["A"]]),
-                                           int(row[self.colnameToCsvIndex["B"]]),
-                                           row[self.colnameToCsvIndex["NAME"]],
-                                           trySeq))
-                                        
-                    # ------------ straight lookup FULLNAME, VEHTYPE, VEHCAP; easy calc for PERIODCAP
-                    self.trnAsgnTable[newrownum]["SYSTEM"]  = system
-                    self.trnAsgnTable[newrownum]["VEHTYPE"] = vehicletype
-
-                    self.trnAsgnTable[newrownum]["FULLNAME"] = self.capacity.getFullname(linename, self.timeperiod)
-                        
-                    try:
-                       (vtype, vehcap) = self.capacity.getVehicleTypeAndCapacity(linename, self.timeperiod)
+        # Create our table data structure once
+        self.trnAsgnTable = DataTable(numRecords=len(rows),
+                                      fieldNames=self.trnAsgnFields.keys(),
+                                      numpyFieldTypes=self.trnAsgnFields.values())
 
-                       self.trnAsgnTable[newrownum]["VEHCAP"] = vehcap
-                       self.trnAsgnTable[newrownum]["PERIODCAP"] = TransitLine.HOURS_PER_TIMEPERIOD[self.timeperiod] * 60.0 * vehcap/self.trnAsgnTable[newrownum]["FREQ"]
-                    except:
-                       self.trnAsgnTable[newrownum]["VEHCAP"] = 0
-                       self.trnAsgnTable[newrownum]["PERIODCAP"] = 0
-
-                    # if we still don't have a system, warn
-                    if self.trnAsgnTable[newrownum]["SYSTEM"] == "" and not warnline.has_key(linename):
-                        WranglerLogger.warning("No default system: " + linename)
-                        warnline[linename] =1
-                    
-                    #---------add in any grouping that may want to use
-                    if self.lineToGroup.has_key(linename):
-                        self.trnAsgnTable[newrownum]["GROUP"] = self.lineToGroup[linename]
-                    else:
-                        self.trnAsgnTable[newrownum]["GROUP"] = ""
-                    
-                    # initialize additive fields
-                    for field in self.trnAsgnAdditiveFields:
-                        if row[self.colnameToCsvIndex[field]]=="":
-                            self.trnAsgnTable[newrownum][field] = 0.0
-                        else:
-                            self.trnAsgnTable[newrownum][field] = float(row[self.colnameToCsvIndex[field]])
-                        
-                # end initial table fill
-                
-                # Add in the subsequent assignment files
-                else:
-                     
-                    # print oldrownum, newrownum, ABNameSeq_List[newrownum]
-                    # print row[self.colnameToCsvIndex["NAME"]], ABNameSeq_List[oldrownum][2]
-                             
-                    assert(int(row[self.colnameToCsvIndex["A"]]) == ABNameSeq_List[newrownum][0])
-                    assert(int(row[self.colnameToCsvIndex["B"]]) == ABNameSeq_List[newrownum][1])
-                    # these don't nec match, can be *32 in ferry skim rather than the bart vehicle name, for example
-                    # assert(  row[self.colnameToCsvIndex["NAME"]] == ABNameSeq_List[newrownum][2])
-                    
-                    ABNameSeq = row[self.colnameToCsvIndex["A"]] + " " + \
-                                row[self.colnameToCsvIndex["B"]] + " " + \
-                                row[self.colnameToCsvIndex["NAME"]].rstrip()
-                    if ABNameSeq_List[newrownum][3]>0:
-                        ABNameSeq += " " + str(ABNameSeq_List[newrownum][3])                    
-                    for field in self.trnAsgnAdditiveFields:
-                        if row[self.colnameToCsvIndex[field]] !="":
-                            self.trnAsgnTable[ABNameSeq][field] += float(row[self.colnameToCsvIndex[field]])
-                        
-                newrownum += 1   
-                oldrownum += 1
-
-            # we're done with this; free it up
-            del filereader
-            if indbf: 
-                del indbf
-            
-            # Table is created and filled -- set the index
-            if mode == self.MODES[0]: 
-                try:
-                    self.trnAsgnTable.setIndex(fieldName="ABNAMESEQ")
-                except:
-                    # failure - try to figure out why
-                    ABNameSeqList = []
-                    for row in self.trnAsgnTable:
-                        ABNameSeqList.append(row["ABNAMESEQ"])
-                    ABNameSeqList.sort()
-                    for idx in range(len(ABNameSeqList)-1):
-                        if ABNameSeqList[idx]==ABNameSeqList[idx+1]:
-                            WranglerLogger.warn("Duplicate ABNAMESEQ at idx %d : [%s]" % (idx,ABNameSeqList[idx]))
-                    exit(1)
+        # for the first csv only, also read the dbf for the freq and seq fields
+        indbf = dbfTableReader(os.path.join(self.assigndir, "SFWBW" + self.timeperiod + ".dbf"))
+        ABNameSeq_List = self.fillAssignmentTable(rows, linenames, systems, indbf, dbfRowNums, warnline)  # (A,B,NAME,SEQ)
+
+        # we're done with this; free it up
+        del rows
+        del indbf
+
+        # Table is created and filled -- set the index
+        try:
+            self.trnAsgnTable.setIndex(fieldName="ABNAMESEQ")
+        except:
+            # failure - try to figure out why
+            ABNameSeqList = []
+            for row in self.trnAsgnTable:
+                ABNameSeqList.append(row["ABNAMESEQ"])
+            ABNameSeqList.sort()
+            for idx in range(len(ABNameSeqList)-1):
+                if ABNameSeqList[idx]==ABNameSeqList[idx+1]:
+                    WranglerLogger.warn("Duplicate ABNAMESEQ at idx %d : [%s]" % (idx,ABNameSeqList[idx]))
+            exit(1)
+
+        # Add in the subsequent assignment files
+        rowIndex = self.buildAssignmentRowIndex(ABNameSeq_List)
+        for (filename, mode, additiveColumns) in self.readAdditiveCsvs(self.MODES[1:]):
+            WranglerLogger.info("Reading "+filename)
+            for message in additiveColumns[4]: WranglerLogger.info(message)
+            self.addAssignmentColumns(additiveColumns, rowIndex)
+
+        # index the line links by their typed (A, B, NAME, SEQ)
+        self.linkColumns = (rowIndex[0], rowIndex[1], numpy.array([abns[2] for abns in ABNameSeq_List], dtype=object),
+                            rowIndex[2], rowIndex[2] > 0)
+        self.buildLinkIndex()
 
         # ok the table is all filled in -- fill in the LOAD
-        for row in self.trnAsgnTable:
-            if row["VEHCAP"] == 0: continue
-            tpfactor = self.TIMEPERIOD_FACTOR[self.timeperiod]
-            
-            # mode-specific peaking factor will over-ride
-            if row["MODE"] in self.TIMEPERIOD_FACTOR:
-                tpfactor = self.TIMEPERIOD_FACTOR[row["MODE"]][self.timeperiod]
-                
-            row["LOAD"] = row["AB_VOL"] * tpfactor * row["FREQ"] / (60.0 * row["VEHCAP"])
+        fields   = self.trnAsgnTable.fields
+        tpfactor = numpy.empty(len(fields), dtype=numpy.float64)
+        tpfactor.fill(self.TIMEPERIOD_FACTOR[self.timeperiod])
+
+        # mode-specific peaking factor will over-ride
+        for (tpmode, modefactor) in self.TIMEPERIOD_FACTOR.iteritems():
+            if isinstance(tpmode, int):
+                tpfactor[fields["MODE"] == tpmode] = modefactor[self.timeperiod]
+
+        hascap = fields["VEHCAP"] != 0
+        fields["LOAD"][hascap] = fields["AB_VOL"][hascap].astype(numpy.float64) * tpfactor[hascap] * \
+                                 fields["FREQ"][hascap] / (60.0 * fields["VEHCAP"][hascap].astype(numpy.float64))
 
         # build the aggregate table for key="A B"
         if self.aggregateAll:
             self.buildAggregateTable()
+
+    def assignmentCsvFilename(self, mode):
+        """
+        Returns the name of the transit assignment csv for *mode*.
+        """
+        if mode == "WMWVIS":
+            return os.path.join(self.assigndir, "VISWMW" + self.timeperiod + ".csv")
+        elif mode[1]=="T":
+            return os.path.join(self.assigndir, "NS" + mode + self.timeperiod + ".csv")
+        return os.path.join(self.assigndir, "SF" + mode + self.timeperiod + ".csv")
+
+    def readAssignmentCsv(self, filename, mode, initialize=False, messages=None):
+        """
+        Reads the transit assignment csv *filename* for *mode* in a single pass and applies the
+        *profileNode*, *ignoreModes* and *system* filters.  Pass *initialize* for the first csv,
+        to initialize the fields from its header row.  The links found for the *profileNode* are
+        logged, or appended to the list *messages* if one is passed.
+
+        Returns ``(rows, linenames, systems, dbfRowNums, totalrows)``:
+
+           * *rows* are the csv rows that are kept
+           * *linenames* are their (stripped) line names
+           * *systems* maps each of those line names to its (system, vehicle type)
+           * *dbfRowNums* is a numpy array of their row numbers in the corresponding dbf
+           * *totalrows* is the number of data rows in the csv
+        """
+        rows = []
+        csvfile = open(filename, 'rb')
+        for row in csv.reader(csvfile, delimiter=',', quoting=csv.QUOTE_NONE):
+            # header row?
+            if row[0]=="A":
+                if initialize: self.initializeFields(row)
+                continue
+            elif initialize and len(rows)==0 and not self.csvColnames:
+                self.initializeFields()
+            rows.append(row)
+        csvfile.close()
+
+        totalrows = len(rows)
+        rownums   = numpy.arange(totalrows)
+        if self.profileNode:
+            acol   = _csvColumn(rows, self.colnameToCsvIndex["A"], int, numpy.int64)
+            bcol   = _csvColumn(rows, self.colnameToCsvIndex["B"], int, numpy.int64)
+            rownums = numpy.flatnonzero((acol == self.profileNode) | (bcol == self.profileNode))
+            for rownum in rownums:
+                row = rows[rownum]
+                if int(row[self.colnameToCsvIndex["AB_VOL"]]) > 0:
+                    message = "Link %s %s for mode %s has AB_VOL %s" % \
+                              (row[self.colnameToCsvIndex["A"]], 
+                               row[self.colnameToCsvIndex["B"]], mode, 
+                               row[self.colnameToCsvIndex["AB_VOL"]])
+                    if messages is None: WranglerLogger.info(message)
+                    else:                messages.append(message)
+            rows = [rows[rownum] for rownum in rownums]
+
+        # ignored modes still count as dbf rows
+        ignored = numpy.in1d(_csvColumn(rows, self.colnameToCsvIndex["MODE"], int, numpy.int64), self.ignoreModes)
+        rows    = [rows[rownum] for rownum in numpy.flatnonzero(~ignored)]
+
+        # exclude this system?  (excluded rows don't count as dbf rows)
+        linenames = _csvColumn(rows, self.colnameToCsvIndex["NAME"], string.strip)
+        systems   = {}
+        for linename in linenames:
+            if linename not in systems:
+                systems[linename] = self.capacity.getSystemAndVehicleType(linename, self.timeperiod)
+        keep = numpy.ones(len(rows), dtype=bool)
+        if len(self.system)>0:
+            keep = numpy.array([systems[linename][0] in self.system for linename in linenames], dtype=bool)
+
+        advanced = ignored.copy()
+        advanced[~ignored] = keep
+        dbfRowNums = (numpy.cumsum(advanced) - 1)[~ignored][keep]
+        if not keep.all():
+            rows      = [rows[rownum] for rownum in numpy.flatnonzero(keep)]
+            linenames = [linenames[rownum] for rownum in numpy.flatnonzero(keep)]
+        return (rows, linenames, systems, dbfRowNums, totalrows)
+
+    def fillAssignmentTable(self, rows, linenames, systems, indbf, dbfRowNums, warnline):
+        """
+        Initial table fill: fills in the *trnAsgnTable* from the *rows* of the first csv, as returned by
+        :py:meth:`readAssignmentCsv`, and the rows *dbfRowNums* of the dbf table *indbf*.
+        Warns about lines without a system unless they're in the dict *warnline*, and adds them to it.
+
+        Returns the list of (A,B,NAME,SEQ) for the rows, as in their ABNAMESEQ key.
+        """
+        fields  = self.trnAsgnTable.fields
+        numrecs = len(rows)
+
+        # ------------ these fields just get used directly
+        converters = {}
+        for field in self.trnAsgnCopyFields:
+            # integer fields
+            if self.trnAsgnFields[field][0] in ['u','b']:
+                if field in ['TIME','DIST']:
+                    converters[field] = (_hundredthsOrZero, numpy.float64)
+                else:
+                    converters[field] = (_intOrZero, numpy.int64)
+            # float fields
+            elif self.trnAsgnFields[field][0] == 'f':
+                converters[field] = (_floatOrZero, numpy.float64)
+            # text fields
+            else:
+                converters[field] = (None, None)
+        try:
+            for field in self.trnAsgnCopyFields:
+                (convert, dtype) = converters[field]
+                fields[field] = _csvColumn(rows, self.colnameToCsvIndex[field], convert, dtype)
+        except:
+            # find the first bad one
+            for row in rows:
+                for field in self.trnAsgnCopyFields:
+                    if not converters[field][0]: continue
+                    try:
+                        converters[field][0](row[self.colnameToCsvIndex[field]])
+                    except:
+                        WranglerLogger.fatal("Error intepreting field %s: [%s]" % (field, str(self.colnameToCsvIndex[field])))
+                        WranglerLogger.fatal("row=%s" % str(row))
+                        WranglerLogger.fatal(sys.exc_info()[0])
+                        WranglerLogger.fatal(sys.exc_info()[1])                        
+                        sys.exit(2)
+            raise
+
+        # ------------ these fields come from the dbf because they're missing in the csv (sigh)
+        acol   = _csvColumn(rows, self.colnameToCsvIndex["A"], int, numpy.int64)
+        bcol   = _csvColumn(rows, self.colnameToCsvIndex["B"], int, numpy.int64)
+        numdbf = len(indbf.fields)
+        indbfRows = dbfRowNums < numdbf
+        dbfRowNums = numpy.where(indbfRows, dbfRowNums, 0)
+        if numdbf == 0: dbfRowNums = dbfRowNums[:0]
+        dbfA   = indbf.fields["A"][dbfRowNums]
+        dbfB   = indbf.fields["B"][dbfRowNums]
+        badA   = (acol < 100000) & (dbfA != acol)
+        badB   = (bcol < 100000) & (dbfB != bcol)
+        bad    = numpy.flatnonzero(~indbfRows | badA | badB)
+        if len(bad) > 0:
+            rownum = bad[0]
+            if not indbfRows[rownum]:
+                raise DataTableKeyError("Key %s does not exist" % str(dbfRowNums[rownum]))
+            if badA[rownum]:
+                raise NetworkException("Assertion error for A on row %d: %s != %s" % (dbfRowNums[rownum], str(dbfA[rownum]), str(rows[rownum][self.colnameToCsvIndex["A"]])))
+            raise NetworkException("Assertion error for B on row %d: %s != %s" % (dbfRowNums[rownum], str(dbfB[rownum]), str(rows[rownum][self.colnameToCsvIndex["B"]])))
+        fields["FREQ"] = indbf.fields["FREQ"][dbfRowNums]
+        fields["SEQ"]  = indbf.fields["SEQ"][dbfRowNums]
+
+        # ------------ special one-time computed fields
+        
+        # ABNameSeq is more complicated because we want it to be unique 
+        ABs            = [row[self.colnameToCsvIndex["A"]] + " " + row[self.colnameToCsvIndex["B"]] for row in rows]
+        ABNameSeqs     = []
+        ABNameSeqSet   = set()
+        ABNameSeq_List = []
+        for (rownum, trySeq) in enumerate(indbf.fields["SEQ"][dbfRowNums].tolist()):
+            ABNameSeq = ABs[rownum] + " " + linenames[rownum]
+            if trySeq>0:
+                tryABNameSeq = ABNameSeq + " " + str(trySeq)
+            
+                # This line seems to be a problem... A/B/NAME/SEQ are not unique
+                if tryABNameSeq in ABNameSeqSet:
+                    WranglerLogger.warn("Non-Unique A/B/Name/Seq: " + tryABNameSeq + "; faking SEQ!")
+                # Find one that works
+                while tryABNameSeq in ABNameSeqSet:
+                    trySeq += 1
+                    tryABNameSeq = ABNameSeq + " " + str(trySeq)
+                ABNameSeq = tryABNameSeq
+            ABNameSeqs.append(ABNameSeq)
+            ABNameSeqSet.add(ABNameSeq)
+            ABNameSeq_List.append((int(acol[rownum]), int(bcol[rownum]), linenames[rownum], trySeq))
+        fields["AB"]        = ABs
+        fields["ABNAMESEQ"] = ABNameSeqs
+                            
+        # ------------ straight lookup FULLNAME, VEHTYPE, VEHCAP; easy calc for PERIODCAP
+        fullnames  = {}
+        capacities = {}
+        for linename in linenames:
+            if linename in fullnames: continue
+            fullnames[linename] = self.capacity.getFullname(linename, self.timeperiod)
+            try:
+                capacities[linename] = self.capacity.getVehicleTypeAndCapacity(linename, self.timeperiod)[1]
+            except:
+                capacities[linename] = None
+
+            # if we still don't have a system, warn
+            if systems[linename][0] == "" and not warnline.has_key(linename):
+                WranglerLogger.warning("No default system: " + linename)
+                warnline[linename] =1
+
+        fields["SYSTEM"]   = [systems[linename][0] for linename in linenames]
+        fields["VEHTYPE"]  = [systems[linename][1] for linename in linenames]
+        fields["FULLNAME"] = [fullnames[linename] for linename in linenames]
+
+        hascap  = numpy.array([capacities[linename] is not None for linename in linenames], dtype=bool)
+        vehcaps = numpy.array([capacities[linename] or 0 for linename in linenames], dtype=numpy.float64)
+        fields["VEHCAP"] = vehcaps
+        fields["PERIODCAP"][hascap] = TransitLine.HOURS_PER_TIMEPERIOD[self.timeperiod] * 60.0 * vehcaps[hascap] / \
+                                      fields["FREQ"][hascap].astype(numpy.float64)
+
+        #---------add in any grouping that may want to use
+        fields["GROUP"] = [self.lineToGroup.get(linename, "") for linename in linenames]
+        
+        # initialize additive fields
+        for field in self.trnAsgnAdditiveFields:
+            fields[field] = _csvColumn(rows, self.colnameToCsvIndex[field], _floatOrZero, numpy.float64)
+        return ABNameSeq_List
+
+    def readAdditiveColumns(self, filename, mode):
+        """
+        Reads a subsequent transit assignment csv *filename* for *mode* with :py:meth:`readAssignmentCsv`.
+        Those only contribute their additive fields, so this returns just what's needed to add them in,
+        ``(acol, bcol, names, columns, messages)``:
+
+           * *acol* and *bcol* are numpy arrays of the A and B of the kept rows
+           * *names* are their line names
+           * *columns* is a list of (values, present) numpy arrays for each of the *trnAsgnAdditiveFields*,
+             where *present* is False for empty values
+           * *messages* are the links found for the *profileNode*
+        """
+        messages = []
+        rows     = self.readAssignmentCsv(filename, mode, messages=messages)[0]
+        acol     = _csvColumn(rows, self.colnameToCsvIndex["A"], int, numpy.int64)
+        bcol     = _csvColumn(rows, self.colnameToCsvIndex["B"], int, numpy.int64)
+        names    = _csvColumn(rows, self.colnameToCsvIndex["NAME"], string.rstrip)
+        columns  = []
+        for field in self.trnAsgnAdditiveFields:
+            texts = _csvColumn(rows, self.colnameToCsvIndex[field])
+            columns.append((numpy.fromiter(itertools.imap(_floatOrZero, texts), dtype=numpy.float64, count=len(texts)),
+                            numpy.fromiter((text != "" for text in texts), dtype=bool, count=len(texts))))
+        return (acol, bcol, names, columns, messages)
+
+    def readAdditiveCsvs(self, modes):
+        """
+        Generator that reads the transit assignment csvs for *modes* with :py:meth:`readAdditiveColumns`,
+        yielding ``(filename, mode, additiveColumns)`` in the order given.
+
+        If :py:attr:`TransitAssignmentData.readerProcesses` > 1, the csvs are read in a process pool.
+        """
+        filenamesAndModes = [(self.assignmentCsvFilename(mode), mode) for mode in modes]
+
+        if TransitAssignmentData.readerProcesses <= 1 or len(filenamesAndModes) <= 1:
+            for (filename, mode) in filenamesAndModes:
+                yield (filename, mode, self.readAdditiveColumns(filename, mode))
+            return
+
+        # the workers don't need the tables
+        reader = copy.copy(self)
+        reader.trnAsgnTable   = False
+        reader.aggregateTable = False
+        pool = multiprocessing.Pool(processes=min(TransitAssignmentData.readerProcesses, len(filenamesAndModes)))
+        try:
+            # imap keeps the order, so we can add each csv as soon as it (and those before it) are done
+            results = pool.imap(_readAdditiveColumns,
+                                [(reader, filename, mode) for (filename, mode) in filenamesAndModes])
+            for ((filename, mode), additiveColumns) in itertools.izip(filenamesAndModes, results):
+                yield (filename, mode, additiveColumns)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def buildAssignmentRowIndex(self, ABNameSeq_List):
+        """
+        Builds the integer index of the *trnAsgnTable* rows used by :py:meth:`addAssignmentColumns`,
+        from their (A,B,NAME,SEQ) as returned by :py:meth:`fillAssignmentTable`.  Each row is coded
+        by its (A, B, SEQ) and its line name, interned into a line id, so the rows of a subsequent csv
+        -- which share the (A, B, SEQ) of the first csv, row for row -- are joined with a binary search.
+
+        Returns ``(anodes, bnodes, seqs, abseqCodes, lineIds, sortedCodes, sortedRows)``.
+        """
+        numrecs = len(ABNameSeq_List)
+        anodes  = numpy.fromiter((abns[0] for abns in ABNameSeq_List), dtype=numpy.int64, count=numrecs)
+        bnodes  = numpy.fromiter((abns[1] for abns in ABNameSeq_List), dtype=numpy.int64, count=numrecs)
+        # the SEQ is only in the key if it's positive
+        seqs    = numpy.fromiter((max(abns[3], 0) for abns in ABNameSeq_List), dtype=numpy.int64, count=numrecs)
+        lineIds = {}
+        lines   = numpy.fromiter((lineIds.setdefault(abns[2], len(lineIds)) for abns in ABNameSeq_List),
+                                 dtype=numpy.int64, count=numrecs)
+
+        (uniqueA, uniqueB, uniqueSeq) = (numpy.unique(anodes), numpy.unique(bnodes), numpy.unique(seqs))
+        abcodes    = _codesIn(uniqueA, anodes)*len(uniqueB) + _codesIn(uniqueB, bnodes)
+        abseqCodes = _codesIn(numpy.unique(abcodes), abcodes)*len(uniqueSeq) + _codesIn(uniqueSeq, seqs)
+        abseqCodes = _codesIn(numpy.unique(abseqCodes), abseqCodes)
+        codes      = abseqCodes*max(len(lineIds), 1) + lines
+        order      = numpy.argsort(codes)
+        return (anodes, bnodes, seqs, abseqCodes, lineIds, codes[order], order)
+
+    def addAssignmentColumns(self, additiveColumns, rowIndex):
+        """
+        Adds the additive fields of a subsequent csv, as returned by :py:meth:`readAdditiveColumns`,
+        into the *trnAsgnTable*.  The rows have to line up with those of the first csv, which are indexed by
+        *rowIndex* (as returned by :py:meth:`buildAssignmentRowIndex`).
+        """
+        (acol, bcol, names, columns, messages) = additiveColumns
+        (anodes, bnodes, seqs, abseqCodes, lineIds, sortedCodes, sortedRows) = rowIndex
+        numrows = len(names)
+        assert(numrows <= len(anodes))
+        assert(numpy.array_equal(acol, anodes[:numrows]))
+        assert(numpy.array_equal(bcol, bnodes[:numrows]))
+        # the names don't nec match, can be *32 in ferry skim rather than the bart vehicle name, for example
+        (uniqueNames, nameIdx) = numpy.unique(numpy.array(names, dtype=str), return_inverse=True)
+        lines   = numpy.array([lineIds.get(name, -1) for name in uniqueNames.tolist()], dtype=numpy.int64)[nameIdx]
+        codes   = numpy.where(lines >= 0, abseqCodes[:numrows]*max(len(lineIds), 1) + lines, -1)
+        found   = _codesIn(sortedCodes, codes)
+        if numpy.any(found < 0):
+            rownum    = numpy.flatnonzero(found < 0)[0]
+            ABNameSeq = "%d %d %s" % (acol[rownum], bcol[rownum], names[rownum])
+            if seqs[rownum]>0:
+                ABNameSeq += " " + str(seqs[rownum])
+            raise DataTableKeyError("Key %s does not exist" % ABNameSeq)
+        rownums = sortedRows[found]
+
+        # the sums are done in double precision, as they would be for one row at a time
+        unique = len(numpy.unique(rownums)) == len(rownums)
+        for (field, (values, present)) in zip(self.trnAsgnAdditiveFields, columns):
+            column = self.trnAsgnTable.fields[field]
+            if unique:
+                column[rownums[present]] = column[rownums[present]].astype(numpy.float64) + values[present]
+            else:
+                for (rownum, value) in itertools.izip(rownums[present], values[present]):
+                    column[rownum] = float(column[rownum]) + value
         
     def buildAggregateTable(self):
-        # first find how big it is
-        ABSet = set()       
-        for row in self.trnAsgnTable:
-            ABSet.add(row["AB"])
+        """
+        Builds the link-level (key=A,B) *aggregateTable* from the line-level *trnAsgnTable*.
+        The links are in the order they first appear in the *trnAsgnTable*.
+
+        The sums are done with :py:func:`numpy.ufunc.at`, which adds one row at a time in row
+        order, so they're rounded the same way as adding up the rows in a loop would be.
+        """
+        fields = self.trnAsgnTable.fields
+
+        # find the links (in order of appearance) and which one each row is on
+        (ABs, firstRows, inverse) = numpy.unique(fields["AB"], return_index=True, return_inverse=True)
+        order   = numpy.argsort(firstRows, kind="mergesort")
+        linkIdx = numpy.empty(len(order), dtype=numpy.int64)
+        linkIdx[order] = numpy.arange(len(order))
+        linkIdx = linkIdx[inverse]
+        firstRows = firstRows[order]
         
-        self.aggregateTable = DataTable(numRecords=len(ABSet),
+        self.aggregateTable = DataTable(numRecords=len(ABs),
                                         fieldNames=self.aggregateFields.keys(),
                                         numpyFieldTypes=self.aggregateFields.values())
-        ABtoRowIndex = {}
-        rowsUsed = 0
-        for row in self.trnAsgnTable:
-            if row["AB"] not in ABtoRowIndex:
-                rowIndex = rowsUsed
-                self.aggregateTable[rowIndex]["AB"]     = row["AB"]
-                self.aggregateTable[rowIndex]["A"]      = row["A"]
-                self.aggregateTable[rowIndex]["B"]      = row["B"]
-                self.aggregateTable[rowIndex]["DIST"]   = row["DIST"]
-                self.aggregateTable[rowIndex]["FREQ"]       = 0.0
-                self.aggregateTable[rowIndex]["PERIODCAP"]  = 0.0
-                self.aggregateTable[rowIndex]["LOAD"]       = 0.0
-                self.aggregateTable[rowIndex]["MAXLOAD"]    = 0.0
-                for field in self.trnAsgnAdditiveFields:    # sum
-                    self.aggregateTable[rowIndex][field] = 0.0
-                ABtoRowIndex[row["AB"]] = rowsUsed
-                rowsUsed += 1
+        aggregate = self.aggregateTable.fields
+        for field in ["AB", "A", "B", "DIST"]:
+            aggregate[field] = fields[field][firstRows]
+
+        for field in self.trnAsgnAdditiveFields:    # sum
+            if field in ["AB_VOL", "BA_VOL"]:
+                # these get added twice for each row
+                numpy.add.at(aggregate[field], numpy.repeat(linkIdx, 2), numpy.repeat(fields[field], 2))
             else:
-                rowIndex = ABtoRowIndex[row["AB"]]
-            
-            for field in self.trnAsgnAdditiveFields:    # sum
-                self.aggregateTable[rowIndex][field] += row[field]
-            self.aggregateTable[rowIndex]["AB_VOL"] += row["AB_VOL"]
-            self.aggregateTable[rowIndex]["BA_VOL"] += row["BA_VOL"]
-            self.aggregateTable[rowIndex]["PERIODCAP"] += row["PERIODCAP"]
-            self.aggregateTable[rowIndex]["MAXLOAD"] = max(row["LOAD"], self.aggregateTable[rowIndex]["MAXLOAD"])
-            self.aggregateTable[rowIndex]["FREQ"] += 1/row["FREQ"]  # combining -- will take reciprocal later
+                numpy.add.at(aggregate[field], linkIdx, fields[field])
+        numpy.add.at(aggregate["PERIODCAP"], linkIdx, fields["PERIODCAP"])
+        numpy.add.at(aggregate["FREQ"], linkIdx, 1.0/fields["FREQ"].astype(numpy.float64))  # combining -- will take reciprocal later
+
+        # max load of any line on the link (but at least zero)
+        loads = fields["LOAD"]
+        if numpy.isnan(loads).any():
+            for (rowIndex, load) in itertools.izip(linkIdx, loads):
+                aggregate[rowIndex]["MAXLOAD"] = max(load, aggregate[rowIndex]["MAXLOAD"])
+        else:
+            numpy.maximum.at(aggregate["MAXLOAD"], linkIdx, loads)
+            # a zero load (of either sign) replaces the maximum, if that's zero
+            zeroRows = numpy.flatnonzero(loads == 0)
+            lastZero = numpy.zeros(len(ABs), dtype=numpy.int64) - 1
+            lastZero[linkIdx[zeroRows]] = zeroRows
+            zeroLinks = numpy.flatnonzero((aggregate["MAXLOAD"] == 0) & (lastZero >= 0))
+            aggregate["MAXLOAD"][zeroLinks] = loads[lastZero[zeroLinks]]
         
         self.aggregateTable.setIndex(fieldName="AB")
 
-        count=0
-        for row in self.aggregateTable:
-            count += 1
-            if row["FREQ"]>0: 
-                row["FREQ"] = 1/row["FREQ"]
-            if row["PERIODCAP"]>0:
-                row["LOAD"] = float(row["AB_VOL"]) / row["PERIODCAP"]
-                # print row["LOAD"]
-        WranglerLogger.debug("count "+str(count)+" lines in aggregate table")
+        freq = aggregate["FREQ"] > 0
+        aggregate["FREQ"][freq] = 1.0/aggregate["FREQ"][freq].astype(numpy.float64)
+        hascap = aggregate["PERIODCAP"] > 0
+        aggregate["LOAD"][hascap] = aggregate["AB_VOL"][hascap].astype(numpy.float64) / aggregate["PERIODCAP"][hascap]
+        WranglerLogger.debug("count "+str(len(aggregate))+" lines in aggregate table")
 
     def calculateFleetCharacteristics(self):
         """ Calculates the fleet characteristics - vehicle hours and vehicle miles - by vehicle type
@@ -589,6 +817,8 @@ class TransitAssignmentData:
 
         # this is the index!
         self.trnAsgnTable.setIndex(fieldName="ABNAMESEQ")
+        self.linkColumns = _linkColumnsFromKeys(self.trnAsgnTable.fields["ABNAMESEQ"].tolist())
+        self.buildLinkIndex()
 
         # the link-level aggregate table
         if not aggregateFileName:
@@ -700,6 +930,98 @@ class TransitAssignmentData:
              )
         self.aggregateTable.writeAsDbf(aggregateFileName)
     
+    def linkKey(self, linename, a, b, seq):
+        """ Returns the trnAsgnTable key (ABNAMESEQ) for the given line link; see :py:meth:`numBoards`
+        """
+        return "%d %d %s %d" % (a, b, linename.upper(), seq)
+
+    def buildLinkIndex(self):
+        """ Builds the integer index used by :py:meth:`lookupLinkRows` from the :py:attr:`linkColumns`
+            of the trnAsgnTable rows whose keys :py:meth:`linkKey` can make.  Their line names are
+            interned into :py:attr:`lineIds`.  (A, B) and (line id, SEQ) are each coded as the position
+            of the pair among the sorted unique pairs, and those two codes are combined into one, so the
+            index is a sorted array of int64 codes whatever the range of the node numbers.
+        """
+        (anodes, bnodes, linenames, seqs, hasSeqs) = self.linkColumns
+        # only the keys that linkKey() can make
+        rows = numpy.flatnonzero(hasSeqs &
+                                 numpy.fromiter((linename == linename.upper() for linename in linenames),
+                                                dtype=bool, count=len(linenames)))
+        #: line name => line id, for the lines in the trnAsgnTable keys
+        self.lineIds = {}
+        lines   = numpy.fromiter((self.lineIds.setdefault(linename, len(self.lineIds)) for linename in linenames[rows]),
+                                 dtype=numpy.int64, count=len(rows))
+        avalues = anodes[rows]
+        bvalues = bnodes[rows]
+        seqs    = seqs[rows]
+        self._linkA   = numpy.unique(avalues)
+        self._linkB   = numpy.unique(bvalues)
+        self._linkSeq = numpy.unique(seqs)
+        abcodes = _codesIn(self._linkA, avalues)*len(self._linkB) + _codesIn(self._linkB, bvalues)
+        lscodes = lines*len(self._linkSeq) + _codesIn(self._linkSeq, seqs)
+        self._linkAB = numpy.unique(abcodes)
+        self._linkLS = numpy.unique(lscodes)
+        codes = _codesIn(self._linkAB, abcodes)*len(self._linkLS) + _codesIn(self._linkLS, lscodes)
+        order = numpy.argsort(codes)
+        self._linkCodes = codes[order]
+        self._linkRows  = rows[order]
+
+    def lookupLinkRows(self, linenames, anodes, bnodes, seqs):
+        """ Batch version of the key lookups done by :py:meth:`numBoards`, :py:meth:`numExits`, etc.,
+            for the line links given by the lists *linenames*, *anodes*, *bnodes* and *seqs* (as for :py:meth:`linkKey`).
+            Returns a numpy array with the trnAsgnTable row number for each, or -1 where it
+            isn't in the table.  See :py:meth:`buildLinkIndex`.
+        """
+        if len(linenames) == 0 or len(self._linkRows) == 0:
+            return numpy.zeros(len(linenames), dtype=numpy.int64) - 1
+
+        lines   = numpy.array([self.lineIds.get(linename.upper(), -1) for linename in linenames], dtype=numpy.int64)
+        abcodes = _pairCodesIn(self._linkAB, _codesIn(self._linkA, anodes), _codesIn(self._linkB, bnodes), len(self._linkB))
+        lscodes = _pairCodesIn(self._linkLS, lines, _codesIn(self._linkSeq, seqs), len(self._linkSeq))
+        found   = _pairCodesIn(self._linkCodes, abcodes, lscodes, len(self._linkLS))
+        return numpy.where(found >= 0, self._linkRows[numpy.maximum(found, 0)], -1)
+
+    def lookupLink(self, field, linename, a, b, seq, message):
+        """ Returns the trnAsgnTable *field* for one line link, with :py:meth:`lookupLinkRows`.
+            Throws an exception with *message* (formatted with the :py:meth:`linkKey`) if it isn't in the table.
+        """
+        row = self.lookupLinkRows([linename], [a], [b], [seq])[0]
+        if row < 0:
+            raise TransitAssignmentDataException(message % self.linkKey(linename, a, b, seq))
+        return self.trnAsgnTable.fields[field][row]
+
+    def lookupMany(self, field, linenames, anodes, bnodes, seqs, missing=None):
+        """ Returns a numpy array of the trnAsgnTable *field* for each of the line links given by the lists
+            *linenames*, *anodes*, *bnodes* and *seqs* (see :py:meth:`lookupLinkRows`).
+            Throws an exception for the first one that isn't in the table, unless *missing* is passed,
+            in which case that's the value for them.
+        """
+        rows = self.lookupLinkRows(linenames, anodes, bnodes, seqs)
+        if missing is None and numpy.any(rows < 0):
+            idx = numpy.flatnonzero(rows < 0)[0]
+            raise TransitAssignmentDataException("key [%s] not found in transit assignment data" %
+                                                 self.linkKey(linenames[idx], anodes[idx], bnodes[idx], seqs[idx]))
+        if len(rows) == 0:
+            return numpy.zeros(0, dtype=self.trnAsgnTable.fields.dtype[field])
+        values = self.trnAsgnTable.fields[field][numpy.maximum(rows, 0)]
+        if missing is None: return values
+        return numpy.where(rows >= 0, values, missing)
+
+    def numBoardsMany(self, linenames, nodenums, nodenums_next, seqs, missing=None):
+        """ Batch version of :py:meth:`numBoards`; see :py:meth:`lookupMany`.
+        """
+        return self.lookupMany("AB_BRDA", linenames, nodenums, nodenums_next, seqs, missing)
+
+    def numExitsMany(self, linenames, nodenums_prev, nodenums, seqs, missing=None):
+        """ Batch version of :py:meth:`numExits`; see :py:meth:`lookupMany`.
+        """
+        return self.lookupMany("AB_XITB", linenames, nodenums_prev, nodenums, seqs, missing)
+
+    def loadFactorMany(self, linenames, anodes, bnodes, seqs, missing=None):
+        """ Batch version of :py:meth:`loadFactor`; see :py:meth:`lookupMany`.
+        """
+        return self.lookupMany("LOAD", linenames, anodes, bnodes, seqs, missing)
+
     def numBoards(self, linename, nodenum, nodenum_next, seq):
         """ linename is something like MUN30I; it includes the direction.
             nodenum is the node in question, nodenum_next is the next node in the line file
@@ -708,18 +1030,14 @@ class TransitAssignmentData:
             Returns an int representing number of boards in the whole time period.
             Throws an exception if linename isnt recognized or if nodenum is not part of the line.
         """
-        key = "%d %d %s %d" % (nodenum, nodenum_next, linename.upper(), seq)
-        if key in self.trnAsgnTable:
-            return self.trnAsgnTable[key]["AB_BRDA"]
-        raise TransitAssignmentDataException("key [%s] not found in transit assignment data" % key)
+        return self.lookupLink("AB_BRDA", linename, nodenum, nodenum_next, seq,
+                               "key [%s] not found in transit assignment data")
     
     def numExits(self, linename, nodenum_prev, nodenum, seq):
         """ See numBoards
         """
-        key = "%d %d %s %d" % (nodenum_prev, nodenum, linename.upper(), seq)
-        if key in self.trnAsgnTable:
-            return self.trnAsgnTable[key]["AB_XITB"]
-        raise TransitAssignmentDataException("key [%s] not found in transit assignment data" % key)
+        return self.lookupLink("AB_XITB", linename, nodenum_prev, nodenum, seq,
+                               "key [%s] not found in transit assignment data")
     
     def loadFactor(self, linename, a,b, seq):
         """ Returns a fraction: peak hour pax per vehicle / vehicle capacity
@@ -729,50 +1047,156 @@ class TransitAssignmentData:
             the simple peak hour factors that quickboards uses but this could be refined
             in the future.
         """
-        key = "%d %d %s %d" % (a, b, linename.upper(), seq)
-        if key not in self.trnAsgnTable:
-            raise TransitAssignmentDataException("Key [%s] not found in transit assignment data" % key)
-        return self.trnAsgnTable[key]["LOAD"]
+        return self.lookupLink("LOAD", linename, a, b, seq, "Key [%s] not found in transit assignment data")
     
     def linkVolume(self,linename,a,b,seq):
         """Return number of people on a given link a b"""
-        key = "%d %d %s %d" % (a, b, linename.upper(), seq)
-        if key not in self.trnAsgnTable:
-            raise TransitAssignmentDataException("Key [%s] not found in transit assignment data" % key)
-        return self.trnAsgnTable[key]["AB_VOL"]
+        return self.lookupLink("AB_VOL", linename, a, b, seq, "Key [%s] not found in transit assignment data")
     
     def linkTime(self,linename,a,b,seq): 
         """Return time in minutes on a given link a b"""
-        key = "%d %d %s %d" % (a, b, linename.upper(), seq)
-        if key not in self.trnAsgnTable:
-            raise TransitAssignmentDataException("Key [%s] not found in transit assignment data" % key)
-        return self.trnAsgnTable[key]["TIME"]
+        return self.lookupLink("TIME", linename, a, b, seq, "Key [%s] not found in transit assignment data")
 
     
     def linkDistance(self,linename,a,b,seq):
         """Return distance in miles on a given link a b"""
-        key = "%d %d %s %d" % (a, b, linename.upper(), seq)
-        if key not in self.trnAsgnTable:
-            raise TransitAssignmentDataException("Key [%s] not found in transit assignment data" % key)
-        return self.trnAsgnTable[key]["DIST"]
+        return self.lookupLink("DIST", linename, a, b, seq, "Key [%s] not found in transit assignment data")
         
 
-# Not complete.... TODO if it makes sense....
-class DailyTransitAssignmentData:
+class MultiPeriodTransitAssignmentData:
+    """
+    The :py:class:`TransitAssignmentData` for several time periods, read in one go, along with an
+    index of the line-level rows (key=A,B,NAME,SEQ) across all of them.
+    """
+
+    TIMEPERIODS = ["AM", "MD", "PM", "EV", "EA"]
+
+    def __init__(self, directory=".", timeperiods=TIMEPERIODS, transitCapacity=None, grouping=None,
+                 periodData=None, **kwargs):
+        """
+           * *directory*, *transitCapacity*, *grouping* and the keyword args are as for
+             :py:class:`TransitAssignmentData`, but the transit capacity and the groupings are
+             read once and shared by all of the *timeperiods*.
+           * pass *periodData*, a dict of timeperiod => :py:class:`TransitAssignmentData`, to index
+             those instead of reading them.  The *timeperiods* that aren't in it are skipped.
+        """
+        if periodData:
+            self.timeperiods = [timeperiod for timeperiod in timeperiods if periodData.get(timeperiod)]
+        else:
+            self.timeperiods = list(timeperiods)
+            periodData = {}
+            if not transitCapacity: transitCapacity = TransitCapacity()
+            for timeperiod in self.timeperiods:
+                periodData[timeperiod] = TransitAssignmentData(directory=directory, timeperiod=timeperiod,
+                                                               transitCapacity=transitCapacity,
+                                                               grouping=grouping, **kwargs)
+                grouping = periodData[timeperiod].lineToGroup
+        self.periodData = periodData
+
+        # the keys of all the time periods, in the order they're first seen
+        periodKeys = [self.periodData[timeperiod].trnAsgnTable.fields["ABNAMESEQ"] for timeperiod in self.timeperiods]
+        (keys, firstIdx, inverse) = numpy.unique(numpy.concatenate(periodKeys), return_index=True, return_inverse=True)
+        order = numpy.argsort(firstIdx, kind="mergesort")
+        keyIdx = numpy.empty(len(order), dtype=numpy.int64)
+        keyIdx[order] = numpy.arange(len(order))
+
+        #: numpy array of the keys
+        self.keys = keys[order]
+        #: key => row in :py:attr:`keys`
+        self.keyToRow = dict(itertools.izip(self.keys.tolist(), itertools.count()))
+        #: numpy array of the row of each key (row) in each time period's *trnAsgnTable* (column), or -1
+        self.periodRows = numpy.empty((len(self.keys), len(self.timeperiods)), dtype=numpy.int64)
+        self.periodRows.fill(-1)
+        offset = 0
+        for (periodIdx, timeperiodKeys) in enumerate(periodKeys):
+            self.periodRows[keyIdx[inverse[offset:offset+len(timeperiodKeys)]], periodIdx] = numpy.arange(len(timeperiodKeys))
+            offset += len(timeperiodKeys)
+
+    def __getitem__(self, timeperiod):
+        """
+        Returns the :py:class:`TransitAssignmentData` for *timeperiod*.
+        """
+        return self.periodData[timeperiod]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def fieldByPeriod(self, field, missing=0.0):
+        """
+        Returns a numpy array of the *trnAsgnTable* *field* for each key (row) in each time period
+        (column), with *missing* where the time period doesn't have that key.
+        """
+        values = numpy.empty(self.periodRows.shape, dtype=numpy.float64)
+        values.fill(missing)
+        for (periodIdx, timeperiod) in enumerate(self.timeperiods):
+            rows = self.periodRows[:,periodIdx]
+            values[rows>=0, periodIdx] = self.periodData[timeperiod].trnAsgnTable.fields[field][rows[rows>=0]]
+        return values
+
+    def daily(self):
+        """
+        Returns the :py:class:`DailyTransitAssignmentData` summed over the time periods.
+        """
+        return DailyTransitAssignmentData(byPeriod=self)
+
+
+class DailyTransitAssignmentData(TransitAssignmentData):
     
-    def __init__(self, tadAM, tadMD, tadPM, tadEV, tadEA):
+    def __init__(self, tadAM=None, tadMD=None, tadPM=None, tadEV=None, tadEA=None, byPeriod=None):
         """
-        For aggregating into a single version!
+        For aggregating into a single version!  Pass the :py:class:`TransitAssignmentData` for each
+        time period, or a :py:class:`MultiPeriodTransitAssignmentData` *byPeriod*.
+
+        The line-level rows (key=A,B,NAME,SEQ) are those of all the time periods.  The additive
+        fields and PERIODCAP of each are summed over the time periods, and its LOAD is AB_VOL/PERIODCAP;
+        the other fields are from the first time period that has the row.
         """
-        keys = set(tadAM.trnAsgnTable._index.keys())
-        keys = keys.union(tadMD.trnAsgnTable._index.keys())
-        keys = keys.union(tadPM.trnAsgnTable._index.keys())
-        keys = keys.union(tadEV.trnAsgnTable._index.keys())
-        keys = keys.union(tadEA.trnAsgnTable._index.keys())
+        if not byPeriod:
+            byPeriod = MultiPeriodTransitAssignmentData(periodData={"AM":tadAM, "MD":tadMD, "PM":tadPM,
+                                                                    "EV":tadEV, "EA":tadEA})
+        self.byPeriod = byPeriod
+        first = byPeriod[byPeriod.timeperiods[0]]
+
+        self.timeperiod     = None
+        self.timeperiods    = byPeriod.timeperiods
+        self.capacity       = first.capacity
+        self.lineToGroup    = first.lineToGroup
+        self.csvColnames    = first.csvColnames
+        self.trnAsgnFields         = first.trnAsgnFields
+        self.trnAsgnCopyFields     = first.trnAsgnCopyFields
+        self.trnAsgnAdditiveFields = first.trnAsgnAdditiveFields
+        self.aggregateFields       = first.aggregateFields
+
+        dtype = first.trnAsgnTable.fields.dtype
+        self.trnAsgnTable = DataTable(numRecords=len(byPeriod),
+                                      fieldNames=list(dtype.names),
+                                      numpyFieldTypes=[dtype[name] for name in dtype.names])
+        fields = self.trnAsgnTable.fields
+        self.linkColumns = (numpy.zeros(len(byPeriod), dtype=numpy.int64), numpy.zeros(len(byPeriod), dtype=numpy.int64),
+                            numpy.empty(len(byPeriod), dtype=object),      numpy.zeros(len(byPeriod), dtype=numpy.int64),
+                            numpy.zeros(len(byPeriod), dtype=bool))
+        firstPeriodIdx = numpy.argmax(byPeriod.periodRows >= 0, axis=1)
+        for (periodIdx, timeperiod) in enumerate(self.timeperiods):
+            rows = firstPeriodIdx == periodIdx
+            periodFields = byPeriod[timeperiod].trnAsgnTable.fields[byPeriod.periodRows[rows, periodIdx]]
+            for name in dtype.names:
+                fields[name][rows] = periodFields[name]
+            for (column, periodColumn) in zip(self.linkColumns, byPeriod[timeperiod].linkColumns):
+                column[rows] = periodColumn[byPeriod.periodRows[rows, periodIdx]]
+
+        for field in self.trnAsgnAdditiveFields + ["PERIODCAP"]:
+            fields[field] = byPeriod.fieldByPeriod(field).sum(axis=1)
+        fields["LOAD"] = 0.0
+        hascap = fields["PERIODCAP"] > 0
+        fields["LOAD"][hascap] = fields["AB_VOL"][hascap].astype(numpy.float64) / fields["PERIODCAP"][hascap]
+        self.trnAsgnTable.setIndex(fieldName="ABNAMESEQ")
+        self.buildLinkIndex()
 
-        # self.trnAsgnTable = DataTable(numRecords=numrecs,
-        #                              fieldNames=self.trnAsgnFields.keys(),
-        #                              numpyFieldTypes=self.trnAsgnFields.values())
+        # build the aggregate table for key="A B"
+        self.aggregateAll   = all([byPeriod[timeperiod].aggregateAll for timeperiod in self.timeperiods])
+        self.aggregateTable = False
+        if self.aggregateAll:
+            self.buildAggregateTable()
 
 
 if __name__ == '__main__':
@@ -14,6 +14,7 @@
 # limitations under the License.
 
 import copy,csv,os,re,string
+from .Logger import WranglerLogger
 from .NetworkException import NetworkException
 
 __all__ = ['TransitCapacity']
@@ -54,6 +55,10 @@ class TransitCapacity:
         self.linenameToAttributes   = {}
         self.linenameToSimple       = {}
         self.prefixToVehicleType    = {}
+        # (linename, timeperiod) -> (system, vehicletype, capacity, delays); see resolveLine()
+        self.lineTable              = {}
+        # linename -> full name; see compileLine()
+        self.lineFullnames          = {}
 
         self.readTransitLineToVehicle(directory, filename=transitLineToVehicle)
         self.readTransitVehicleToCapacity(directory, filename=transitVehicleToCapacity)
@@ -90,6 +95,7 @@ class TransitCapacity:
             
         # print "vehicleTypeToCapacity = " + str(self.vehicleTypeToCapacity)
         # print "vehicleTypeToDelays = " + str(self.vehicleTypeToDelays)
+        self.invalidateLineTable()
 
     def writeTransitVehicleToCapacity(self, directory=".", filename="transitVehicleToCapacity.csv"):
         """
@@ -124,6 +130,7 @@ class TransitCapacity:
             self.linenameToAttributes[name] = [system, fullLineName, vehicleTypeAM,vehicleTypePM,vehicleTypeOP]
             self.linenameToSimple[name] = [stripped, simplename]
         # print "linenameToAttributes = " + str(self.linenameToAttributes)
+        self.invalidateLineTable()
 
     def writeTransitLineToVehicle(self, directory=".", filename="transitLineToVehicle.csv"):
         """
@@ -150,6 +157,7 @@ class TransitCapacity:
         p2vReader = csv.reader(open(os.path.join(directory,filename)))
         for prefix, system, vehicleType in p2vReader:
             self.prefixToVehicleType[prefix] = [system, vehicleType]
+        self.invalidateLineTable()
 
     def writeTransitPrefixToVehicle(self, directory=".", filename="transitPrefixToVehicle.csv"):
         """
@@ -163,10 +171,78 @@ class TransitCapacity:
             f.write(self.prefixToVehicleType[prefix][1] + "\n")   # vehicleType
         f.close()
         
+    def invalidateLineTable(self):
+        """
+        Forgets the resolved lines in :py:attr:`lineTable` and :py:attr:`lineFullnames`.  The methods
+        that change the mappings call this; call it yourself after changing them directly.
+        """
+        self.lineTable     = {}
+        self.lineFullnames = {}
+
+    def resolveLine(self, linename, timeperiod):
+        """
+        Returns (system, vehicletype, capacity, delays) for *linename* in *timeperiod*, where
+        *capacity* is from :py:attr:`vehicleTypeToCapacity` and *delays* is the list from
+        :py:attr:`vehicleTypeToDelays`, or None if the vehicle type isn't in them.
+        The line is resolved for all the time periods at once (see :py:meth:`compileLine`) and kept in
+        :py:attr:`lineTable`, so that the next lookup, for any time period, is a dictionary hit.
+        """
+        key = (linename, timeperiod)
+        if key in self.lineTable: return self.lineTable[key]
+        if linename not in self.lineFullnames:
+            self.compileLine(linename)
+            if key in self.lineTable: return self.lineTable[key]
+
+        # not one of the TIMEPERIOD_TO_VEHTYPIDX time periods
+        self.lineTable[key] = self.lineEntry(*self.findSystemAndVehicleType(linename, timeperiod))
+        return self.lineTable[key]
+
+    def lineEntry(self, system, vehicleType):
+        """
+        Returns the :py:attr:`lineTable` entry (system, vehicletype, capacity, delays) for *vehicleType*.
+        """
+        return (system, vehicleType,
+                self.vehicleTypeToCapacity.get(vehicleType),
+                self.vehicleTypeToDelays.get(vehicleType))
+
+    def compileLine(self, linename):
+        """
+        Resolves *linename* for each of the time periods into :py:attr:`lineTable`, and its full name
+        into :py:attr:`lineFullnames`, looking it up in the mappings only once.
+        """
+        attributes = self.linenameToAttributes.get(linename.upper())
+        if attributes:
+            self.lineFullnames[linename] = attributes[TransitCapacity.ATTR_FULLNAME]
+            for (timeperiod, vehtypidx) in TransitCapacity.TIMEPERIOD_TO_VEHTYPIDX.iteritems():
+                self.lineTable[(linename, timeperiod)] = self.lineEntry(attributes[TransitCapacity.ATTR_SYSTEM],
+                                                                        attributes[vehtypidx])
+            return
+
+        # the prefixes are the same for every time period
+        self.lineFullnames[linename] = ""
+        entry = self.lineEntry(*self.findSystemAndVehicleType(linename, None))
+        for timeperiod in TransitCapacity.TIMEPERIOD_TO_VEHTYPIDX.keys():
+            self.lineTable[(linename, timeperiod)] = entry
+
+    def compileLineTable(self, linenames, timeperiods=TIMEPERIOD_TO_VEHTYPIDX.keys()):
+        """
+        Resolves all of the given *linenames* for all the given *timeperiods* into :py:attr:`lineTable`
+        in one go.  See :py:meth:`resolveLine`.
+        """
+        for linename in linenames:
+            for timeperiod in timeperiods:
+                self.resolveLine(linename, timeperiod)
+
     def getSystemAndVehicleType(self, linename, timeperiod):
         """
         Convenience function.  Returns tuple: best guess of (system, vehicletype)
         """
+        return self.resolveLine(linename, timeperiod)[:2]
+
+    def findSystemAndVehicleType(self, linename, timeperiod):
+        """
+        Does the work for :py:meth:`getSystemAndVehicleType`, without :py:attr:`lineTable`.
+        """
         linenameU = linename.upper()
         if self.linenameToAttributes.has_key(linenameU):
             return (self.linenameToAttributes[linenameU][TransitCapacity.ATTR_SYSTEM], 
@@ -184,51 +260,49 @@ class TransitCapacity:
     def getVehicleTypeAndCapacity(self, linename, timeperiod):
         """ returns (vehicletype, vehiclecapacity)
         """        
-        (system, vehicleType) = self.getSystemAndVehicleType(linename, timeperiod)
+        (system, vehicleType, capacity, delays) = self.resolveLine(linename, timeperiod)
         
-        if vehicleType not in self.vehicleTypeToCapacity:
+        if capacity is None:
             raise NetworkException("Vehicle type [%s] of system [%s] characteristics unknown; line name = [%s]" % (vehicleType, system, linename.upper()))
 
-        capacity = self.vehicleTypeToCapacity[vehicleType]
         return (vehicleType, capacity)
 
     def getFullname(self, linename, timeperiod):
         """
         Returns best guess of fullname, or empty string if unknown
         """
-        linenameU = linename.upper()
-        if self.linenameToAttributes.has_key(linenameU):
-            return self.linenameToAttributes[linenameU][TransitCapacity.ATTR_FULLNAME]
-        else:
-            return ""
+        if linename not in self.lineFullnames:
+            self.compileLine(linename)
+        return self.lineFullnames[linename]
 
     def getSimpleDwell(self, linename, timeperiod):
         """
         Returns a number
         """
-        (system, vehicleType) = self.getSystemAndVehicleType(linename, timeperiod)
-        if vehicleType not in self.vehicleTypeToDelays:
+        (system, vehicleType, capacity, delays) = self.resolveLine(linename, timeperiod)
+        if delays is None:
             raise NetworkException("Vehicle type [%s] of system [%s] simple dwell unknown; line name = [%s]" % (vehicleType, system, linename.upper()))
 
-        return self.vehicleTypeToDelays[vehicleType][TransitCapacity.DELAY_SIMPLE]
+        return delays[TransitCapacity.DELAY_SIMPLE]
 
     def getComplexDwells(self, linename, timeperiod):
         """
         Returns (constant, perboard, peralight), all three are numbers
         """
-        (system, vehicleType) = self.getSystemAndVehicleType(linename, timeperiod)
-        if vehicleType not in self.vehicleTypeToDelays:
+        (system, vehicleType, capacity, delays) = self.resolveLine(linename, timeperiod)
+        if delays is None:
             raise NetworkException("Vehicle type [%s] of system [%s] complex dwell unknown; line name = [%s]" % (vehicleType, system, linename.upper()))
 
-        return (self.vehicleTypeToDelays[vehicleType][TransitCapacity.DELAY_CONST],
-                self.vehicleTypeToDelays[vehicleType][TransitCapacity.DELAY_PERBOARD],
-                self.vehicleTypeToDelays[vehicleType][TransitCapacity.DELAY_PERALIGHT])        
+        return (delays[TransitCapacity.DELAY_CONST],
+                delays[TransitCapacity.DELAY_PERBOARD],
+                delays[TransitCapacity.DELAY_PERALIGHT])        
 
     def addVehicleType(self, newVehicleType, newVehicleCapacity):
         """
         Self explanatory
         """
         self.vehicleTypeToCapacity[newVehicleType] = newVehicleCapacity
+        self.invalidateLineTable()
 
     def addLinenameFromTemplate(self, newLine, templateLine):
         """
@@ -239,6 +313,7 @@ class TransitCapacity:
 
         self.linenameToAttributes[newLine] = copy.deepcopy(self.linenameToAttributes[templateLine])
         self.linenameToSimple[newLine]     = copy.deepcopy(self.linenameToSimple[templateLine])
+        self.invalidateLineTable()
 
     def addLineName(self, newLine, system, fullname, vehicletype_AM, vehicletype_PM, vehicletype_OP):
         """
@@ -246,6 +321,7 @@ class TransitCapacity:
         """
         self.linenameToAttributes[newLine] = [system, fullname, vehicletype_AM, vehicletype_PM, vehicletype_OP]
         self.linenameToSimple[newLine]     = [fullname, fullname]
+        self.invalidateLineTable()
 
     def setAllVehicleTypes(self, linename, vehicleType, lineNameIsRegex = False):
         """
@@ -285,4 +361,6 @@ class TransitCapacity:
             self.linenameToAttributes[linename.upper()][TransitCapacity.ATTR_AMVEHTYPE] = vehicleType_AM
             self.linenameToAttributes[linename.upper()][TransitCapacity.ATTR_PMVEHTYPE] = vehicleType_PM
             self.linenameToAttributes[linename.upper()][TransitCapacity.ATTR_OPVEHTYPE] = vehicleType_OP
+
+        self.invalidateLineTable()
     
\ No newline at end of file
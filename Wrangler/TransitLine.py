@@ -16,6 +16,7 @@
 import copy
 from .NetworkException import NetworkException
 from .Node import Node
+from .NodeSequence import NodeSequence, sequenceMatches
 from .Logger import WranglerLogger
 
 __all__ = ['TransitLine']
@@ -23,7 +24,8 @@ __all__ = ['TransitLine']
 class TransitLine(object):
     """
     Transit route. Behaves like a dictionary of attributes.
-    *n* is list of Node objects (see :py:class:`Node`)
+    *n* is list of Node objects (see :py:class:`Node`), or a columnar :py:class:`NodeSequence`
+    that behaves like one (see :py:meth:`TransitLine.compactNodes`)
     All other attributes are stored as a dictionary. e.g.::
 
         thisroute['MODE']='5'
@@ -68,19 +70,35 @@ class TransitLine(object):
                             31:True,  # Ferry
                             32:True   # BART
                             }
+
+    # Bumped whenever a line is renamed, so that a TransitNetwork knows to redo its line name index
+    renameCount = 0
+
+    # Bumped (per line) whenever the methods below edit the line's nodes, so that a TransitNetwork
+    # knows to redo the line in its node index
+    nodeEdits = 0
     
     def __init__(self, name=None, template=None):
         self.attr = {}
         self.n = []
         self.comment = None
 
-        self.name = name
+        self._name = name
         if name and name.find('"')==0:
-            self.name = name[1:-1]  # Strip leading/trailing dbl-quotes
+            self._name = name[1:-1]  # Strip leading/trailing dbl-quotes
 
         if template:
             self._applyTemplate(template)
 
+    def _getName(self):
+        return self._name
+
+    def _setName(self, name):
+        self._name = name
+        TransitLine.renameCount += 1
+
+    name = property(_getName, _setName)
+
     def __iter__(self):
         """
         Iterator for looping through stops
@@ -242,8 +260,9 @@ class TransitLine(object):
         Returns True if the given *nodeNumber* is a node in this line (stop or no).
         *nodeNumber* should be an integer.
         """
+        if isinstance(self.n, NodeSequence): return self.n.hasNode(nodeNumber)
         for node in self.n:
-            if abs(int(node.num)) == abs(nodeNumber):
+            if node.number == abs(nodeNumber):
                 return True
         return False
                 
@@ -253,9 +272,10 @@ class TransitLine(object):
         *nodeA* and *nodeB* should be integers and this method is stop-insensitive.
         However, it does not check for *(nodeB,nodeA)* even when the line is two-way.
         """
+        if isinstance(self.n, NodeSequence): return self.n.hasLink(nodeA,nodeB)
         nodeNumPrev = -1
         for node in self.n:
-            nodeNum = abs(int(node.num))
+            nodeNum = node.number
             if nodeNum == abs(nodeB) and nodeNumPrev == abs(nodeA):
                 return True
             nodeNumPrev = nodeNum
@@ -269,7 +289,7 @@ class TransitLine(object):
         """
         hasA=False
         for node in self.n:
-            nodeNum = abs(int(node.num))
+            nodeNum = node.number
             if nodeNum == abs(nodeA):
                 hasA=True
             elif nodeNum == abs(nodeB):
@@ -283,17 +303,25 @@ class TransitLine(object):
         This method is stop-insenstive.
         list_of_node_ids should be a list of positive integers, ordered by transit line path.
         """
-        node_ids = self.listNodeIds()
-        for i in range(len(node_ids)):
-            if node_ids[i:i+len(list_of_node_ids)] == list_of_node_ids:
-                return True
+        if isinstance(self.n, NodeSequence): return len(self.n.findSequence(list_of_node_ids)) > 0
+        for start in sequenceMatches(self.listNodeIds(), list_of_node_ids):
+            return True
         return False
 
+    def findSequence(self, list_of_node_ids):
+        """
+        Returns a list of every index at which the nodes indicated by list_of_node_ids appear in this line,
+        in the exact specified order.  Matches may overlap.  This method is stop-insensitive.
+        """
+        if isinstance(self.n, NodeSequence): return self.n.findSequence(list_of_node_ids)
+        return list(sequenceMatches(self.listNodeIds(), list_of_node_ids))
+
     def listNodeIds(self,ignoreStops=True):
         """
         Returns a list of integers representing the node ids that appear along this line.
         This method is stop-sensitive if called with ignoreStops=False.
         """
+        if isinstance(self.n, NodeSequence): return self.n.nodeIds(ignoreStops)
         node_ids = []
         for node in self.n:
             nodeNum = int(node.num)
@@ -319,7 +347,34 @@ class TransitLine(object):
         """
         for i in range(len(newnodelist)):
             if isinstance(newnodelist[i],int): newnodelist[i] = Node(newnodelist[i])
-        self.n = newnodelist
+        if isinstance(self.n, NodeSequence):
+            self.n = NodeSequence(newnodelist)
+        else:
+            self.n = newnodelist
+        self.nodeEdits += 1
+
+    def compactNodes(self):
+        """
+        Switches this line's node list to a columnar :py:class:`NodeSequence`, which is much
+        smaller and makes :py:meth:`hasNode`, :py:meth:`hasLink`, :py:meth:`hasSequence` and
+        :py:meth:`listNodeIds` vectorized.  Nodes are still accessed as :py:class:`Node` views.
+
+        Returns False (leaving the list alone) if some node can't be stored that way, e.g. one
+        whose number was written unusually (``+24322``).
+        """
+        if isinstance(self.n, NodeSequence): return True
+        try:
+            self.n = NodeSequence(self.n)
+        except NetworkException as e:
+            WranglerLogger.debug("Line %s: keeping node list; %s" % (self.name, str(e)))
+            return False
+        return True
+
+    def expandNodes(self):
+        """
+        Switches this line's node list back to a list of :py:class:`Node` objects.
+        """
+        if isinstance(self.n, NodeSequence): self.n = self.n.nodes()
     
     def insertNode(self,refNodeNum,newNodeNum,stop=False,after=True):
         """
@@ -337,8 +392,9 @@ class TransitLine(object):
             # out of nodes -- done
             if nodeIdx >= len(self.n): return
             
-            currentNodeNum = abs(int(self.n[nodeIdx].num))
+            currentNodeNum = self.n[nodeIdx].number
             if currentNodeNum == abs(refNodeNum):
+                self.nodeEdits += 1
                 if after==True:
                     self.n.insert(nodeIdx+1,newNode)
                     WranglerLogger.debug("In line %s: inserted node %s after node %s" % (self.name,newNode.num,str(refNodeNum)))
@@ -365,9 +421,10 @@ class TransitLine(object):
         
         nodeNumPrev = -1
         for nodeIdx in range(len(self.n)):
-            currentNodeNum = abs(int(self.n[nodeIdx].num))
+            currentNodeNum = self.n[nodeIdx].number
             if currentNodeNum == abs(nodeB) and nodeNumPrev == abs(nodeA):
                 self.n.insert(nodeIdx,newNode)
+                self.nodeEdits += 1
                 WranglerLogger.debug("In line %s: inserted node %s between node %s and node %s" % (self.name,newNode.num,str(nodeA),str(nodeB)))
             nodeNumPrev = currentNodeNum
     
@@ -394,6 +451,7 @@ class TransitLine(object):
             self.n[:ind+1] = newsection
         else:
             self.n[ind:] = newsection
+        self.nodeEdits += 1
     
     def replaceSegment(self, node1, node2, newsection, preserveStopStatus=False):
         """ Replaces the section from node1 to node2 with the newsection
@@ -430,51 +488,95 @@ class TransitLine(object):
             newsection[-1].setStop(stop2)
         
         self.n[ind1:ind2+1] = newsection
+        self.nodeEdits += 1
 
-    def replaceSequence(self, node_ids_to_replace, replacement_node_ids):
+    def replaceSequence(self, node_ids_to_replace, replacement_node_ids, replaceAll=False):
         """
         Replaces the sequence of nodes indicated by the positive integer list node_ids_to_replace
         with the new sequence of nodes indicated by the positive integer list replacement_node_ids
         This method removes stops from the replaced sequence; stops will have to be re-added.
+        Only the first occurrence is replaced, unless *replaceAll* is True, in which case every
+        non-overlapping occurrence is.
         Returns true iff the sequence is successfully replaced.
         """
-        if self.hasSequence(node_ids_to_replace):
-            WranglerLogger.debug("replacing sequence " + str(node_ids_to_replace) + " with " + str(replacement_node_ids) + " for " + self.name)
-        else:
-            return False
-        node_ids = self.listNodeIds()
-        replaceNodesStartingAt = -1
-        for i in range(len(node_ids)):
-            if node_ids[i:i+len(node_ids_to_replace)] == node_ids_to_replace:
-                replaceNodesStartingAt = i
-                break
-        if replaceNodesStartingAt < 0:
-            WranglerLogger.debug("an unexpected error occurred in replaceSequence for " + self.name)
+        matches  = []
+        for start in self.findSequence(node_ids_to_replace):
+            if matches and start < matches[-1][0] + len(node_ids_to_replace): continue
+            matches.append((start, node_ids_to_replace, replacement_node_ids))
+            if not replaceAll: break
+        if len(matches) == 0:
             return False
 
-        attr1 = self.n[replaceNodesStartingAt].attr
-        attr2 = self.n[replaceNodesStartingAt+len(node_ids_to_replace)].attr
-        
-        # make the new nodes
-        replacement_nodes = list(replacement_node_ids) # copy this, we'll make them nodes
-        for i in range(len(replacement_nodes)):
-            if isinstance(replacement_nodes[i],int): replacement_nodes[i] = Node(replacement_nodes[i])
-            # they aren't stops
-            replacement_nodes[i].setStop(False)
-        # xfer the attributes
-        replacement_nodes[0].attr=attr1
-        replacement_nodes[-1].attr=attr2
-
-        self.n[replaceNodesStartingAt:replaceNodesStartingAt+len(node_ids_to_replace)] = replacement_nodes
+        WranglerLogger.debug("replacing sequence " + str(node_ids_to_replace) + " with " + str(replacement_node_ids) + " for " + self.name)
+        self._replaceMatches(matches)
         return True
 
+    def replaceSequences(self, replacements):
+        """
+        Batch version of :py:meth:`replaceSequence` for corridor rewrites: *replacements* is a list of
+        (node_ids_to_replace, replacement_node_ids) pairs.  Every pair is matched against the line as it
+        is now and all the non-overlapping occurrences are replaced together, so one pair's replacement
+        nodes are never rewritten by another.  Where occurrences overlap, the one that starts first wins,
+        and for ties, the pair that comes first in *replacements*.
+        Returns the number of occurrences replaced.
+        """
+        found    = []
+        for pairnum in range(len(replacements)):
+            (node_ids_to_replace, replacement_node_ids) = replacements[pairnum]
+            if len(node_ids_to_replace) == 0:
+                raise NetworkException("TransitLine %s replaceSequences called with an empty sequence to replace" % self.name)
+            for start in self.findSequence(node_ids_to_replace):
+                found.append((start, pairnum))
+
+        matches = []
+        for (start, pairnum) in sorted(found):
+            if matches and start < matches[-1][0] + len(matches[-1][1]): continue
+            matches.append((start, replacements[pairnum][0], replacements[pairnum][1]))
+        if len(matches) == 0: return 0
+
+        WranglerLogger.debug("replacing %d sequences for %s" % (len(matches), self.name))
+        self._replaceMatches(matches)
+        return len(matches)
+
+    def _replaceMatches(self, matches):
+        """
+        Does the work for :py:meth:`replaceSequence` and :py:meth:`replaceSequences`: *matches* is a list
+        of non-overlapping (start index, node_ids_to_replace, replacement_node_ids), ordered by start index.
+        The new node list is built in one pass and then swapped in.
+        """
+        newnodes = []
+        prevEnd  = 0
+        for matchNum in range(len(matches)):
+            (start, node_ids_to_replace, replacement_node_ids) = matches[matchNum]
+            attr1 = self.n[start].attr
+            attr2 = self.n[start+len(node_ids_to_replace)].attr
+
+            # make the new nodes; if the caller passed Nodes, only the first replacement gets to use them
+            replacement_nodes = list(replacement_node_ids)
+            for i in range(len(replacement_nodes)):
+                if isinstance(replacement_nodes[i],int): replacement_nodes[i] = Node(replacement_nodes[i])
+                elif matchNum > 0: replacement_nodes[i] = copy.deepcopy(replacement_nodes[i])
+                # they aren't stops
+                replacement_nodes[i].setStop(False)
+            # xfer the attributes
+            replacement_nodes[0].attr=attr1
+            replacement_nodes[-1].attr=attr2
+
+            newnodes.extend(self.n[prevEnd:start])
+            newnodes.extend(replacement_nodes)
+            prevEnd = start + len(node_ids_to_replace)
+        newnodes.extend(self.n[prevEnd:])
+
+        self.n[:] = newnodes
+        self.nodeEdits += 1
+
     def setStop(self, nodenum, isStop=True):
         """ 
         Throws an exception if the nodenum isn't found
         """
         found = False
         for node in self.n:
-            if abs(int(node.num)) == abs(nodenum):
+            if node.number == abs(nodenum):
                 node.setStop(isStop)
                 found = True
         if not found:
@@ -493,6 +595,7 @@ class TransitLine(object):
         if len(self.name)>=11: self.name = self.name[:11]
         self.name = self.name + "R"
         self.n.reverse()
+        self.nodeEdits += 1
         
     def _applyTemplate(self, template):
         '''Copy all attributes (including nodes) from an existing transit line to this line'''
@@ -507,20 +610,21 @@ class TransitLine(object):
 
     # String representation: for outputting to line-file
     def __repr__(self):
-        s = '\nLINE NAME=\"%s\",\n    ' % (self.name,)
-        if self.comment: s+= self.comment
+        parts = ['\nLINE NAME=\"%s\",\n    ' % (self.name,)]
+        if self.comment: parts.append(self.comment)
 
         # Line attributes
-        s += ",\n    ".join(["%s=%s" % (k,v) for k,v in sorted(self.attr.items())])
+        parts.append(",\n    ".join(["%s=%s" % (k,v) for k,v in sorted(self.attr.items())]))
 
         # Node list
-        s += ",\n"
+        parts.append(",\n")
         prevAttr = True
-        for nodeIdx in range(len(self.n)):
-            s += self.n[nodeIdx].lineFileRepr(prependNEquals=prevAttr, lastNode=(nodeIdx==len(self.n)-1))
-            prevAttr = len(self.n[nodeIdx].attr)>0
+        lastIdx  = len(self.n)-1
+        for (nodeIdx, node) in enumerate(self.n):
+            parts.append(node.lineFileRepr(prependNEquals=prevAttr, lastNode=(nodeIdx==lastIdx)))
+            prevAttr = len(node.attr)>0
 
-        return s
+        return "".join(parts)
 
     def __str__(self):
         s = 'Line name \"%s\" freqs=%s' % (self.name, str(self.getFreqs()))
@@ -13,10 +13,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import copy, glob, inspect, math, os, re, sys, xlrd
+import cPickle, copy, glob, hashlib, inspect, itertools, math, multiprocessing, multiprocessing.pool, numpy, os, re, sre_constants, sre_parse, sys, xlrd
 from collections import defaultdict
 from .Linki import Linki
 from .Logger import WranglerLogger
+from .MSAState import MSAState
 from .Network import Network
 from .NetworkException import NetworkException
 from .PNRLink import PNRLink
@@ -26,10 +27,64 @@ from .TransitCapacity import TransitCapacity
 from .TransitLine import TransitLine
 from .TransitLink import TransitLink
 from .TransitParser import TransitParser, transit_file_def
+from .TransitTokenizer import TransitTokenizer
 from .ZACLink import ZACLink
 
 __all__ = ['TransitNetwork']
 
+TRANSIT_FILE_SUFFIXES = ["lin","link","pnr","zac","access","xfer"]
+
+def _readTransitFile((fullfile, suffix, champVersion, parserBackend, snapshotDir)):
+    """
+    Process pool worker for :py:meth:`TransitNetwork.readTransitFiles`.
+    Lives at module level so that it can be pickled.
+    """
+    TransitNetwork.parserBackend = parserBackend
+    TransitNetwork.snapshotDir   = snapshotDir
+    return TransitNetwork(champVersion).readTransitFile(fullfile, suffix)
+
+def _writeFile((filename, records, skipUnchanged)):
+    """
+    Thread pool worker for :py:meth:`TransitNetwork.write`.
+    """
+    return TransitNetwork.writeFile(filename, records, skipUnchanged)
+
+def _recordKey(record):
+    """
+    Returns the key identifying the support *record* for :py:meth:`TransitNetwork.doMerge`:
+    (A,B) for :py:class:`TransitLink` and :py:class:`Linki`, the node pair for :py:class:`ZACLink`
+    and the NODE (pnr-station or station) for :py:class:`PNRLink`.  Returns None for anything else,
+    such as comments.
+    """
+    if isinstance(record, TransitLink):
+        return (record.Anode, record.Bnode)
+    if isinstance(record, Linki):
+        try:
+            return (int(record.A), int(record.B))
+        except ValueError:
+            return (record.A, record.B)
+    if isinstance(record, ZACLink):
+        m = nodepair_pattern.match(record.id)
+        if m: return (int(m.group(1)), int(m.group(2)))
+        return record.id
+    if isinstance(record, PNRLink):
+        return record.id
+    return None
+
+def _literalPrefix(pattern):
+    """
+    Returns the literal text that anything the compiled regex *pattern* matches must start with
+    (possibly the empty string).
+    """
+    parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    if parsed.pattern.flags & sre_constants.SRE_FLAG_IGNORECASE: return ""
+
+    prefix = []
+    for (op, av) in parsed:
+        if op != sre_constants.LITERAL: break
+        prefix.append(unichr(av) if isinstance(pattern.pattern, unicode) else chr(av))
+    return "".join(prefix)
+
 class TransitNetwork(Network):
     """
     Full Cube representation of a transit network (all components)
@@ -47,6 +102,26 @@ class TransitNetwork(Network):
     # Static reference to a TransitCapacity instance
     capacity = None
 
+    # Which parser reads transit files: "tokenizer" for the hand-written :py:class:`TransitTokenizer`
+    # or "simpleparse" for the grammar-based :py:class:`TransitParser`.  They produce the same objects.
+    PARSER_BACKENDS = ["tokenizer", "simpleparse"]
+    parserBackend = "tokenizer"
+
+    # Number of processes used to parse transit files in :py:meth:`mergeDir` and tiered
+    # initialization.  Files are still merged in sorted filename order, so the result is
+    # the same as parsing them one after another (the default, 1).
+    parserProcesses = 1
+
+    # Number of threads used by :py:meth:`write` to write the component files (lines, links, etc.)
+    # The files are the same either way.
+    writerThreads = 1
+
+    # If not None, parsed transit files are saved as binary snapshots in this directory (or next
+    # to the source files, if it's "") and reused while the file contents are unchanged.
+    snapshotDir = None
+    # Bump this whenever the parsed objects change, so old snapshots are ignored.
+    SNAPSHOT_VERSION = 3
+
     def __init__(self, champVersion, basenetworkpath=None, networkBaseDir=None, networkProjectSubdir=None,
                  networkSeedSubdir=None, networkPlanSubdir=None, isTiered=False, networkName=None):
         """
@@ -56,12 +131,22 @@ class TransitNetwork(Network):
         Network.__init__(self, champVersion, networkBaseDir, networkProjectSubdir, networkSeedSubdir,
                          networkPlanSubdir, networkName)
         self.lines = []
+        self.lineIndex      = {}   # line name -> position in self.lines of the first TransitLine with that name
+        self.lineVersion    = 0    # bumped by reindexLines(), i.e. whenever the network changes self.lines
+        self.lineIndexState = None # lineState() when lineIndex was last updated
+        self.lineMatchState = None # lineState() when lineMatches was computed
+        self.lineMatches    = {}   # (regex, flags) -> positions in self.lines of the lines it matches
+        # Optional node and link indexes; see buildNodeIndex()
+        self.nodeIndex      = None # node number -> list of (line, position)
+        self.linkIndex      = None # (node A, node B) -> list of (line, position of A)
+        self.nodeIndexLines = {}   # id(line) -> (line, id(line.n), len(line.n), line.nodeEdits, node numbers indexed)
         self.links = []
         self.pnrs   = []
         self.zacs   = []
         self.accessli = []
         self.xferli   = []
         self.farefiles = {} # farefile name -> [ lines in farefile ]
+        self.mergeStats = [] # (path, counts of what was merged) for each doMerge(); see doMerge()
         for farefile in TransitNetwork.FARE_FILES:
             self.farefiles[farefile] = []
 
@@ -72,10 +157,12 @@ class TransitNetwork(Network):
             if not networkName:
                 raise NetworkException("Cannot initialize tiered TransitNetwork with basenetworkpath %s: no networkName specified" % basenetworkpath)
 
-            for filename in glob.glob(os.path.join(basenetworkpath, networkName + ".*")):
-                suffix = filename.rsplit(".")[-1].lower()
-                if suffix in ["lin","link","pnr","zac","access","xfer"]:
-                    self.parseFile(filename)
+            filenames = sorted(glob.glob(os.path.join(basenetworkpath, networkName + ".*")))
+            for (filename, suffix, parsed) in self.readTransitFiles(filenames):
+                lines,links,pnr,zac,accessli,xferli = parsed
+                logstr = "   Reading %s as %s" % (filename, suffix)
+                logstr += self.doMerge(filename,lines,links,pnr,zac,accessli,xferli,insert_replace=True)
+                WranglerLogger.debug(logstr)
 
             # fares
             for farefile in TransitNetwork.FARE_FILES:
@@ -168,6 +255,7 @@ class TransitNetwork(Network):
         del self.zacs[:]
         del self.accessli[:]
         del self.xferli[:]
+        self.reindexLines()
 
     def clearLines(self):
         """
@@ -175,6 +263,54 @@ class TransitNetwork(Network):
         Muni network so clearing the existing contents beforehand makes sense.
         """
         del self.lines[:]
+        self.reindexLines()
+
+    def compactLines(self):
+        """
+        Switches every line to columnar node storage (see :py:meth:`TransitLine.compactNodes`),
+        which cuts memory use and speeds up network-wide node and link queries on big networks.
+        Returns the number of lines that couldn't be compacted.
+        """
+        notCompacted = 0
+        for line in self.lines:
+            if isinstance(line,TransitLine) and not line.compactNodes(): notCompacted += 1
+        return notCompacted
+
+    def lineState(self):
+        """
+        Returns what the line indexes are kept up to date with: :py:attr:`lineVersion`, the
+        number of lines, and :py:attr:`TransitLine.renameCount`.
+        """
+        return (self.lineVersion, len(self.lines), TransitLine.renameCount)
+
+    def reindexLines(self, start=0):
+        """
+        Updates :py:attr:`lineIndex`, the dictionary of line name to position in :py:attr:`lines`,
+        for the lines from position *start* on.  Positions before *start* must be unchanged.
+        Call this after changing :py:attr:`lines` directly.
+        """
+        # if the index wasn't up to date with the lines before start, redo the whole thing
+        if self.lineIndexState != (self.lineVersion, start, TransitLine.renameCount): start = 0
+        if start == 0: self.lineIndex = {}
+        for idx in xrange(start, len(self.lines)):
+            line = self.lines[idx]
+            if isinstance(line,TransitLine) and line.name not in self.lineIndex:
+                self.lineIndex[line.name] = idx
+        self.lineVersion   += 1
+        self.lineIndexState = self.lineState()
+
+    def getLineIndex(self, name):
+        """
+        Returns the position in :py:attr:`lines` of the (first) line named *name*, or None.
+        Catches and fixes up lines added or removed behind the index's back, and lines renamed,
+        but lines replaced in :py:attr:`lines` directly need a :py:meth:`reindexLines`.
+        """
+        if self.lineState() != self.lineIndexState: self.reindexLines()
+        idx = self.lineIndex.get(name)
+        if idx != None and not (isinstance(self.lines[idx],TransitLine) and self.lines[idx].name == name):
+            self.reindexLines()
+            idx = self.lineIndex.get(name)
+        return idx
 
 
     def validateWnrsAndPnrs(self):
@@ -189,7 +325,34 @@ class TransitNetwork(Network):
         setToModeType   = {} # lineset => list of ModeTypes ("Local", etc)
         setToOffstreet  = {} # lineset => True if has offstreet nodes
         doneNodes       = set()
-        
+
+        # Index the support links by node once up front, rather than scanning them all for each stop.
+        # The lists keep the links in file order so everything comes out just as it would from a scan.
+        stationXfers = defaultdict(list) # node str => [xfer node str, ...]
+        for link in self.xferli:
+            if not isinstance(link,Linki): continue
+            stationXfers[link.A].append(link.B)
+            if link.B != link.A: stationXfers[link.B].append(link.A)
+
+        stationWnrs = defaultdict(list)  # node str => [wnr node, ...]
+        for zac in self.zacs:
+            if not isinstance(zac,ZACLink): continue
+            m = re.match(nodepair_pattern, zac.id)
+            stationWnrs[m.group(1)].append(int(m.group(2)))
+            stationWnrs[m.group(2)].append(int(m.group(1)))
+
+        stationPnrs = defaultdict(list) # station node str => [pnr node, ...]
+        for pnr in self.pnrs:
+            if not isinstance(pnr, PNRLink): continue
+            pnr.parseID()
+            if pnr.pnr!=PNRLink.UNNUMBERED: stationPnrs[pnr.station].append(int(pnr.pnr))
+
+        accessLinks = [link for link in self.accessli if isinstance(link,Linki)]
+        accessIdx   = defaultdict(list) # node => [index into accessLinks, ...]
+        for linkIdx in range(len(accessLinks)):
+            accessIdx[int(accessLinks[linkIdx].A)].append(linkIdx)
+            accessIdx[int(accessLinks[linkIdx].B)].append(linkIdx)
+
         # For each line
         for line in self:
             if not isinstance(line,TransitLine): continue
@@ -217,32 +380,24 @@ class TransitNetwork(Network):
                 nodeInfo[lineset][stopNodeStr] = {}
                    
                 #print " check if we have access to an on-street node"
-                for link in self.xferli:
-                    if not isinstance(link,Linki): continue
+                for xfernode in stationXfers.get(stopNodeStr, []):
                     # This xfer links the node to the on-street network
-                    if link.A == stopNodeStr:
-                        nodeInfo[lineset][stopNodeStr][link.B] = ["-","-"]
-                    elif link.B == stopNodeStr:
-                        nodeInfo[lineset][stopNodeStr][link.A] = ["-","-"]
+                    nodeInfo[lineset][stopNodeStr][xfernode] = ["-","-"]
                     
                 #print " Check for WNR"
-                for zac in self.zacs:
-                    if not isinstance(zac,ZACLink): continue
-                    
-                    m = re.match(nodepair_pattern, zac.id)
-                    if m.group(1)==stopNodeStr: wnrNodes.add(int(m.group(2)))
-                    if m.group(2)==stopNodeStr: wnrNodes.add(int(m.group(1)))
+                for wnrnode in stationWnrs.get(stopNodeStr, []):
+                    wnrNodes.add(wnrnode)
                     
                 #print "Check for PNR"
-                for pnr in self.pnrs:
-                    if not isinstance(pnr, PNRLink): continue
-                    pnr.parseID()
-                    if pnr.station==stopNodeStr and pnr.pnr!=PNRLink.UNNUMBERED:
-                        pnrNodes.add(int(pnr.pnr))
+                for pnrnode in stationPnrs.get(stopNodeStr, []):
+                    pnrNodes.add(pnrnode)
                         
                 #print "Check that our access links go from an onstreet xfer to a pnr or to a wnr"
-                for link in self.accessli:
-                    if not isinstance(link,Linki): continue
+                # (only links touching a wnr or pnr node can do anything)
+                linkIdxs = set()
+                for node in wnrNodes | pnrNodes: linkIdxs.update(accessIdx.get(node, []))
+                for linkIdx in sorted(linkIdxs):
+                    link = accessLinks[linkIdx]
                     try:
                         if int(link.A) in wnrNodes:
                             nodeInfo[lineset][stopNodeStr][link.B][0] = link.A
@@ -300,82 +455,215 @@ class TransitNetwork(Network):
         If a regex, return all relevant lines (a list of TransitLine objects).
         If 'all', return all lines (a list of TransitLine objects).
         """
+        if name=='all':
+            return list(self.lines)
         if isinstance(name,str):
-            if name in self.lines:
-                return self.lines[self.lines.index(name)]
+            idx = self.getLineIndex(name)
+            if idx != None:
+                return self.lines[idx]
 
         if str(type(name))=="<type '_sre.SRE_Pattern'>":
-            toret = []
-            for i in range(len(self.lines)):
-                if isinstance(self.lines[i],str): continue
-                if name.match(self.lines[i].name): toret.append(self.lines[i])
-            return toret
-        if name=='all':
-            allLines = []
-            for i in range(len(self.lines)):
-                allLines.append(self.lines[i])
-            return allLines
+            return self.matchLines([name])[name]
         raise NetworkException('Line name not found: %s' % (name,))
     
+    def matchLines(self, patterns):
+        """
+        Returns a dictionary of pattern => list of the :py:class:`TransitLine` objects whose names
+        the pattern matches (with ``pattern.match()``), in network order, for each compiled or
+        string regex in *patterns*.
+
+        All the patterns are checked in one pass over the line names; each line name is only tried
+        against the patterns whose literal prefix it starts with.  Results are remembered until
+        the lines change (see :py:meth:`lineState`).
+        """
+        if self.lineState() != self.lineMatchState:
+            self.lineMatchState = self.lineState()
+            self.lineMatches    = {}
+
+        keys  = {}  # pattern => key into self.lineMatches
+        todo  = {}  # key => compiled pattern, for those not done yet
+        for pattern in patterns:
+            compiled = re.compile(pattern) if isinstance(pattern, basestring) else pattern
+            key = (compiled.pattern, compiled.flags)
+            keys[pattern] = key
+            if key not in self.lineMatches: todo[key] = compiled
+
+        if len(todo)>0:
+            byprefix = defaultdict(list) # literal prefix => keys
+            for (key, compiled) in todo.iteritems():
+                byprefix[_literalPrefix(compiled)].append(key)
+                self.lineMatches[key] = []
+            prefixlens = sorted(set([len(prefix) for prefix in byprefix.keys()]))
+
+            for idx in xrange(len(self.lines)):
+                if not isinstance(self.lines[idx],TransitLine): continue
+                name = self.lines[idx].name
+                for prefixlen in prefixlens:
+                    if prefixlen > len(name): break
+                    for key in byprefix.get(name[:prefixlen], []):
+                        if todo[key].match(name): self.lineMatches[key].append(idx)
+
+        matches = {}
+        for (pattern, key) in keys.iteritems():
+            matches[pattern] = [self.lines[idx] for idx in self.lineMatches[key]]
+        return matches
+
     def deleteLinkForNodes(self, nodeA, nodeB, include_reverse=True):
         """
         Delete any TransitLink in self.links[] from nodeA to nodeB (these should be integers).
         If include_reverse, also delete from nodeB to nodeA.
         Returns number of links deleted.
         """
-        del_idxs = []
-        for idx in range(len(self.links)-1,-1,-1): # go backwards
-            if not isinstance(self.links[idx],TransitLink): continue
-            if self.links[idx].Anode == nodeA and self.links[idx].Bnode == nodeB:
-                del_idxs.append(idx)
-            elif include_reverse and self.links[idx].Anode == nodeB and self.links[idx].Bnode == nodeA:
-                del_idxs.append(idx)
+        return self.deleteLinksForNodePairs([(nodeA, nodeB)], include_reverse)
+
+    def deleteLinksForNodePairs(self, nodePairs, include_reverse=True):
+        """
+        Bulk version of :py:meth:`deleteLinkForNodes`: delete any TransitLink in self.links[]
+        from A to B for any (A,B) in *nodePairs* (integers).  If include_reverse, also delete
+        those from B to A.
+        Returns number of links deleted.
+        """
+        nodePairs = set(nodePairs)
+        if include_reverse: nodePairs.update([(nodeB, nodeA) for (nodeA, nodeB) in nodePairs])
+
+        return self.deleteSupportRecords("links", set([nodeA for (nodeA, nodeB) in nodePairs]),
+            lambda link: (link.Anode, link.Bnode) in nodePairs, "link")
 
-        for del_idx in del_idxs:
-            WranglerLogger.debug("Removing link %s" % str(self.links[del_idx]))
-            del self.links[del_idx]
-        
-        return len(del_idxs)
-    
     def deleteAccessXferLinkForNode(self, nodenum, access_links=True, xfer_links=True):
         """
         Delete any Linki in self.accessli (if access_links) and/or self.xferli (if xfer_links)
         with Anode or Bnode as nodenum.
         Returns number of links deleted.
         """
-        del_acc_idxs = []
-        if access_links:
-            for idx in range(len(self.accessli)-1,-1,-1): # go backwards
-                if not isinstance(self.accessli[idx],Linki): continue
-                if int(self.accessli[idx].A) == nodenum or int(self.accessli[idx].B) == nodenum:
-                    del_acc_idxs.append(idx)
-            
-            for del_idx in del_acc_idxs:
-                WranglerLogger.debug("Removing access link %s" % str(self.accessli[del_idx]))
-                del self.accessli[del_idx]
-
-        del_xfer_idxs = []
-        if xfer_links:
-            for idx in range(len(self.xferli)-1,-1,-1): # go backwards
-                if not isinstance(self.xferli[idx],Linki): continue
-                if int(self.xferli[idx].A) == nodenum or int(self.xferli[idx].B) == nodenum:
-                    del_xfer_idxs.append(idx)
-            
-            for del_idx in del_xfer_idxs:
-                WranglerLogger.debug("Removing xfere link %s" % str(self.xferli[del_idx]))
-                del self.xferli[del_idx]
-                
-        return len(del_acc_idxs) + len(del_xfer_idxs)
-                
+        return self.deleteAccessXferLinksForNodes([nodenum], access_links, xfer_links)
+
+    def deleteAccessXferLinksForNodes(self, nodenums, access_links=True, xfer_links=True):
+        """
+        Bulk version of :py:meth:`deleteAccessXferLinkForNode`: delete any Linki in self.accessli
+        (if access_links) and/or self.xferli (if xfer_links) with Anode or Bnode in *nodenums*.
+        Returns number of links deleted.
+        """
+        nodenums = set(nodenums)
+        deleted  = 0
+        for (listname, wanted, desc) in [("accessli", access_links, "access link"),
+                                         ("xferli",   xfer_links,   "xfere link")]:
+            if not wanted: continue
+            deleted += self.deleteSupportRecords(listname, nodenums,
+                lambda linki: int(linki.A) in nodenums or int(linki.B) in nodenums, desc)
+        return deleted
+
+    def deleteSupportRecords(self, listname, nodenums, matches, desc):
+        """
+        Deletes the support links in list *listname* that start or end at one of *nodenums*
+        and for which *matches* (a function of the link) is True, in one pass over the list.
+        Logs each one as a *desc*.  Returns number of links deleted.
+        """
+        records  = getattr(self, listname)
+        del_idxs = []
+        for idx in xrange(len(records)-1,-1,-1): # go backwards
+            key = _recordKey(records[idx])
+            if not isinstance(key, tuple): continue
+            if (key[0] in nodenums or key[1] in nodenums) and matches(records[idx]):
+                del_idxs.append(idx)
+        if len(del_idxs)==0: return 0
+
+        for del_idx in del_idxs:
+            WranglerLogger.debug("Removing %s %s" % (desc, str(records[del_idx])))
+        del_idxs = set(del_idxs)
+        records[:] = [records[idx] for idx in xrange(len(records)) if idx not in del_idxs]
+        return len(del_idxs)
+
+    def buildNodeIndex(self):
+        """
+        Builds the optional :py:attr:`nodeIndex`, node number => list of (line, position), and
+        :py:attr:`linkIndex`, (node A, node B) => list of (line, position of A).  Node numbers are
+        positive (stop-insensitive).
+
+        Once built, :py:meth:`splitLinkInTransitLines` and :py:meth:`replaceSegmentInTransitLines`
+        use them to go straight to the lines involved, and keep them up to date.  Lines added or
+        removed, edited with the :py:class:`TransitLine` methods, or whose node lists change length,
+        are picked up by :py:meth:`syncNodeIndex`; if you otherwise edit a line's nodes yourself
+        (e.g. ``line.n[3] = Node(123)``), call :py:meth:`updateNodeIndex` for it.
+        """
+        self.nodeIndex      = defaultdict(list)
+        self.linkIndex      = defaultdict(list)
+        self.nodeIndexLines = {}
+        for line in self.lines:
+            if isinstance(line,TransitLine): self.updateNodeIndex(line)
+
+    def updateNodeIndex(self, line):
+        """
+        Re-indexes the nodes of the given *line* in :py:attr:`nodeIndex` and :py:attr:`linkIndex`.
+        """
+        self.removeFromNodeIndex(line)
+        nodenums = line.listNodeIds()
+        for pos in range(len(nodenums)):
+            self.nodeIndex[nodenums[pos]].append((line,pos))
+            if pos > 0: self.linkIndex[(nodenums[pos-1],nodenums[pos])].append((line,pos-1))
+        self.nodeIndexLines[id(line)] = (line, id(line.n), len(line.n), line.nodeEdits, nodenums)
+
+    def removeFromNodeIndex(self, line):
+        """
+        Removes the given *line* from :py:attr:`nodeIndex` and :py:attr:`linkIndex`.
+        """
+        if id(line) not in self.nodeIndexLines: return
+        nodenums = self.nodeIndexLines[id(line)][4]
+        for nodenum in set(nodenums):
+            self.nodeIndex[nodenum] = [entry for entry in self.nodeIndex[nodenum] if entry[0] is not line]
+            if len(self.nodeIndex[nodenum])==0: del self.nodeIndex[nodenum]
+        for link in set(zip(nodenums[:-1], nodenums[1:])):
+            self.linkIndex[link] = [entry for entry in self.linkIndex[link] if entry[0] is not line]
+            if len(self.linkIndex[link])==0: del self.linkIndex[link]
+        del self.nodeIndexLines[id(line)]
+
+    def syncNodeIndex(self):
+        """
+        Updates :py:attr:`nodeIndex` and :py:attr:`linkIndex` for lines added to or removed from
+        the network, or whose node lists were edited, replaced or changed length, since they were last updated.
+        """
+        current = {}
+        for line in self.lines:
+            if isinstance(line,TransitLine): current[id(line)] = line
+
+        for (lineid, (line, nodelistid, nodelistlen, nodeEdits, nodenums)) in self.nodeIndexLines.items():
+            if lineid not in current: self.removeFromNodeIndex(line)
+
+        for (lineid, line) in current.iteritems():
+            if lineid not in self.nodeIndexLines:
+                self.updateNodeIndex(line)
+                continue
+            (indexedline, nodelistid, nodelistlen, nodeEdits, nodenums) = self.nodeIndexLines[lineid]
+            if nodelistid != id(line.n) or nodelistlen != len(line.n) or nodeEdits != line.nodeEdits:
+                self.updateNodeIndex(line)
+
+    def linesWithNodes(self, nodenums):
+        """
+        Returns the lines that contain all of the given *nodenums* (stop-insensitive), in
+        network order, using :py:attr:`nodeIndex`.
+        """
+        self.syncNodeIndex()
+        lineids = None
+        for nodenum in nodenums:
+            ids = set([id(entry[0]) for entry in self.nodeIndex.get(abs(nodenum), [])])
+            lineids = ids if lineids == None else (lineids & ids)
+        return [line for line in self.lines if isinstance(line,TransitLine) and id(line) in lineids]
+
     def splitLinkInTransitLines(self,nodeA,nodeB,newNode,stop=False):
         """
         Goes through each line and for any with links going from *nodeA* to *nodeB*, inserts
         the *newNode* in between them (as a stop if *stop* is True).
         """
         totReplacements = 0
-        for line in self:
+        if self.nodeIndex != None:
+            self.syncNodeIndex()
+            lineids = set([id(entry[0]) for entry in self.linkIndex.get((abs(nodeA),abs(nodeB)), [])])
+            lines = [line for line in self.lines if isinstance(line,TransitLine) and id(line) in lineids]
+        else:
+            lines = self
+        for line in lines:
             if line.hasLink(nodeA,nodeB):
                 line.splitLink(nodeA,nodeB,newNode,stop=stop)
+                if self.nodeIndex != None: self.updateNodeIndex(line)
                 totReplacements+=1
         WranglerLogger.debug("Total Lines with Link %s-%s split:%d" % (str(nodeA),str(nodeB),totReplacements))
     
@@ -386,13 +674,41 @@ class TransitNetwork(Network):
         totReplacements = 0
         allExp=re.compile(".")
         newSection=newNodes # [nodeA]+newNodes+[nodeB]
-        for line in self.line(allExp):
+        if self.nodeIndex != None:
+            lines = [line for line in self.linesWithNodes([nodeA,nodeB]) if allExp.match(line.name)]
+        else:
+            lines = self.line(allExp)
+        for line in lines:
             if line.hasSegment(nodeA,nodeB):
                 WranglerLogger.debug(line.name)
                 line.replaceSegment(nodeA,nodeB,newSection)
+                if self.nodeIndex != None: self.updateNodeIndex(line)
                 totReplacements+=1
         WranglerLogger.debug("Total Lines with Segment %s-%s replaced:%d" % (str(nodeA),str(nodeB),totReplacements))
 
+    def replaceSequencesInTransitLines(self, replacements):
+        """
+        Applies the corridor rewrites in *replacements*, a list of (node_ids_to_replace, replacement_node_ids)
+        pairs, to every line; see :py:meth:`TransitLine.replaceSequences`.  Each line is rewritten in one pass.
+        """
+        totReplacements = 0
+        for (node_ids_to_replace, replacement_node_ids) in replacements:
+            if len(node_ids_to_replace) == 0:
+                raise NetworkException("replaceSequencesInTransitLines called with an empty sequence to replace")
+        if self.nodeIndex != None:
+            lineids = set()
+            for (node_ids_to_replace, replacement_node_ids) in replacements:
+                lineids.update([id(line) for line in self.linesWithNodes(node_ids_to_replace)])
+            lines = [line for line in self.lines if isinstance(line,TransitLine) and id(line) in lineids]
+        else:
+            lines = self
+        for line in lines:
+            numReplaced = line.replaceSequences(replacements)
+            if numReplaced == 0: continue
+            if self.nodeIndex != None: self.updateNodeIndex(line)
+            totReplacements += numReplaced
+        WranglerLogger.debug("Total sequences replaced:%d" % totReplacements)
+
     def setCombiFreqsForShortLine(self, shortLine, longLine, combFreqs):
         """
         Set all five headways for a short line to equal a combined 
@@ -421,12 +737,13 @@ class TransitNetwork(Network):
         shortLineInst.setFreqs([amShort,mdShort,pmShort,evShort,eaShort])
     
     
-    def getCombinedFreq(self, names, coverage_set=False):
+    def getCombinedFreq(self, names, coverage_set=False, lines=None):
         """
         Pass a regex pattern, we'll show the combined frequency.  This
         doesn't change anything, it's just a useful tool.
+        Pass *lines* if the lines matching *names* are already known (see :py:meth:`matchLines`).
         """
-        lines = self.line(names)
+        if lines == None: lines = self.line(names)
         denom = [0,0,0,0,0]
         for l in lines:
             if coverage_set: coverage_set.discard(l.name)
@@ -449,12 +766,18 @@ class TransitNetwork(Network):
            frequencies of all of these lines.  e.g. ``MUNI*``
 
         """
+        # match all the patterns at once, and hand each one's lines to getCombinedFreq()
+        patterns = []
+        for label in frequencies.keys():
+            for regexnum in [0,1]:
+                if frequencies[label][regexnum].strip()=="": continue
+                patterns.append(frequencies[label][regexnum].strip())
+        if coverage: patterns.append(coverage)
+        matches = self.matchLines(patterns)
+
         covset = set([])
         if coverage:
-            covpattern = re.compile(coverage)
-            for i in range(len(self.lines)):
-                if isinstance(self.lines[i],str): continue
-                if covpattern.match(self.lines[i].name): covset.add(self.lines[i].name)
+            for line in matches[coverage]: covset.add(line.name)
             # print covset
             
         labels = frequencies.keys(); labels.sort()
@@ -464,15 +787,15 @@ class TransitNetwork(Network):
             for regexnum in [0,1]:
                 frequencies[label][regexnum]=frequencies[label][regexnum].strip()
                 if frequencies[label][regexnum]=="": continue
-                pattern = re.compile(frequencies[label][regexnum])
-                freqs = self.getCombinedFreq(pattern, coverage_set=covset)
+                pattern = frequencies[label][regexnum]
+                freqs = self.getCombinedFreq(pattern, coverage_set=covset, lines=matches[pattern])
                 if freqs[0]+freqs[1]+freqs[2]+freqs[3]+freqs[4]==0:
                     logstr += "-- Found no matching lines for pattern [%s]" % (frequencies[label][regexnum])
                 for timeperiod in range(5):
                     if abs(freqs[timeperiod]-frequencies[label][2][timeperiod])>0.2:
                         logstr += "-- Mismatch. Desired %s" % str(frequencies[label][2])
                         logstr += "but got ",str(freqs)
-                        lines = self.line(pattern)
+                        lines = matches[pattern]
                         WranglerLogger.error(logstr)
                         WranglerLogger.error("Problem lines:")
                         for line in lines: WranglerLogger.error(str(line))
@@ -487,9 +810,12 @@ class TransitNetwork(Network):
 
 
     def write(self, path='.', name='transit', writeEmptyFiles=True, suppressQuery=False, suppressValidation=False,
-              cubeNetFileForValidation=None):
+              cubeNetFileForValidation=None, skipUnchanged=False):
         """
         Write out this full transit network to disk in path specified.
+
+        If *skipUnchanged*, then output files that already exist with the same contents are left
+        untouched, and the files written are recorded in the manifest (see :py:meth:`Network.updateManifest`).
         """
         if not suppressValidation:
             self.validateWnrsAndPnrs()
@@ -520,71 +846,60 @@ class TransitNetwork(Network):
 
         WranglerLogger.info("Writing into %s\\%s" % (path, name))
         logstr = ""
+        components = [] # (filename, iterable of strings to write)
         if len(self.lines)>0 or writeEmptyFiles:
             logstr += " lines"
-            f = open(os.path.join(path,name+".lin"), 'w');
-            f.write(";;<<Trnbuild>>;;\n")
-            for line in self.lines:
-                if isinstance(line,str): f.write(line)
-                else: f.write(repr(line)+"\n")
-            f.close()
-
-        if len(self.links)>0 or writeEmptyFiles:
-            logstr += " links"
-            f = open(os.path.join(path,name+".link"), 'w');
-            for link in self.links:
-                f.write(str(link)+"\n")
-            f.close()
-
-        if len(self.pnrs)>0 or writeEmptyFiles:
-            logstr += " pnr"
-            f = open(os.path.join(path,name+".pnr"), 'w');
-            for pnr in self.pnrs:
-                f.write(str(pnr)+"\n")
-            f.close()
-
-        if len(self.zacs)>0 or writeEmptyFiles:
-            logstr += " zac"
-            f = open(os.path.join(path,name+".zac"), 'w');
-            for zac in self.zacs:
-                f.write(str(zac)+"\n")
-            f.close()
+            components.append((os.path.join(path,name+".lin"), self.linesFileRecords()))
+
+        for (attrname, suffix, logname) in [("links",    "link",   "links"),
+                                            ("pnrs",     "pnr",    "pnr"),
+                                            ("zacs",     "zac",    "zac"),
+                                            ("accessli", "access", "access"),
+                                            ("xferli",   "xfer",   "xfer")]:
+            records = getattr(self, attrname)
+            if len(records)>0 or writeEmptyFiles:
+                logstr += " " + logname
+                components.append((os.path.join(path,name+"."+suffix), (str(record)+"\n" for record in records)))
 
-        if len(self.accessli)>0 or writeEmptyFiles:
-            logstr += " access"
-            f = open(os.path.join(path,name+".access"), 'w');
-            for accessli in self.accessli:
-                f.write(str(accessli)+"\n")
-            f.close()
-        
-        if len(self.xferli)>0 or writeEmptyFiles:
-            logstr += " xfer"
-            f = open(os.path.join(path,name+".xfer"), 'w');
-            for xferli in self.xferli:
-                f.write(str(xferli)+"\n")
-            f.close()
-            
         # fares
         for farefile in TransitNetwork.FARE_FILES:
             # don't write an empty one unless there isn't anything there
             if len(self.farefiles[farefile]) == 0:
                 if writeEmptyFiles and not os.path.exists(os.path.join(path,farefile)):
                     logstr += " " + farefile
-                    f = open(os.path.join(path,farefile), 'w')
-                    f.write("; no fares known\n")
-                    f.close()
+                    components.append((os.path.join(path,farefile), ["; no fares known\n"]))
 
             else:
                 logstr += " " + farefile
-                f = open(os.path.join(path,farefile), 'w')
-                for line in self.farefiles[farefile]:
-                    f.write(line)
-                f.close()
+                components.append((os.path.join(path,farefile), self.farefiles[farefile]))
+
+        if TransitNetwork.writerThreads <= 1 or len(components) <= 1:
+            digests = [TransitNetwork.writeFile(filename, records, skipUnchanged) for (filename, records) in components]
+        else:
+            pool = multiprocessing.pool.ThreadPool(processes=min(TransitNetwork.writerThreads, len(components)))
+            try:
+                digests = pool.map(_writeFile, [(filename, records, skipUnchanged) for (filename, records) in components])
+            finally:
+                pool.close()
+                pool.join()
+
+        if skipUnchanged:
+            TransitNetwork.updateManifest(path, dict([(os.path.basename(filename), digest) for
+                                                      ((filename, records), digest) in zip(components, digests)]))
 
         logstr += "... done."
         WranglerLogger.debug(logstr)
         WranglerLogger.info("")
 
+    def linesFileRecords(self):
+        """
+        Generates the text of the ``.lin`` file for :py:attr:`lines`, one line (or comment) at a time.
+        """
+        yield ";;<<Trnbuild>>;;\n"
+        for line in self.lines:
+            if isinstance(line,str): yield line
+            else: yield repr(line)+"\n"
+
     def parseAndPrintTransitFile(self, trntxt, verbosity=1):
         """
         Verbosity=1: 1 line per line summary
@@ -607,6 +922,147 @@ class TransitNetwork(Network):
         return convertedLines, convertedLinks, convertedPNR, convertedZAC, \
             convertedAccessLinki, convertedXferLinki
 
+    @staticmethod
+    def createParser(liType=''):
+        """
+        Returns a new parser for transit files, per :py:attr:`TransitNetwork.parserBackend`.
+        *liType* is ``access`` or ``xfer`` and says what kind of links access/xfer records are.
+        """
+        if TransitNetwork.parserBackend == "tokenizer":
+            parser = TransitTokenizer(verbosity=0)
+            parser.liType = liType
+        elif TransitNetwork.parserBackend == "simpleparse":
+            parser = TransitParser(transit_file_def, verbosity=0)
+            parser.tfp.liType = liType
+        else:
+            raise NetworkException("Unknown parserBackend %s; expected one of %s" %
+                                   (TransitNetwork.parserBackend, str(TransitNetwork.PARSER_BACKENDS)))
+        return parser
+
+    def readTransitFile(self, fullfile, suffix):
+        """
+        Reads the transit file *fullfile*, with access/xfer records read as *suffix* links.
+        Returns lines, links, PNRs, ZACs, access links and xfer links like
+        :py:meth:`parseAndPrintTransitFile`.  The tokenizer backend streams the file
+        with :py:meth:`TransitTokenizer.iterparse` instead of reading it all in first.
+        """
+        if TransitNetwork.snapshotDir != None:
+            (snapshotfile, snapshotkey) = TransitNetwork.getSnapshotFileAndKey(fullfile, suffix)
+            parsed = TransitNetwork.readSnapshot(snapshotfile, snapshotkey)
+            if parsed: return parsed
+
+        self.parser = TransitNetwork.createParser(suffix)
+        f = open(fullfile, 'r')
+        if isinstance(self.parser, TransitTokenizer):
+            parsedlists = defaultdict(list)
+            for (listname, item) in self.parser.iterparse(f):
+                parsedlists[listname].append(item)
+            parsed = (parsedlists['lines'], parsedlists['links'], parsedlists['pnrs'], parsedlists['zacs'],
+                      parsedlists['accessli'], parsedlists['xferli'])
+        else:
+            parsed = self.parseAndPrintTransitFile(f.read(), verbosity=0)
+        f.close()
+
+        if TransitNetwork.snapshotDir != None:
+            TransitNetwork.writeSnapshot(snapshotfile, snapshotkey, parsed)
+        return parsed
+
+    @staticmethod
+    def getSnapshotFileAndKey(fullfile, suffix):
+        """
+        Returns the snapshot filename for the transit file *fullfile* read as *suffix*, and the key
+        its snapshot must have to be valid: a hash of the file contents, the suffix and the
+        snapshot/Wrangler versions.
+        """
+        sha = hashlib.sha1()
+        f = open(fullfile, 'rb')
+        while True:
+            chunk = f.read(1024*1024)
+            if not chunk: break
+            sha.update(chunk)
+        f.close()
+        snapshotkey = "%s %s %d %s" % (sha.hexdigest(), suffix, TransitNetwork.SNAPSHOT_VERSION,
+                                       str(TransitNetwork.WRANGLER_VERSION))
+
+        # one snapshot per source file; the hash of its directory keeps same-named files apart
+        fulldir  = os.path.dirname(os.path.abspath(fullfile))
+        snapshotdir = TransitNetwork.snapshotDir if TransitNetwork.snapshotDir else fulldir
+        snapshotfile = os.path.join(snapshotdir, "%s.%s.snapshot" % (os.path.basename(fullfile),
+                                                                     hashlib.sha1(fulldir).hexdigest()[:8]))
+        return (snapshotfile, snapshotkey)
+
+    @staticmethod
+    def readSnapshot(snapshotfile, snapshotkey):
+        """
+        Returns the parsed lines, links, PNRs, ZACs, access links and xfer links stored in
+        *snapshotfile*, or None if it doesn't exist or isn't for *snapshotkey*.
+        """
+        if not os.path.exists(snapshotfile): return None
+        try:
+            f = open(snapshotfile, 'rb')
+            key = cPickle.load(f)
+            parsed = cPickle.load(f) if key == snapshotkey else None
+            f.close()
+        except Exception as e:
+            WranglerLogger.warning("Couldn't read transit snapshot %s: %s" % (snapshotfile, str(e)))
+            return None
+
+        if parsed: WranglerLogger.debug("Read transit snapshot %s" % snapshotfile)
+        return parsed
+
+    @staticmethod
+    def writeSnapshot(snapshotfile, snapshotkey, parsed):
+        """
+        Saves the *parsed* lines, links, PNRs, ZACs, access links and xfer links to *snapshotfile*
+        with *snapshotkey*.  Failing to write the snapshot is only a warning.
+        """
+        tmpfile = "%s.%d.tmp" % (snapshotfile, os.getpid())
+        try:
+            if not os.path.exists(os.path.dirname(snapshotfile)):
+                os.makedirs(os.path.dirname(snapshotfile))
+            f = open(tmpfile, 'wb')
+            cPickle.dump(snapshotkey, f, cPickle.HIGHEST_PROTOCOL)
+            cPickle.dump(parsed, f, cPickle.HIGHEST_PROTOCOL)
+            f.close()
+            # os.rename won't replace an existing file on Windows
+            if os.path.exists(snapshotfile): os.remove(snapshotfile)
+            os.rename(tmpfile, snapshotfile)
+        except Exception as e:
+            WranglerLogger.warning("Couldn't write transit snapshot %s: %s" % (snapshotfile, str(e)))
+            if os.path.exists(tmpfile): os.remove(tmpfile)
+
+    def readTransitFiles(self, fullfiles):
+        """
+        Generator that reads the transit files among *fullfiles* (by suffix, see
+        :py:data:`TRANSIT_FILE_SUFFIXES`) with :py:meth:`readTransitFile`, yielding
+        ``(fullfile, suffix, (lines, links, pnrs, zacs, accessli, xferli))`` in the order given.
+
+        If :py:attr:`TransitNetwork.parserProcesses` > 1, the files are parsed in a process pool.
+        """
+        filesAndSuffixes = []
+        for fullfile in fullfiles:
+            suffix = fullfile.rsplit(".")[-1].lower()
+            if suffix in TRANSIT_FILE_SUFFIXES:
+                filesAndSuffixes.append((fullfile, suffix))
+
+        if TransitNetwork.parserProcesses <= 1 or len(filesAndSuffixes) <= 1:
+            for (fullfile, suffix) in filesAndSuffixes:
+                yield (fullfile, suffix, self.readTransitFile(fullfile, suffix))
+            return
+
+        pool = multiprocessing.Pool(processes=min(TransitNetwork.parserProcesses, len(filesAndSuffixes)))
+        try:
+            # imap keeps the order, so we can merge each file as soon as it (and those before it) are done
+            results = pool.imap(_readTransitFile,
+                                [(fullfile, suffix, self.champVersion, TransitNetwork.parserBackend,
+                                  TransitNetwork.snapshotDir)
+                                 for (fullfile, suffix) in filesAndSuffixes])
+            for ((fullfile, suffix), parsed) in itertools.izip(filesAndSuffixes, results):
+                yield (fullfile, suffix, parsed)
+        finally:
+            pool.terminate()
+            pool.join()
+
     def parseFile(self, fullfile, insert_replace=True):
         """
         fullfile is the filename,
@@ -620,68 +1076,146 @@ class TransitNetwork(Network):
         This is a little bit of a hack, but it's meant to allow us to do something
         like read an xfer file as an access file...
         """
-        self.parser = TransitParser(transit_file_def, verbosity=0)
-        self.parser.tfp.liType = suffix
         logstr = "   Reading %s as %s" % (fullfile, suffix)
-        f = open(fullfile, 'r');
-        lines,links,pnr,zac,accessli,xferli = self.parseAndPrintTransitFile(f.read(), verbosity=0)
-        f.close()
+        lines,links,pnr,zac,accessli,xferli = self.readTransitFile(fullfile, suffix)
         logstr += self.doMerge(fullfile,lines,links,pnr,zac,accessli,xferli,insert_replace)
         WranglerLogger.debug(logstr)
             
     def doMerge(self,path,lines,links,pnrs,zacs,accessli,xferli,insert_replace=False):
         """
         Merge a set of transit lines & support links with this network's transit representation.
+
+        The given objects become part of this network; they aren't copied, so don't reuse them.
+        Lines replace existing lines with the same name, and support records replace existing
+        records with the same key (see :py:meth:`mergeRecords`): in place if *insert_replace*,
+        otherwise the existing ones are removed and the new ones appended.
+
+        Each call appends ``(path, stats)`` to :py:attr:`mergeStats`, where *stats* is a dictionary
+        of counts: ``lines``, ``lines replaced``, ``lines removed`` and ``lines appended``, plus
+        ``links``, ``PNRs``, ``ZACs``, ``accesslinks`` and ``xferlinks`` and, if there were any of
+        those, how many of each were replaced and removed (e.g. ``links replaced``).
         """
 
         logstr = " -- Merging"
+        stats  = dict.fromkeys(["lines", "lines replaced", "lines removed", "lines appended"], 0)
 
         if len(lines)>0:
             logstr += " %s lines" % len(lines)
 
-            extendlines = copy.deepcopy(lines)
+            # sort the incoming lines into those replacing existing lines in place and those to append
+            extendlines = []
+            toremove    = defaultdict(int)  # line name -> number of existing lines to remove
             for line in lines:
-                if isinstance(line,TransitLine) and (line in self.lines):
-                    # logstr += " *%s" % (line.name)
-                    if insert_replace:
-                        self.lines[self.lines.index(line)]=line
-                        extendlines.remove(line)
-                    else:
-                        self.lines.remove(line)
+                if not isinstance(line,TransitLine):
+                    extendlines.append(line)
+                    continue
+                stats["lines"] += 1
+                idx = self.getLineIndex(line.name)
+                if idx != None and insert_replace:
+                    self.lines[idx]=line
+                    stats["lines replaced"] += 1
+                    continue
+                if idx != None: toremove[line.name] += 1
+                extendlines.append(line)
+
+            # remove the first toremove[name] lines with each name, in one pass
+            if len(toremove)>0:
+                keeplines = []
+                for line in self.lines:
+                    if isinstance(line,TransitLine) and toremove.get(line.name,0)>0:
+                        toremove[line.name] -= 1
+                        stats["lines removed"] += 1
+                        continue
+                    keeplines.append(line)
+                self.lines[:] = keeplines
+                self.reindexLines()
 
             if len(extendlines)>0:
                 # for line in extendlines: print line
+                start = len(self.lines)
                 self.lines.extend(["\n;######################### From: "+path+"\n"])
                 self.lines.extend(extendlines)
+                self.reindexLines(start)
+                stats["lines appended"] = len([line for line in extendlines if isinstance(line,TransitLine)])
+
+            logstr += " (%d replaced, %d removed, %d appended)" % \
+                (stats["lines replaced"], stats["lines removed"], stats["lines appended"])
+
+        for (listname, records, label) in [("links",    links,    "links"),
+                                           ("pnrs",     pnrs,     "PNRs"),
+                                           ("zacs",     zacs,     "ZACs"),
+                                           ("accessli", accessli, "accesslinks"),
+                                           ("xferli",   xferli,   "xferlinks")]:
+            if len(records)==0: continue
+            (replaced, removed) = self.mergeRecords(listname, records, path, insert_replace)
+            logstr += " %d %s" % (len(records), label)
+            if replaced or removed: logstr += " (%d replaced, %d removed)" % (replaced, removed)
+            stats[label+" replaced"] = replaced
+            stats[label+" removed"]  = removed
+
+        for (records, label) in [(links, "links"), (pnrs, "PNRs"), (zacs, "ZACs"),
+                                 (accessli, "accesslinks"), (xferli, "xferlinks")]:
+            stats[label] = len(records)
+        self.mergeStats.append((path, dict(stats)))
 
-        if len(links)>0:
-            logstr += " %d links" % len(links)
-            self.links.extend(["\n;######################### From: "+path+"\n"])
-            self.links.extend(links)  #TODO: Need to replace existing links
+        logstr += "...done."
+        return logstr
 
-        if len(pnrs)>0:
-            logstr += " %d PNRs" % len(pnrs)
-            self.pnrs.extend( ["\n;######################### From: "+path+"\n"])
-            self.pnrs.extend(pnrs)  #TODO: Need to replace existing PNRs
+    def getRecordIndex(self, listname):
+        """
+        Returns an index of the support records in list *listname* (``links``, ``pnrs``, ``zacs``,
+        ``accessli`` or ``xferli``): a dictionary of record key (see :py:func:`_recordKey`) to the
+        position of the first record with that key.  It's built from scratch in one pass, so it's
+        only good until the list is next changed.
+        """
+        records = getattr(self, listname)
+        index = {}
+        for idx in xrange(len(records)):
+            key = _recordKey(records[idx])
+            if key != None and key not in index: index[key] = idx
+        return index
+
+    def findRecord(self, listname, key):
+        """
+        Returns the position of the first support record in list *listname* with *key*, or None.
+        """
+        return self.getRecordIndex(listname).get(key)
 
-        if len(zacs)>0:
-            logstr += " %d ZACs" % len(zacs)
-            self.zacs.extend( ["\n;######################### From: "+path+"\n"])
-            self.zacs.extend(zacs)  #TODO: Need to replace existing PNRs
+    def mergeRecords(self, listname, records, path, insert_replace=False):
+        """
+        Merges the support *records* (read from *path*) into list *listname* (``links``, ``pnrs``,
+        ``zacs``, ``accessli`` or ``xferli``).  A record with the same key as an existing record
+        (see :py:func:`_recordKey`) replaces it in place if *insert_replace*; otherwise the existing
+        record is removed and the new one appended, as for lines.  Everything else is appended.
+        The existing records are indexed once per call, with :py:meth:`getRecordIndex`.
 
-        if len(accessli)>0:
-            logstr += " %d accesslinks" % len(accessli)
-            self.accessli.extend( ["\n;######################### From: "+path+"\n"])
-            self.accessli.extend(accessli)
+        Returns (number of existing records replaced, number removed).
+        """
+        existing  = getattr(self, listname)
+        index     = self.getRecordIndex(listname)
+        appendees = []
+        replaced  = 0
+        toremove  = set() # positions in existing
+        for record in records:
+            key = _recordKey(record)
+            idx = index.get(key) if key != None else None
+            if idx == None:
+                appendees.append(record)
+            elif insert_replace:
+                existing[idx] = record
+                replaced += 1
+            else:
+                toremove.add(idx)
+                appendees.append(record)
 
-        if len(xferli)>0:
-            logstr += " %d xferlinks" % len(xferli)
-            self.xferli.extend( ["\n;######################### From: "+path+"\n"])
-            self.xferli.extend(xferli)
+        if len(toremove)>0:
+            existing[:] = [existing[idx] for idx in xrange(len(existing)) if idx not in toremove]
 
+        if len(appendees)>0:
+            existing.append("\n;######################### From: "+path+"\n")
+            existing.extend(appendees)
 
-        logstr += "...done."
-        return logstr
+        return (replaced, len(toremove))
 
     def mergeDir(self,path,insert_replace=False):
         """
@@ -692,18 +1226,12 @@ class TransitNetwork(Network):
         dirlist.sort()
         WranglerLogger.debug("Path: %s" % path)
 
-        for filename in dirlist:
-            suffix = filename.rsplit(".")[-1].lower()
-            if suffix in ["lin","link","pnr","zac","access","xfer"]:
-                self.parser = TransitParser(transit_file_def, verbosity=0)
-                self.parser.tfp.liType = suffix
-                fullfile = os.path.join(path,filename)
-                logstr = "   Reading %s" % filename
-                f = open(fullfile, 'r');
-                lines,links,pnr,zac,accessli,xferli = self.parseAndPrintTransitFile(f.read(), verbosity=0)
-                f.close()
-                logstr += self.doMerge(fullfile,lines,links,pnr,zac,accessli,xferli,insert_replace)
-                WranglerLogger.debug(logstr)
+        fullfiles = [os.path.join(path,filename) for filename in dirlist]
+        for (fullfile, suffix, parsed) in self.readTransitFiles(fullfiles):
+            lines,links,pnr,zac,accessli,xferli = parsed
+            logstr = "   Reading %s" % os.path.basename(fullfile)
+            logstr += self.doMerge(fullfile,lines,links,pnr,zac,accessli,xferli,insert_replace)
+            WranglerLogger.debug(logstr)
 
     @staticmethod
     def initializeTransitCapacity(directory="."):
@@ -754,7 +1282,9 @@ class TransitNetwork(Network):
         type from that data are used to calculate delay for the given *complexDelayModes*.
         
         When *MSAweight* < 1.0, then the delay is modified
-        to be a linear combination of (prev delay x (1.0-*MSAweight*)) + (new delay x *MSAweight*))
+        to be a linear combination of (prev delay x (1.0-*MSAweight*)) + (new delay x *MSAweight*)),
+        where the prev delays come from *previousNet*.  That's either the previous iteration's
+        :py:class:`TransitNetwork` or, to avoid reading that in again, an :py:class:`MSAState` made from it.
         
         *logPrefix* is a string used for logging: this method appends to the following files:
         
@@ -766,6 +1296,10 @@ class TransitNetwork(Network):
         
         When *stripTimeFacRunTimeAttrs* is passed as TRUE, TIMEFAC and RUNTIME is stripped for ALL
         modes.  Otherwise it's ignored.
+
+        The stops of all the lines are looked up before any of them are changed, so errors like an invalid
+        *timeperiod* for the complex delays, an unknown complex dwell or a line missing from *previousNet*
+        are raised before any line is stripped or delayed and before any per-stop warnings are logged.
         """
 
         # Use own links and, if passed, additionaLinkFile to form linSet, which is the set of
@@ -779,7 +1313,7 @@ class TransitNetwork(Network):
 
         if additionalLinkFile:
             linknet = TransitNetwork(self.champVersion)
-            linknet.parser = TransitParser(transit_file_def, verbosity=0)
+            linknet.parser = TransitNetwork.createParser()
             f = open(additionalLinkFile, 'r');
             junk,additionallinks,junk,junk,junk,junk = \
                 linknet.parseAndPrintTransitFile(f.read(), verbosity=0)
@@ -829,11 +1363,102 @@ class TransitNetwork(Network):
                 WranglerLogger.debug("Reversed line %s to line %s" % (str(self.lines[line_idx]), str(reverse_line)))                
                 self.lines.insert(line_idx+1,reverse_line)
                 line_idx += 2
+
+            self.reindexLines()
                         
 
-        # iterate through my lines
+        # resolve the vehicle types for the simple dwells (see findSimpleDwellDelay) in one go
+        TransitNetwork.capacity.compileLineTable([line.name for line in self.lines if isinstance(line,TransitLine)], ["AM"])
+
+        # iterate through my lines, finding the stops that get a delay
+        lineStops = [] # (line, simpleDwellDelay or None if no service, [stop node index, ...], turn off access?, complex delay?)
+        links     = [] # (line name, A, B, SEQ) of the trnAsgnTable links to look up, or None
         for line in self:
 
+            # Passing on all the lines that do not have service during the specific time of day
+            if timeperiod in TransitLine.HOURS_PER_TIMEPERIOD and line.getFreq(timeperiod) == 0.0:
+                lineStops.append((line, None, [], False, False))
+                continue
+
+            simpleDwellDelay = self.findSimpleDwellDelay(line)
+
+            # dwell delay for stop nodes only, but not the last stop (end of the line)
+            # and not linkSet nodes - don't add delay 'cos that's inherent to the link
+            nodeids  = line.listNodeIds(ignoreStops=False)
+            stopIdxs = [nodeIdx for nodeIdx in range(len(nodeids)-1)
+                        if nodeids[nodeIdx] > 0 and nodeids[nodeIdx] not in linkSet]
+
+            # turn off access?  complex delay?
+            turnOffAccess = transitAssignmentData and int(line.attr["MODE"]) in complexAccessModes
+            complexDelay  = transitAssignmentData and int(line.attr["MODE"]) in complexDelayModes
+            lineStops.append((line, simpleDwellDelay, stopIdxs, turnOffAccess, complexDelay))
+
+            # the links into and out of each stop
+            if turnOffAccess or complexDelay:
+                nodeids = map(abs, nodeids)
+                for nodeIdx in stopIdxs:
+                    links.append((line.name, nodeids[nodeIdx-1], nodeids[nodeIdx], nodeIdx) if nodeIdx>0 else None)
+                    links.append((line.name, nodeids[nodeIdx], nodeids[nodeIdx+1], nodeIdx+1))
+
+        # look up the load factors, boards and exits for all the stops at once
+        if len(links) > 0:
+            rows     = transitAssignmentData.lookupLinkRows(*zip(*[link if link else ("", 0, 0, 0) for link in links]))
+            found    = (rows >= 0) & numpy.array([link != None for link in links])
+            rows     = numpy.where(found, rows, 0)
+            table    = transitAssignmentData.trnAsgnTable.fields
+            loads    = numpy.where(found, table["LOAD"][rows], 0.0)
+            boards   = numpy.where(found, table["AB_BRDA"][rows].astype(float), 0.0)
+            exits    = numpy.where(found, table["AB_XITB"][rows].astype(float), 0.0)
+
+        # compute the complex dwell delays, all at once:
+        # (prev delay x (1.0-MSAweight)) + (new delay x MSAweight)
+        # where new delay is (delay_per_board x boards + delay_per_alight x exits)/vehicles + delay_const
+        complexKeyIdxs = [] # index into keys for each complex delay stop
+        complexParams  = [] # (vehiclesPerPeriod, delay_const, delay_per_board, delay_per_alight, existing delay) per stop
+        missingDelays  = [] # node num if the stop had no previous delay, or None
+        previousDelays = None # MSAState for previousNet, made when first needed
+        keyIdx = 0
+        for (line, simpleDwellDelay, stopIdxs, turnOffAccess, complexDelay) in lineStops:
+            if not (turnOffAccess or complexDelay): continue
+            if complexDelay and len(stopIdxs) > 0:
+                vehiclesPerPeriod = line.vehiclesPerPeriod(timeperiod)
+                if vehiclesPerPeriod == 0: raise ZeroDivisionError("float division by zero")
+                (delay_const,delay_per_board,delay_per_alight) = transitAssignmentData.capacity.getComplexDwells(line.name, timeperiod)
+                if MSAweight < 1.0:
+                    if previousDelays is None:
+                        previousDelays = previousNet if isinstance(previousNet, MSAState) else MSAState(previousNet)
+                    (previousIds, previousLineDelays) = previousDelays.lineDelays(line.name)
+                for nodeIdx in stopIdxs:
+                    existingDelay = 0.0
+                    missingDelay  = None
+                    if MSAweight < 1.0:
+                        existingDelay = previousLineDelays[nodeIdx]
+                        if existingDelay != existingDelay: # NaN: no DELAY
+                            missingDelay  = str(previousIds[nodeIdx])
+                            existingDelay = 0.0 # this can happen if no boards/alights and const=0
+                    complexParams.append((vehiclesPerPeriod, delay_const, delay_per_board, delay_per_alight, existingDelay))
+                    complexKeyIdxs.append(keyIdx)
+                    missingDelays.append(missingDelay)
+                    keyIdx += 2
+            else:
+                keyIdx += 2*len(stopIdxs)
+
+        if len(complexParams) > 0:
+            params     = numpy.array(complexParams, dtype=float)
+            stopBoards = boards[numpy.array(complexKeyIdxs)+1]  # on the link out of the stop
+            stopExits  = exits[numpy.array(complexKeyIdxs)]     # on the link into the stop
+            (vehiclesPerPeriod, delay_const, delay_per_board, delay_per_alight, existingDelay) = params.T
+            dwellDelays = (1.0-MSAweight)*existingDelay + \
+                          MSAweight*((delay_per_board*stopBoards/vehiclesPerPeriod) +
+                                     (delay_per_alight*stopExits/vehiclesPerPeriod) +
+                                     delay_const)
+            dwellBucketNums = numpy.floor(dwellDelays/DWELL_BUCKET_SIZE).astype(int).tolist()
+            dwellDelays = dwellDelays.tolist()
+
+        # write them back to the nodes
+        keyIdx     = 0
+        complexIdx = 0
+        for (line, simpleDwellDelay, stopIdxs, turnOffAccess, complexDelay) in lineStops:
             totalLineDwell[line.name]   = 0.0
             totalClosedNodes[line.name] = 0
 
@@ -845,35 +1470,25 @@ class TransitNetwork(Network):
                 if "TIMEFAC" in line.attr:
                     WranglerLogger.debug("Stripping TIMEFAC from %s" % line.name)                    
                     del line.attr["TIMEFAC"]
-            
-            # Passing on all the lines that do not have service during the specific time of day
-            if timeperiod in TransitLine.HOURS_PER_TIMEPERIOD and line.getFreq(timeperiod) == 0.0: continue
-                   
-                
-            simpleDwellDelay = self.findSimpleDwellDelay(line)
 
-            for nodeIdx in range(len(line.n)):
+            # no service during this time period
+            if simpleDwellDelay is None: continue
 
-                # linkSet nodes exempt - don't add delay 'cos that's inherent to the link
-                if int(line.n[nodeIdx].num) in linkSet: continue
-                # last stop - no delay, end of the line
-                if nodeIdx == len(line.n)-1: continue
-                # dwell delay for stop nodes only
-                if not line.n[nodeIdx].isStop(): continue
-                
+            if complexDelay and len(stopIdxs) > 0:
+                (delay_const,delay_per_board,delay_per_alight) = complexParams[complexIdx][1:4]
+                complexLog = "line name=%s, timeperiod=%s, delay_const,perboard,peralight=%.3f, %.3f, %.3f" % \
+                             (line.name, timeperiod, delay_const, delay_per_board, delay_per_alight)
+            simpleBucketNum = int(math.floor(simpleDwellDelay/DWELL_BUCKET_SIZE))
+
+            for nodeIdx in stopIdxs:
                 # =======================================================================================
                 # turn off access?
-                if (transitAssignmentData and 
-                    (nodeIdx>0) and 
-                    (int(line.attr["MODE"]) in complexAccessModes)):
-                    try:                  
-                        loadFactor  = transitAssignmentData.loadFactor(line.name,
-                                                                       abs(int(line.n[nodeIdx-1].num)),
-                                                                       abs(int(line.n[nodeIdx].num)),
-                                                                       nodeIdx)
-                    except:
+                if turnOffAccess and nodeIdx>0:
+                    if found[keyIdx]:
+                        loadFactor = loads[keyIdx]
+                    else:
                         WranglerLogger.warning("Failed to get loadfactor for (%s, A=%d B=%d SEQ=%d); assuming 0" % 
-                          (line.name, abs(int(line.n[nodeIdx-1].num)), abs(int(line.n[nodeIdx].num)),nodeIdx))
+                          (line.name, line.n[nodeIdx-1].number, line.n[nodeIdx].number,nodeIdx))
                         loadFactor = 0.0
                         
                     # disallow boardings (ACCESS=2) (for all nodes except first stop) 
@@ -886,65 +1501,37 @@ class TransitNetwork(Network):
                 # Simple delay if
                 # - we do not have boards/alighting data,
                 # - or if we're not configured to do a complex delay operation
-                if not transitAssignmentData or (int(line.attr["MODE"]) not in complexDelayModes):
+                if not complexDelay:
                     if simpleDwellDelay > 0:
                         line.n[nodeIdx].attr["DELAY"] =  str(simpleDwellDelay)
                     totalLineDwell[line.name]         += simpleDwellDelay
-                    dwellBuckets[int(math.floor(simpleDwellDelay/DWELL_BUCKET_SIZE))] += 1
+                    dwellBuckets[simpleBucketNum]     += 1
+                    if turnOffAccess: keyIdx += 2
                     continue
                              
                 # Complex Delay
                 # =======================================================================================
-                vehiclesPerPeriod = line.vehiclesPerPeriod(timeperiod)
-                try:
-                    boards = transitAssignmentData.numBoards(line.name,
-                                                             abs(int(line.n[nodeIdx].num)),
-                                                             abs(int(line.n[nodeIdx+1].num)),
-                                                             nodeIdx+1)
-                except:
+                if not found[keyIdx+1]:
                     WranglerLogger.warning("Failed to get boards for (%s, A=%d B=%d SEQ=%d); assuming 0" % 
-                          (line.name, abs(int(line.n[nodeIdx].num)), abs(int(line.n[nodeIdx+1].num)),nodeIdx+1))
-                    boards = 0
+                          (line.name, line.n[nodeIdx].number, line.n[nodeIdx+1].number,nodeIdx+1))
 
                 # At the first stop, vehicle has no exits and load factor
-                if nodeIdx == 0:             
-                    exits       = 0
-                else:
-                    try:
-                        exits       = transitAssignmentData.numExits(line.name,
-                                                                     abs(int(line.n[nodeIdx-1].num)),
-                                                                     abs(int(line.n[nodeIdx].num)),
-                                                                     nodeIdx)
-                    except:
-                        WranglerLogger.warning("Failed to get exits for (%s, A=%d B=%d SEQ=%d); assuming 0" % 
-                          (line.name, abs(int(line.n[nodeIdx-1].num)), abs(int(line.n[nodeIdx].num)),nodeIdx))
-                        exits = 0
+                if nodeIdx > 0 and not found[keyIdx]:
+                    WranglerLogger.warning("Failed to get exits for (%s, A=%d B=%d SEQ=%d); assuming 0" % 
+                          (line.name, line.n[nodeIdx-1].number, line.n[nodeIdx].number,nodeIdx))
 
+                if missingDelays[complexIdx] != None:
+                    WranglerLogger.debug("No delay found for line %s node %s -- using 0" % 
+                                         (line.name, missingDelays[complexIdx]))
 
-                
-                if MSAweight < 1.0:
-                    try:
-                        existingDelay = float(previousNet.line(line.name).n[nodeIdx].attr["DELAY"])
-                    except:
-                        WranglerLogger.debug("No delay found for line %s node %s -- using 0" % 
-                                             (line.name, previousNet.line(line.name).n[nodeIdx].num))
-                        existingDelay = 0.0 # this can happen if no boards/alights and const=0
-                else:
-                    MSAdelay = -99999999
-                    existingDelay = 0.0
+                WranglerLogger.debug(complexLog)
 
-                (delay_const,delay_per_board,delay_per_alight) = transitAssignmentData.capacity.getComplexDwells(line.name, timeperiod)
-
-                WranglerLogger.debug("line name=%s, timeperiod=%s, delay_const,perboard,peralight=%.3f, %.3f, %.3f" %
-                                     (line.name, timeperiod, delay_const, delay_per_board, delay_per_alight))
-
-                dwellDelay = (1.0-MSAweight)*existingDelay + \
-                             MSAweight*((delay_per_board*float(boards)/vehiclesPerPeriod) +
-                                        (delay_per_alight*float(exits)/vehiclesPerPeriod) +
-                                        delay_const)
+                dwellDelay = dwellDelays[complexIdx]
                 line.n[nodeIdx].attr["DELAY"]   ="%.3f" % dwellDelay 
                 totalLineDwell[line.name]       += dwellDelay
-                dwellBuckets[int(math.floor(dwellDelay/DWELL_BUCKET_SIZE))] += 1
+                dwellBuckets[dwellBucketNums[complexIdx]] += 1
+                complexIdx += 1
+                keyIdx     += 2
                 # end for each node loop
 
             statsfile.write("%s,%s,%f,%d\n" % (logPrefix, line.name, 
@@ -965,6 +1552,8 @@ class TransitNetwork(Network):
         if not TransitNetwork.capacity:
             TransitNetwork.capacity = TransitCapacity()
         
+        TransitNetwork.capacity.compileLineTable([line.name.upper() for line in self.lines if isinstance(line,TransitLine)])
+
         failures = 0
         for line in self:
             linename = line.name.upper()
@@ -988,6 +1577,9 @@ class TransitNetwork(Network):
         """
         Checks the validity of each of the transit links against the given cubeNetFile.
         That is, each link in a .lin should either be in the roadway network, or in a .link file.
+
+        Returns a list of the invalid links found, as (A node, B node, line name) tuples in the
+        order they're encountered; each is also noted in the debug log.
         """
         import Cube
     
@@ -998,6 +1590,15 @@ class TransitNetwork(Network):
                                         links_csv=os.path.join(os.getcwd(),"cubenet_validate_links.csv"),
                                         nodes_csv=os.path.join(os.getcwd(),"cubenet_validate_nodes.csv"),
                                         exportIfExists=True)
+
+        # the off-road links, in both directions for two-way links
+        offroad_links = set()
+        for link in self.links:
+            if not isinstance(link,TransitLink): continue
+            offroad_links.add((link.Anode, link.Bnode))
+            if not link.isOneway(): offroad_links.add((link.Bnode, link.Anode))
+
+        invalid_links = []
         for line in self:
             
             # todo fix this
@@ -1022,24 +1623,16 @@ class TransitNetwork(Network):
                     # it's a road link
                     if (a,b) in links_dict: continue
                     
-                    found_link = False
-                    for link in self.links:
-                        if not isinstance(link,TransitLink): continue
-                        
-                        if link.Anode == a and link.Bnode == b:
-                            found_link = True
-                            break
-                        
-                        if not link.isOneway() and link.Anode == b and link.Bnode == a:
-                            found_link = True
-                            break
-                    
-                    if found_link: continue
+                    # it's an off-road link
+                    if (a,b) in offroad_links: continue
 
                     WranglerLogger.debug("TransitNetwork.checkValidityOfLinks: (%d, %d) not in the roadway network nor in the off-road links (line %s)" % (a, b, line.name))
+                    invalid_links.append((a, b, line.name))
                 
                 last_node = node
 
+        return invalid_links
+
     def applyProject(self, parentdir, networkdir, gitdir, projectsubdir=None, **kwargs):
         """
         Apply the given project by calling import and apply.  Currently only supports
@@ -1063,6 +1656,9 @@ class TransitNetwork(Network):
         except:
             print "Failed to exec [%s]" % evalstr
             raise
+
+        # the project may have changed self.lines directly
+        self.reindexLines()
                
         evalstr = "dir(%s)" % projectname
         projectdir = eval(evalstr)
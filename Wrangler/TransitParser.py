@@ -21,11 +21,13 @@ import re
 
 from .Linki import Linki
 from .Logger import WranglerLogger
+from .NetworkException import NetworkException
 from .Node import Node
 from .PNRLink import PNRLink
 from .Supplink import Supplink
 from .TransitLine import TransitLine
 from .TransitLink import TransitLink
+from .TransitTokenizer import TransitTokenizer
 from .ZACLink import ZACLink
 
 __all__ = [ 'TransitParser' ]
@@ -245,6 +247,16 @@ class TransitParser(Parser):
     def buildProcessor(self):
         return self.tfp
 
+    def iterparse(self, fileobj):
+        """ Generator that yields (listname, item) for each comment or object in the transit file
+            *fileobj*, a record at a time, without reading the whole file or building the parse tree.
+            simpleparse needs the whole text, so this is done by a :py:class:`TransitTokenizer`;
+            see :py:meth:`TransitTokenizer.iterparse`.
+        """
+        tokenizer = TransitTokenizer(self.verbosity)
+        tokenizer.liType = self.tfp.liType
+        return tokenizer.iterparse(fileobj)
+
     def convertLineData(self):
         """ Convert the parsed tree of data into a usable python list of transit lines
             returns list of comments and transit line objects
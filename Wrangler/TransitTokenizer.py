@@ -0,0 +1,523 @@
+# SFCTA NetworkWrangler: Wrangles transit and road networks from SF-CHAMP
+# Copyright (C) 2018 San Francisco County Transportation Authority
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+
+from .Linki import Linki
+from .Logger import WranglerLogger
+from .NetworkException import NetworkException
+from .Node import Node
+from .PNRLink import PNRLink
+from .Supplink import Supplink
+from .TransitLine import TransitLine
+from .TransitLink import TransitLink
+from .ZACLink import ZACLink
+
+__all__ = [ 'TransitTokenizer' ]
+
+# TOKEN DEFINITIONS ------------------------------------------------------------------------------
+# These mirror the productions in TransitParser.transit_file_def (and the simpleparse common
+# numbers/strings/comments it uses) one for one; if you change the grammar, change these too.
+_WS         = r'[ \t\r\n]*'
+_SEMI       = r';[^\n]*(?:\n|\Z)'
+_CCOMMENT   = r'/\*.*?\*/'
+_INT        = r'[-+]*[0-9]+'
+_FLOAT      = r'[-+]*[0-9]*\.[0-9]*(?:[eE][-+]*[0-9]+)?'
+_VALUE      = r'''[a-zA-Z0-9.]+|'(?:[^\\']|\\.)*'|"(?:[^\\"]|\\.)*"'''
+_NODEPAIR   = _INT + r'[ \t]*[-,][ \t]*' + _INT
+_NUMSEQ     = _INT + r'(?:[ \t]*[-,][ \t]*' + _INT + r')*'
+_ATTR_END   = _WS + r',?' + _WS
+
+# whitespace?, smcw? -- the start of every record
+_LEAD       = re.compile(_WS + r'(?P<smcw>(?:(?:' + _SEMI + r'|' + _CCOMMENT + r')' + _WS + r')*)', re.S)
+_SEMI_RE    = re.compile(_SEMI)
+_KEYWORD    = re.compile(r'(LINE|LINK|PNR|ZONEACCESS|SUPPLINK)[ \t\r\n]+', re.I)
+
+_LIN_ATTR   = re.compile(r'(allstops|color|freq\[[1-5]\]|mode|name|oneway|owner|runtime|timefac|xyspeed|longname)' +
+                         _WS + r'=' + _WS + r'(' + _VALUE + r')' + _WS + r',' + _WS +
+                         r'((?:' + _SEMI + r')*)', re.I|re.S)
+# the "N" in lin_nodestart is case-sensitive, so no re.I here
+_LIN_NODE   = re.compile(r'(?:' + _WS + r'N' + _WS + r'=)?' + _WS + r'(' + _INT + r')[ \t]*,?[ \t]*(?:' + _SEMI + r')?' + _WS)
+_LIN_NODEATTR = re.compile(r'(access_c|access|delay|xyspeed|timefac)' +
+                           _WS + r'=' + _WS + r'(' + _VALUE + r')' + _ATTR_END +
+                           r'((?:' + _SEMI + r')*)', re.I|re.S)
+_LINK_ATTR  = re.compile(r'(?:(dist|speed|time|oneway)' + _WS + r'=' + _WS + r'(' + _VALUE + r')|' +
+                         r'(nodes)' + _WS + r'=' + _WS + r'(' + _NODEPAIR + r')|' +
+                         r'(modes)' + _WS + r'=' + _WS + r'(' + _NUMSEQ + r'))' + _ATTR_END, re.I|re.S)
+_PNR_ATTR   = re.compile(r'(?:(time|maxtime|distfac|cost)' + _WS + r'=' + _WS + r'(' + _VALUE + r')|' +
+                         r'(node)' + _WS + r'=' + _WS + r'(' + _NODEPAIR + r'|' + _INT + r')|' +
+                         r'(zones)' + _WS + r'=' + _WS + r'(' + _NUMSEQ + r'))' + _ATTR_END +
+                         r'((?:' + _SEMI + r')*)', re.I|re.S)
+_ZAC_ATTR   = re.compile(r'(?:link' + _WS + r'=' + _WS + r'(' + _NODEPAIR + r')|' +
+                         r'(mode)' + _WS + r'=' + _WS + r'(' + _VALUE + r'))' + _ATTR_END, re.I|re.S)
+_SUPPLINK_ATTR = re.compile(r'(?:(mode|dist|speed|oneway|time)' + _WS + r'=' + _WS + r'(' + _VALUE + r')|' +
+                            r'n' + _WS + r'=' + _WS + r'(' + _NODEPAIR + r'))' + _ATTR_END, re.I|re.S)
+# nodenumA may not give up digits to nodenumB, hence the lookahead
+_ACCESSLI   = re.compile(r'(' + _INT + r')(?![0-9])[ \t]*(' + _INT + r')[ \t]*(wnr|pnr)?[ \t]*' +
+                         r'(?:(' + _FLOAT + r')|(' + _INT + r'))?[ \t]*(' + _SEMI + r')?', re.I)
+_TRAILER    = re.compile(_WS + r'((?:' + _SEMI + r')*)')
+
+
+class TransitTokenizer(object):
+    """
+    Hand-written, single-pass replacement for the simpleparse :py:class:`TransitParser`.
+
+    Each record (LINE, LINK, PNR, ZONEACCESS, SUPPLINK or access/xfer link) is matched with a
+    handful of compiled regular expressions and turned into :py:class:`TransitLine`,
+    :py:class:`TransitLink`, :py:class:`PNRLink`, :py:class:`ZACLink`, :py:class:`Supplink` or
+    :py:class:`Linki` objects right away, without building the intermediate tag tree.
+
+    It has the same interface as :py:class:`TransitParser` as far as :py:class:`TransitNetwork`
+    is concerned (:py:meth:`parse` then the ``convert*Data()`` methods) and produces the same
+    objects -- quirks included -- so the two are interchangeable.  Set *liType* to ``access`` or
+    ``xfer`` to say what kind of links the access/xfer records are.
+    """
+
+    def __init__(self, verbosity=1):
+        self.verbosity = verbosity
+        self.liType    = ''
+        self._reset()
+
+    def _reset(self):
+        self.lines      = []
+        self.links      = []
+        self.pnrs       = []
+        self.zacs       = []
+        self.accesslis  = []
+        self.xferlis    = []
+        self.supplinks  = []
+
+        # conversion state, carried from one record to the next like the convert*Data() loops do
+        self.currentRoute       = None
+        self.currentLink        = None
+        self.currentPNR         = None
+        self.currentZAC         = None
+        self.currentSupplink    = None
+        self.currentLineComment = None
+
+    def parse(self, trntxt, production="transit_file"):
+        """
+        Parses the full text of a transit file.  Returns the same
+        ``(success, children, nextcharacter)`` triple as the simpleparse parser; here *children*
+        is a list of the record types read.
+        """
+        if production != "transit_file":
+            raise NetworkException("TransitTokenizer only knows how to parse a transit_file, not %s" % production)
+
+        self._reset()
+        children = []
+        pos = 0
+        while True:
+            record = self._matchRecord(trntxt, pos)
+            if not record: break
+
+            (tag, endpos, parts) = record
+            if self.verbosity>=1:
+                print tag, pos, endpos
+            self._convertRecord(tag, parts)
+            children.append(tag)
+            pos = endpos
+
+        # transit_file requires at least one record
+        if len(children)==0:
+            return (0, [], 0)
+
+        # then smcw*, whitespace*
+        nextcharacter = _LEAD.match(trntxt, pos).end()
+        self._finish()
+        return (1, children, nextcharacter)
+
+    def iterparse(self, fileobj, chunksize=65536):
+        """
+        Generator that reads the transit file *fileobj* a chunk at a time and yields
+        ``(listname, item)`` for each comment string or object as soon as it is complete,
+        in file order.  *listname* is the :py:class:`TransitNetwork` list the item belongs in:
+        one of ``lines``, ``links``, ``pnrs``, ``zacs``, ``accessli``, ``xferli`` or ``supplinks``.
+
+        Only the records not yet known to be complete are kept in memory.
+        Raises a :py:class:`NetworkException` if the file doesn't parse all the way through.
+        """
+        self._reset()
+        buf         = ''
+        offset      = 0     # file position of buf[0]
+        readsize    = chunksize
+        numrecords  = 0
+        eof         = False
+
+        while not eof:
+            # read whole lines so tokens don't get split
+            chunk = fileobj.read(readsize)
+            if chunk and not chunk.endswith('\n'):
+                chunk += fileobj.readline()
+            if not chunk: eof = True
+            buf += chunk
+
+            records = []
+            pos = 0
+            while True:
+                record = self._matchRecord(buf, pos)
+                if not record: break
+                records.append((pos, record))
+                pos = record[1]
+
+            # A record could still grow with more text (e.g. ZONEACCESS followed by "LINK ="),
+            # so it's only complete once the two records after it have been matched.
+            if not eof: records = records[:-2]
+
+            # nothing complete yet -- read more next time
+            readsize = chunksize if records else readsize*2
+
+            for (start, (tag, endpos, parts)) in records:
+                if self.verbosity>=1:
+                    print tag, offset+start, offset+endpos
+                self._convertRecord(tag, parts)
+                numrecords += 1
+                for item in self._drain(): yield item
+
+            if records and not eof:
+                consumed = records[-1][1][1]
+                buf      = buf[consumed:]
+                offset  += consumed
+
+        # then smcw*, whitespace*
+        nextcharacter = 0
+        pos = records[-1][1][1] if records else 0
+        if numrecords > 0:
+            nextcharacter = _LEAD.match(buf, pos).end()
+        if nextcharacter != len(buf):
+            raise NetworkException("Did not successfully read the whole file; got to nextcharacter=%d out of %d total; next unread text = [%s]" %
+                                   (offset+nextcharacter, offset+len(buf), buf[nextcharacter:nextcharacter+50]))
+        self._finish()
+        for item in self._drain(): yield item
+
+    def _drain(self):
+        """
+        Yields ``(listname, item)`` for everything converted so far, and empties the lists.
+        """
+        for (listname, rows) in (('lines',    self.lines),
+                                 ('links',    self.links),
+                                 ('pnrs',     self.pnrs),
+                                 ('zacs',     self.zacs),
+                                 ('accessli', self.accesslis),
+                                 ('xferli',   self.xferlis),
+                                 ('supplinks',self.supplinks)):
+            for item in rows:
+                yield (listname, item)
+            del rows[:]
+
+    def _matchRecord(self, buf, pos):
+        """
+        Matches the record starting at *pos* in *buf*.
+        Returns None if there isn't one, or (tag, end position, parts) where
+        parts is a list of tuples describing the pieces of the record.
+        """
+        m     = _LEAD.match(buf, pos)
+        smcw  = m.group('smcw')
+        pos   = m.end()
+        parts = [('smcw', smcw)] if smcw else []
+
+        k = _KEYWORD.match(buf, pos)
+        if not k:
+            a = _ACCESSLI.match(buf, pos)
+            if not a: return None
+            parts.append(('accessli', a.groups()))
+            return ('accessli', a.end(), parts)
+
+        keyword = k.group(1).upper()
+        pos     = k.end()
+
+        if keyword == "LINE":
+            attr = _LIN_ATTR.match(buf, pos)
+            while attr:
+                parts.append(('lin_attr', attr.group(1), attr.group(2), self._lastComment(attr.group(3))))
+                pos  = attr.end()
+                attr = _LIN_ATTR.match(buf, pos)
+
+            node = _LIN_NODE.match(buf, pos)
+            while node:
+                pos       = node.end()
+                nodeattrs = []
+                nodeattr  = _LIN_NODEATTR.match(buf, pos)
+                while nodeattr:
+                    nodeattrs.append((nodeattr.group(1), nodeattr.group(2), self._lastComment(nodeattr.group(3))))
+                    pos      = nodeattr.end()
+                    nodeattr = _LIN_NODEATTR.match(buf, pos)
+                parts.append(('lin_node', node.group(1), nodeattrs))
+                node = _LIN_NODE.match(buf, pos)
+
+            # whitespace?
+            pos = _TRAILER.match(buf, pos).start(1)
+            return ('line', pos, parts)
+
+        if keyword == "LINK":
+            attr = _LINK_ATTR.match(buf, pos)
+            while attr:
+                parts.append(('link_attr', attr.groups()))
+                pos  = attr.end()
+                attr = _LINK_ATTR.match(buf, pos)
+            return ('link', self._matchTrailer(buf, pos, parts), parts)
+
+        if keyword == "PNR":
+            attr = _PNR_ATTR.match(buf, pos)
+            while attr:
+                parts.append(('pnr_attr', attr.groups()[:6], self._lastComment(attr.group(7))))
+                pos  = attr.end()
+                attr = _PNR_ATTR.match(buf, pos)
+            # whitespace?
+            pos = _TRAILER.match(buf, pos).start(1)
+            return ('pnr', pos, parts)
+
+        if keyword == "ZONEACCESS":
+            attr = _ZAC_ATTR.match(buf, pos)
+            while attr:
+                parts.append(('zac_attr', attr.groups()))
+                pos  = attr.end()
+                attr = _ZAC_ATTR.match(buf, pos)
+            return ('zac', self._matchTrailer(buf, pos, parts), parts)
+
+        # SUPPLINK
+        attr = _SUPPLINK_ATTR.match(buf, pos)
+        while attr:
+            parts.append(('supplink_attr', attr.groups()))
+            pos  = attr.end()
+            attr = _SUPPLINK_ATTR.match(buf, pos)
+        return ('supplink', self._matchTrailer(buf, pos, parts), parts)
+
+    def _matchTrailer(self, buf, pos, parts):
+        """
+        Matches the whitespace?, semicolon_comment* that ends a link, zac or supplink.
+        Appends the comments to *parts* and returns the end position.
+        """
+        m = _TRAILER.match(buf, pos)
+        if not m.group(1): return m.start(1)
+        for comment in _SEMI_RE.findall(m.group(1)):
+            parts.append(('semicolon_comment', comment))
+        return m.end()
+
+    def _lastComment(self, comments):
+        """
+        Returns the last of the semicolon comments in *comments*, stripped, or None if there are none.
+        """
+        if not comments: return None
+        return _SEMI_RE.findall(comments)[-1].strip()
+
+    def _convertRecord(self, tag, parts):
+        """
+        Converts the *parts* of a matched record into objects, just like the ``convert*Data()``
+        methods of :py:class:`TransitParser` do for the tag tree.
+        """
+        if   tag == 'line':     self._convertLine(parts)
+        elif tag == 'link':     self._convertLink(parts)
+        elif tag == 'pnr':      self._convertPNR(parts)
+        elif tag == 'zac':      self._convertZAC(parts)
+        elif tag == 'supplink': self._convertSupplink(parts)
+        elif tag == 'accessli':
+            if self.liType=="access":
+                self._convertLinki(parts, self.accesslis)
+            elif self.liType=="xfer":
+                self._convertLinki(parts, self.xferlis)
+            else:
+                raise NetworkException("Found access or xfer link without classification")
+
+    def _convertLine(self, parts):
+        for part in parts:
+            # Add comments as simple strings
+            if part[0] == 'smcw':
+                cmt = part[1].strip()
+                if not cmt==';;<<Trnbuild>>;;':
+                    self.lines.append(cmt)
+                continue
+
+            # Handle Line attributes
+            if part[0] == 'lin_attr':
+                (key, value, comment) = part[1:]
+                self.currentLineComment = comment
+
+                # If this is a NAME attribute, we need to start a new TransitLine!
+                if key=='NAME':
+                    if self.currentRoute:
+                        self.lines.append(self.currentRoute)
+                    self.currentRoute = TransitLine(name=value)
+                else:
+                    self.currentRoute[key] = value  # Just store all other attributes
+
+                # And save line comment if there is one
+                if comment: self.currentRoute.comment = comment
+                continue
+
+            # Handle Node list
+            node = Node(part[1])
+            for (key, value, comment) in part[2]:
+                # the last comment seen sticks, as it does in TransitParser.convertLineData()
+                if comment: self.currentLineComment = comment
+                node[key] = value
+                if self.currentLineComment: node.comment = self.currentLineComment
+            self.currentRoute.n.append(node)
+
+    def _convertLink(self, parts):
+        for part in parts:
+            # Add comments as simple strings:
+            if part[0] in ('smcw','semicolon_comment'):
+                if self.currentLink:
+                    self.currentLink.comment = " "+part[1].strip()  # Link comment
+                    self.links.append(self.currentLink)
+                    self.currentLink = None
+                else:
+                    self.links.append(part[1].strip())  # Line comment
+                continue
+
+            # Link records
+            (name, value, nodes, nodepair, modes, numseq) = part[1]
+            if name:
+                self.currentLink[name] = value
+            elif nodes:
+                # If this is a NODES attribute, we need to start a new TransitLink.
+                if nodes in ('nodes','NODES'):
+                    if self.currentLink: self.links.append(self.currentLink)
+                    self.currentLink = TransitLink()
+                self.currentLink.setId(nodepair)
+            else:
+                self.currentLink[modes] = numseq
+
+    def _convertPNR(self, parts):
+        for part in parts:
+            # Textline Comments
+            if part[0] == 'smcw':
+                # Line comment; thus existing PNR must be finished.
+                if self.currentPNR:
+                    self.pnrs.append(self.currentPNR)
+                    self.currentPNR = None
+                self.pnrs.append(part[1].strip())  # Append line-comment
+                continue
+
+            # PNR records
+            (name, value, node, nodeid, zones, numseq) = part[1]
+            if name:
+                self.currentPNR[name.upper()] = value
+            elif node:
+                # If this is a NODE attribute, we need to start a new PNR.
+                if node in ('node','NODE'):
+                    if self.currentPNR:
+                        self.pnrs.append(self.currentPNR)
+                    self.currentPNR = PNRLink()
+                self.currentPNR.id = nodeid
+                self.currentPNR.parseID()
+            else:
+                self.currentPNR[zones.upper()] = numseq
+
+            if part[2]:
+                self.currentPNR.comment = ' '+part[2]
+
+    def _convertZAC(self, parts):
+        for part in parts:
+            # Textline Comments
+            if part[0] in ('smcw','semicolon_comment'):
+                if self.currentZAC:
+                    self.currentZAC.comment = ' '+part[1].strip()
+                    self.zacs.append(self.currentZAC)
+                    self.currentZAC = None
+                else:
+                    self.zacs.append(part[1].strip())
+                continue
+
+            (nodepair, name, value) = part[1]
+            if nodepair:
+                # Save old ZAC
+                if self.currentZAC: self.zacs.append(self.currentZAC)
+                # Start new ZAC
+                self.currentZAC = ZACLink()
+                self.currentZAC.id = nodepair
+            else:
+                self.currentZAC[name] = value
+
+    def _convertSupplink(self, parts):
+        # Each SUPPLINK record is a new Supplink
+        if self.currentSupplink: self.supplinks.append(self.currentSupplink)
+        self.currentSupplink = Supplink()
+
+        for part in parts:
+            if part[0] == 'supplink_attr':
+                (name, value, nodepair) = part[1]
+                if name:
+                    self.currentSupplink[name] = value
+                else:
+                    self.currentSupplink.setId(nodepair)
+            else:
+                self.currentSupplink.comment = part[1].strip()
+
+    def _convertLinki(self, parts, rows):
+        for part in parts:
+            if part[0] == 'smcw':
+                rows.append(part[1].strip())
+                continue
+
+            (nodenumA, nodenumB, accesstag, distance, xferTime, comment) = part[1]
+            currentLinki = Linki()
+            rows.append(currentLinki)
+            currentLinki.A = nodenumA.strip()
+            currentLinki.B = nodenumB.strip()
+            if accesstag: currentLinki.accessType = accesstag.strip()
+            if distance:  currentLinki.distance   = distance.strip()
+            if xferTime:  currentLinki.xferTime   = xferTime.strip()
+            if comment:   currentLinki.comment    = comment.strip()
+
+    def _finish(self):
+        """
+        Stores the records still in progress at the end of the file.
+        """
+        if self.currentRoute: self.lines.append(self.currentRoute)
+        if self.currentLink:  self.links.append(self.currentLink)
+        if self.currentPNR:   self.pnrs.append(self.currentPNR)
+        if self.currentZAC:   self.zacs.append(self.currentZAC)
+        if self.currentSupplink: self.supplinks.append(self.currentSupplink)
+        self.currentRoute    = None
+        self.currentLink     = None
+        self.currentPNR      = None
+        self.currentZAC      = None
+        self.currentSupplink = None
+
+    def convertLineData(self):
+        """ Returns list of comments and transit line objects
+        """
+        return self.lines
+
+    def convertLinkData(self):
+        """ Returns list of comments and transit link objects
+        """
+        return self.links
+
+    def convertPNRData(self):
+        """ Returns list of strings and PNR objects
+        """
+        return self.pnrs
+
+    def convertZACData(self):
+        """ Returns list of strings and ZAC objects
+        """
+        return self.zacs
+
+    def convertLinkiData(self, linktype):
+        """ Returns list of strings and Linki objects for *linktype* ``access`` or ``xfer``
+        """
+        if linktype=="access":
+            return self.accesslis
+        elif linktype=="xfer":
+            return self.xferlis
+        raise NetworkException("ConvertLinkiData with invalid linktype")
+
+    def convertSupplinksData(self):
+        """ Returns list of Supplink objects
+        """
+        return self.supplinks
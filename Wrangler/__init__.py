@@ -22,22 +22,25 @@ from .Network import Network
 from .NetworkException import NetworkException
 from .PNRLink import PNRLink
 from .Supplink import Supplink
-from .TransitAssignmentData import TransitAssignmentData ##
+from .TransitAssignmentData import TransitAssignmentData, MultiPeriodTransitAssignmentData, DailyTransitAssignmentData ##
 from .TransitCapacity import TransitCapacity
 from .TransitLine import TransitLine
 from .TransitLink import TransitLink
 from .TransitNetwork import TransitNetwork
 from .TransitParser import TransitParser
+from .TransitTokenizer import TransitTokenizer
 from .HighwayNetwork import HighwayNetwork
 from .Logger import setupLogging, WranglerLogger
+from .MSAState import MSAState
 from .Node import Node
+from .NodeSequence import NodeSequence
 from .HwySpecsRTP import HwySpecsRTP
 
 
 __all__ = ['NetworkException', 'setupLogging', 'WranglerLogger',
-           'Network', 'TransitAssignmentData', 'TransitNetwork', 'TransitLine', 'TransitParser',
-           'Node', 'TransitLink', 'Linki', 'PNRLink', 'Supplink', 'HighwayNetwork', 'HwySpecsRTP',
-           'TransitCapacity',
+           'Network', 'TransitAssignmentData', 'TransitNetwork', 'TransitLine', 'TransitParser', 'TransitTokenizer',
+           'Node', 'NodeSequence', 'TransitLink', 'Linki', 'PNRLink', 'Supplink', 'HighwayNetwork', 'HwySpecsRTP',
+           'TransitCapacity', 'MSAState', 'MultiPeriodTransitAssignmentData', 'DailyTransitAssignmentData',
 ]
 
 
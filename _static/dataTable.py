@@ -152,11 +152,11 @@ class DataTable(object):
         newIndex = {}
         if fieldName:
             #check the uniqueness of the fields values
-            if len(set(self.fields[fieldName])) != self.getNumRecords():
+            values = self.fields[fieldName].tolist()
+            if len(set(values)) != self.getNumRecords():
                 raise DataTableError("The field: %s contains non unique values and therefore"
                                      "canot be set as the index" % fieldName)
-            for i, record in enumerate(self):
-                newIndex[record[fieldName]] = i
+            newIndex = dict(izip(values, xrange(len(values))))
         elif indexFunction:
             for i, record in enumerate(self):
                 newIndex[indexFunction(record)] = i
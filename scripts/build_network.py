@@ -99,6 +99,13 @@ APPLIED_PROJECTS = None
 # the TAG.  This is meant for developing a network project.
 TEST_PROJECTS = None
 
+# OPTIONAL.  Number of processes to use when parsing the transit files in PIVOT_DIR.
+TRANSIT_PARSER_PROCESSES = 1
+
+# OPTIONAL.  Directory for snapshots of the parsed PIVOT_DIR transit files, so that
+# unchanged files aren't parsed again on the next build.  Use "" to keep them next to the files.
+TRANSIT_SNAPSHOT_DIR = None
+
 CHAMPVERSION = 5.0
 CHAMP_NODE_NAMES = r'Y:\champ\util\nodes.xls'
 ###############################################################################
@@ -359,6 +366,8 @@ if __name__ == '__main__':
     LOG_FILENAME = "build%snetwork_%s_%d%s_%s.info.LOG" % ("TEST" if BUILD_MODE=="test" else "", PROJECT, YEAR, SCENARIO, NOW)
     Wrangler.setupLogging(LOG_FILENAME, LOG_FILENAME.replace("info", "debug"))
     Wrangler.TransitNetwork.capacity = Wrangler.TransitCapacity(directory=TRANSIT_CAPACITY_DIR)
+    Wrangler.TransitNetwork.parserProcesses = TRANSIT_PARSER_PROCESSES
+    Wrangler.TransitNetwork.snapshotDir     = TRANSIT_SNAPSHOT_DIR
 
     # Prepend the RTP roadway projects (if applicable -- not TEST mode and YEAR!=PIVOT_YEAR)
     NONSF_PLANBAYAREA_SPECS = None
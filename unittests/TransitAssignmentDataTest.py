@@ -0,0 +1,199 @@
+import os, shutil, sys, tempfile, unittest
+
+# test this version of Wrangler
+curdir = os.path.dirname(__file__)
+sys.path.insert(1, os.path.normpath(os.path.join(curdir, "..", "..")))
+
+import Wrangler
+from Wrangler.TransitAssignmentData import TransitAssignmentDataException
+from dataTable import DataTable, DataTableKeyError, FieldType
+
+LINE_TO_VEHICLE = """MUNTI,SF MUNI,TI,T,T - THIRD STREET,LRV2,LRV2,LRV1
+"""
+
+VEHICLE_TO_CAPACITY = """VehicleType,100%Capacity,85%Capacity,VehicleCategory,SimpleDelayPerStop,ConstDelayPerStop,DelayPerBoard,DelayPerAlight
+LRV1,119,101,LRV,0.4,0.1,0.02,0.01
+LRV2,238,202,LRV,0.5,0.2,0.03,0.015
+Motor_Std,63,53,Bus,0.3,0.05,0.04,0.02
+"""
+
+PREFIX_TO_VEHICLE = """MUN,SF MUNI,Motor_Std
+"""
+
+CSV_HEADER = "A,B,TIME,MODE,PLOT,STOP_A,STOP_B,DIST,NAME,OWNER," + \
+             "AB_VOL,AB_BRDA,AB_XITA,AB_BRDB,AB_XITB,BA_VOL,BA_BRDA,BA_XITA,BA_BRDB,BA_XITB\n"
+
+# walk to transit
+WBW_CSV = CSV_HEADER + \
+"""1,2,1.5,11,1,1,1,0.25,MUNTI,SFMUNI,10,10,0,0,0,0,0,0,0,0
+2,3,2,11,1,1,1,0.5,MUNTI,SFMUNI,10,0,0,0,0,5,0,0,0,0
+1,2,1.5,3,1,1,1,0.25,MUN30I,SFMUNI,20,20,0,0,0,0,0,0,0,0
+"""
+
+# drive to transit
+DBW_CSV = CSV_HEADER + \
+"""1,2,1.5,11,1,1,1,0.25,MUNTI,SFMUNI,5,5,,,,,,,,
+2,3,2,11,1,1,1,0.5,MUNTI,SFMUNI,5,,,,,,,,,
+1,2,1.5,3,1,1,1,0.25,MUN30I,SFMUNI,2.5,2.5,,,,,,,,
+"""
+
+# A, B, FREQ, SEQ
+WBW_DBF = [(1, 2, 10.0, 1), (2, 3, 10.0, 2), (1, 2, 7.5, 1)]
+
+class TestTransitAssignmentData(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        for (filename, text) in [("transitLineToVehicle.csv", LINE_TO_VEHICLE),
+                                 ("transitVehicleToCapacity.csv", VEHICLE_TO_CAPACITY),
+                                 ("transitPrefixToVehicle.csv", PREFIX_TO_VEHICLE)]:
+            f = open(os.path.join(self.tempdir, filename), 'w')
+            f.write(text)
+            f.close()
+        self.writeTimePeriod("AM", len(WBW_DBF))
+
+        self.alltripmodes = os.environ.get("ALLTRIPMODES")
+        os.environ["ALLTRIPMODES"] = "WBW DBW"
+        self.capacity = Wrangler.TransitCapacity(directory=self.tempdir)
+
+    def writeTimePeriod(self, timeperiod, numrows):
+        """
+        Writes the assignment files for *timeperiod* with the first *numrows* rows.
+        """
+        for (filename, text) in [("SFWBW%s.csv" % timeperiod, WBW_CSV),
+                                 ("SFDBW%s.csv" % timeperiod, DBW_CSV)]:
+            f = open(os.path.join(self.tempdir, filename), 'w')
+            f.write("".join(text.splitlines(True)[:numrows+1]))
+            f.close()
+
+        dbf = DataTable(numrows, header=(FieldType("A",    "N", 7, 0),
+                                         FieldType("B",    "N", 7, 0),
+                                         FieldType("FREQ", "F", 6, 2),
+                                         FieldType("SEQ",  "N", 3, 0)))
+        for (rownum, record) in enumerate(WBW_DBF[:numrows]): dbf[rownum] = record
+        dbf.writeAsDbf(os.path.join(self.tempdir, "SFWBW%s.dbf" % timeperiod))
+
+    def tearDown(self):
+        if self.alltripmodes is None:
+            del os.environ["ALLTRIPMODES"]
+        else:
+            os.environ["ALLTRIPMODES"] = self.alltripmodes
+        shutil.rmtree(self.tempdir)
+
+    def test_read_csvs(self):
+        tad = Wrangler.TransitAssignmentData(directory=self.tempdir, timeperiod="AM",
+                                             transitCapacity=self.capacity)
+        fields = tad.trnAsgnTable.fields
+        self.assertEqual(fields["ABNAMESEQ"].tolist(), ["1 2 MUNTI 1", "2 3 MUNTI 2", "1 2 MUN30I 1"])
+        self.assertEqual(fields["TIME"].tolist(), [150, 200, 150])
+        self.assertEqual(fields["DIST"].tolist(), [25, 50, 25])
+        self.assertEqual(fields["FREQ"].tolist(), [10.0, 10.0, 7.5])
+        self.assertEqual(fields["SYSTEM"].tolist(), ["SF MUNI"]*3)
+        self.assertEqual(fields["VEHTYPE"].tolist(), ["LRV2", "LRV2", "Motor_Std"])
+        self.assertEqual(fields["VEHCAP"].tolist(), [238, 238, 63])
+        self.assertAlmostEqual(fields["PERIODCAP"][2], 3.0*60.0*63/7.5, places=3)
+
+        # the additive fields are summed over the modes
+        self.assertEqual(fields["AB_VOL"].tolist(), [15.0, 15.0, 22.5])
+        self.assertEqual(fields["AB_BRDA"].tolist(), [15.0, 0.0, 22.5])
+        self.assertEqual(fields["BA_VOL"].tolist(), [0.0, 5.0, 0.0])
+        self.assertAlmostEqual(tad.trnAsgnTable["1 2 MUN30I 1"]["LOAD"], 22.5*0.44*7.5/(60.0*63), places=5)
+
+        self.assertEqual(tad.numBoards("MUNTI", 1, 2, 1), 15.0)
+        self.assertEqual(len(tad.aggregateTable), 2)
+        self.assertAlmostEqual(tad.aggregateTable["1 2"]["FREQ"], 1.0/(1.0/10.0 + 1.0/7.5), places=5)
+
+        # the aggregate table has the links in order, and counts the volumes twice
+        aggregate = tad.aggregateTable.fields
+        self.assertEqual(aggregate["AB"].tolist(), ["1 2", "2 3"])
+        self.assertEqual(aggregate["AB_VOL"].tolist(), [75.0, 30.0])
+        self.assertEqual(aggregate["AB_BRDA"].tolist(), [37.5, 0.0])
+        self.assertEqual(aggregate["MAXLOAD"].tolist(), [max(fields["LOAD"][0], fields["LOAD"][2]), fields["LOAD"][1]])
+        self.assertAlmostEqual(aggregate["LOAD"][0], 75.0/(fields["PERIODCAP"][0] + fields["PERIODCAP"][2]), places=5)
+
+    def test_lookup_many(self):
+        tad = Wrangler.TransitAssignmentData(directory=self.tempdir, timeperiod="AM",
+                                             transitCapacity=self.capacity)
+        self.assertEqual(tad.numBoardsMany(["MUNTI", "mun30i", "MUNTI"], [1, 1, 2], [2, 2, 3], [1, 1, 2]).tolist(),
+                         [15.0, 22.5, 0.0])
+        self.assertEqual(tad.numExitsMany(["MUNTI"], [1], [2], [1]).tolist(), [0.0])
+        self.assertEqual(tad.loadFactorMany(["MUN30I"], [1], [2], [1]).tolist(),
+                         [tad.loadFactor("MUN30I", 1, 2, 1)])
+        self.assertEqual(tad.lookupLinkRows(["MUNTI", "MUNTI", "MUN30I", "XYZ"], [2, 2, 1, 1], [3, 3, 2, 2], [2, 1, 1, 1]).tolist(),
+                         [1, -1, 2, -1])
+        self.assertEqual(tad.numBoardsMany(["MUNTI", "XYZ"], [1, 1], [2, 2], [1, 1], missing=-1.0).tolist(), [15.0, -1.0])
+        self.assertRaises(TransitAssignmentDataException, tad.numBoardsMany, ["MUNTI", "XYZ"], [1, 1], [2, 2], [1, 1])
+
+        # the single lookups go through the same index
+        self.assertEqual(tad.linkVolume("munti", 2, 3, 2), 15.0)
+        self.assertEqual(tad.linkTime("MUNTI", 2, 3, 2), 200)
+        self.assertEqual(tad.linkDistance("MUN30I", 1, 2, 1), 25)
+        self.assertRaises(TransitAssignmentDataException, tad.numExits, "MUNTI", 2, 3, 1)
+
+        # and for tables read back from the dbfs
+        tad.writeDbfs(os.path.join(self.tempdir, "line.dbf"), os.path.join(self.tempdir, "link.dbf"))
+        read = Wrangler.TransitAssignmentData(directory=self.tempdir, timeperiod="AM", transitCapacity=self.capacity,
+                                              lineLevelAggregateFilename=os.path.join(self.tempdir, "line.dbf"),
+                                              linkLevelAggregateFilename=os.path.join(self.tempdir, "link.dbf"))
+        self.assertEqual(read.numBoards("MUNTI", 1, 2, 1), 15.0)
+        self.assertEqual(read.numBoardsMany(["MUNTI", "MUN30I", "MUNTI"], [1, 1, 2], [2, 2, 3], [1, 1, 2]).tolist(),
+                         [15.0, 22.5, 0.0])
+
+    def test_read_csvs_unmatched_row(self):
+        # the rows of the subsequent csvs are joined to the first on A, B, NAME and the first csv's SEQ
+        f = open(os.path.join(self.tempdir, "SFDBWAM.csv"), 'w')
+        f.write(DBW_CSV.replace("2,3,2,11,1,1,1,0.5,MUNTI", "2,3,2,11,1,1,1,0.5,MUN30I"))
+        f.close()
+        try:
+            Wrangler.TransitAssignmentData(directory=self.tempdir, timeperiod="AM", transitCapacity=self.capacity)
+            self.fail("expected DataTableKeyError")
+        except DataTableKeyError, e:
+            self.assertEqual(str(e), "Key 2 3 MUN30I 2 does not exist")
+
+    def test_read_csvs_in_parallel(self):
+        shutil.copy(os.path.join(self.tempdir, "SFDBWAM.csv"), os.path.join(self.tempdir, "SFWMWAM.csv"))
+        os.environ["ALLTRIPMODES"] = "WBW DBW WMW"
+        serial = Wrangler.TransitAssignmentData(directory=self.tempdir, timeperiod="AM",
+                                                transitCapacity=self.capacity)
+        Wrangler.TransitAssignmentData.readerProcesses = 2
+        try:
+            parallel = Wrangler.TransitAssignmentData(directory=self.tempdir, timeperiod="AM",
+                                                      transitCapacity=self.capacity)
+        finally:
+            Wrangler.TransitAssignmentData.readerProcesses = 1
+        self.assertEqual(parallel.trnAsgnTable.fields["AB_VOL"].tolist(), [20.0, 20.0, 25.0])
+        self.assertEqual(parallel.trnAsgnTable.fields.tolist(), serial.trnAsgnTable.fields.tolist())
+        self.assertEqual(parallel.aggregateTable.fields.tolist(), serial.aggregateTable.fields.tolist())
+
+    def test_multiple_timeperiods(self):
+        self.writeTimePeriod("PM", 2)
+        # the time periods share the transit capacity, so each line is only resolved once
+        compiled = []
+        compileLine = self.capacity.compileLine
+        def countCompileLine(linename):
+            compiled.append(linename)
+            compileLine(linename)
+        self.capacity.compileLine = countCompileLine
+        byPeriod = Wrangler.MultiPeriodTransitAssignmentData(directory=self.tempdir, timeperiods=["AM", "PM"],
+                                                             transitCapacity=self.capacity)
+        self.assertEqual(sorted(compiled), ["MUN30I", "MUNTI"])
+        self.assertEqual(byPeriod.keys.tolist(), ["1 2 MUNTI 1", "2 3 MUNTI 2", "1 2 MUN30I 1"])
+        self.assertEqual(byPeriod.periodRows.tolist(), [[0, 0], [1, 1], [2, -1]])
+        self.assertEqual(byPeriod.fieldByPeriod("AB_VOL").tolist(), [[15.0, 15.0], [15.0, 15.0], [22.5, 0.0]])
+        self.assertEqual(byPeriod["PM"].timeperiod, "PM")
+
+        daily = byPeriod.daily()
+        self.assertEqual(daily.trnAsgnTable.fields["AB_VOL"].tolist(), [30.0, 30.0, 22.5])
+        self.assertEqual(daily.numBoards("MUNTI", 1, 2, 1), 30.0)
+        self.assertEqual(daily.trnAsgnTable["1 2 MUN30I 1"]["VEHTYPE"], "Motor_Std")
+        self.assertAlmostEqual(daily.trnAsgnTable["1 2 MUNTI 1"]["PERIODCAP"], 2*3.0*60.0*238/10.0, places=2)
+        self.assertAlmostEqual(daily.trnAsgnTable["1 2 MUNTI 1"]["LOAD"], 30.0/(2*3.0*60.0*238/10.0), places=5)
+        self.assertEqual(len(daily.aggregateTable), 2)
+
+        # the same from the separate time periods
+        daily = Wrangler.DailyTransitAssignmentData(tadAM=byPeriod["AM"], tadPM=byPeriod["PM"])
+        self.assertEqual(daily.timeperiods, ["AM", "PM"])
+        self.assertEqual(daily.trnAsgnTable.fields["AB_VOL"].tolist(), [30.0, 30.0, 22.5])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import os, shutil, sys, tempfile, unittest
+
+# test this version of Wrangler
+curdir = os.path.dirname(__file__)
+sys.path.insert(1, os.path.normpath(os.path.join(curdir, "..", "..")))
+
+import Wrangler
+
+LINE_TO_VEHICLE = """MUNTI,SF MUNI,TI,T,T - THIRD STREET,LRV2,LRV2,LRV1
+"""
+
+VEHICLE_TO_CAPACITY = """VehicleType,100%Capacity,85%Capacity,VehicleCategory,SimpleDelayPerStop,ConstDelayPerStop,DelayPerBoard,DelayPerAlight
+LRV1,119,101,LRV,0.4,0.1,0.02,0.01
+LRV2,238,202,LRV,0.5,0.2,0.03,0.015
+Motor_Std,63,53,Bus,0.3,0.05,0.04,0.02
+"""
+
+PREFIX_TO_VEHICLE = """MUN,SF MUNI,Motor_Std
+"""
+
+class TestTransitCapacity(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        for (filename, text) in [("transitLineToVehicle.csv", LINE_TO_VEHICLE),
+                                 ("transitVehicleToCapacity.csv", VEHICLE_TO_CAPACITY),
+                                 ("transitPrefixToVehicle.csv", PREFIX_TO_VEHICLE)]:
+            f = open(os.path.join(self.tempdir, filename), 'w')
+            f.write(text)
+            f.close()
+        self.capacity = Wrangler.TransitCapacity(directory=self.tempdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_line_table(self):
+        self.capacity.compileLineTable(["MUNTI", "MUN30", "XYZ"])
+        self.assertEqual(self.capacity.lineTable[("MUNTI", "EA")][:3], ("SF MUNI", "LRV1", 119.0))
+        self.assertEqual(self.capacity.getSystemAndVehicleType("MUNTI", "AM"), ("SF MUNI", "LRV2"))
+        self.assertEqual(self.capacity.getSystemAndVehicleType("MUN30", "AM"), ("SF MUNI", "Motor_Std"))
+        self.assertEqual(self.capacity.getSimpleDwell("MUNTI", "AM"), 0.5)
+        self.assertEqual(self.capacity.getComplexDwells("MUNTI", "MD"), (0.1, 0.02, 0.01))
+        self.assertRaises(Wrangler.NetworkException, self.capacity.getVehicleTypeAndCapacity, "XYZ", "AM")
+
+        # each line is resolved for all the time periods at once, along with its full name
+        self.assertEqual(self.capacity.getFullname("MUNTI", "PM"), "T - THIRD STREET")
+        self.assertEqual(self.capacity.getFullname("MUN30", "PM"), "")
+        self.assertEqual(self.capacity.getSystemAndVehicleType("MUN5", "EV"), ("SF MUNI", "Motor_Std"))
+        self.assertEqual(sorted(key for key in self.capacity.lineTable if key[0] == "MUN5"),
+                         [("MUN5", timeperiod) for timeperiod in ["AM", "EA", "EV", "MD", "PM"]])
+        self.assertEqual(self.capacity.lineFullnames["MUN5"], "")
+
+        # changing the mappings is reflected right away
+        self.capacity.setAllVehicleTypes("MUNTI", "Motor_Std")
+        self.assertEqual(self.capacity.getVehicleTypeAndCapacity("MUNTI", "AM"), ("Motor_Std", 63.0))
+        self.capacity.addLineName("XYZ", "XYZ TRANSIT", "XYZ", "BUS1", "BUS1", "BUS1")
+        self.assertRaises(Wrangler.NetworkException, self.capacity.getVehicleTypeAndCapacity, "XYZ", "AM")
+        self.capacity.addVehicleType("BUS1", 50.0)
+        self.assertEqual(self.capacity.getVehicleTypeAndCapacity("XYZ", "AM"), ("BUS1", 50.0))
+
+if __name__ == '__main__':
+    unittest.main()
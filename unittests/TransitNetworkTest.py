@@ -1,17 +1,95 @@
-import os, sys, unittest
+import logging, math, os, re, shutil, sys, tempfile, unittest, zipfile
 
 # test this version of Wrangler
 curdir = os.path.dirname(__file__)
 sys.path.insert(1, os.path.normpath(os.path.join(curdir, "..", "..")))
 
 import Wrangler
+from Wrangler.NodeSequence import sequenceMatches
+from dataTable import DataTable, FieldType
+
+# an offstreet (BART) line set and an onstreet one, with their support links
+OFFSTREET_FILES = {
+    "offstreet.lin":    """LINE NAME="BART_1", MODE=32, ONEWAY=T, FREQ[1]=10, N=100, 101, -150, 102
+LINE NAME="BART_2", MODE=32, ONEWAY=T, FREQ[1]=10, N=102, 101
+LINE NAME="MUN5", MODE=11, ONEWAY=T, FREQ[1]=10, N=200, 201, 100
+""",
+    "offstreet.xfer":   "100 1100\n1101 101\n102 1102\n",
+    "offstreet.zac":    "ZONEACCESS LINK=100-2100 MODE=1\nZONEACCESS LINK=2102-102 MODE=1\nZONEACCESS LINK=200-2200 MODE=1\n",
+    "offstreet.pnr":    "PNR NODE=3101-101 ZONES=1-981\nPNR NODE=102 TIME=3\n",
+    "offstreet.access": "2100 1100 wnr\n1101 3101 pnr\n2100 9999 wnr\n1102 2102 wnr\n2200 7 wnr\n",
+}
+
+# lines for addDelay: MUNTI gets complex delays and access shutoffs, MUN30I simple (TPS) delays,
+# MUN5I complex delays without assignment data and MUN6I has no AM service
+DELAY_FILES = {
+    "transitLineToVehicle.csv":     "MUNTI,SF MUNI,TI,T,T - THIRD STREET,LRV2,LRV2,LRV1\n",
+    "transitVehicleToCapacity.csv": """VehicleType,100%Capacity,85%Capacity,VehicleCategory,SimpleDelayPerStop,ConstDelayPerStop,DelayPerBoard,DelayPerAlight
+LRV1,119,101,LRV,0.4,0.1,0.02,0.01
+LRV2,238,202,LRV,0.5,0.2,0.03,0.015
+Motor_Std,63,53,Bus,0.3,0.05,0.04,0.02
+""",
+    "transitPrefixToVehicle.csv":   "MUN,SF MUNI,Motor_Std\n",
+    "delay.lin": """LINE NAME="MUNTI", MODE=15, ONEWAY=T, OWNER="SFMUNI", FREQ[1]=10, FREQ[2]=10, FREQ[3]=10, FREQ[4]=10, FREQ[5]=0, RUNTIME=20,
+  N=1, 2, 3, -11, 4
+LINE NAME="MUN30I", MODE=11, ONEWAY=T, OWNER="TPS", FREQ[1]=7.5, FREQ[2]=10, FREQ[3]=7.5, FREQ[4]=15, FREQ[5]=0, TIMEFAC=1.1,
+  N=5, 6, 7
+LINE NAME="MUN5I", MODE=15, ONEWAY=T, FREQ[1]=12, FREQ[2]=12, FREQ[3]=12, FREQ[4]=12, FREQ[5]=0,
+  N=8, 9, 10, 12
+LINE NAME="MUN6I", MODE=11, ONEWAY=T, FREQ[1]=0, FREQ[2]=12, FREQ[3]=12, FREQ[4]=12, FREQ[5]=0,
+  N=5, 6, 7
+LINK NODES=9-10, ONEWAY=T
+"""}
+
+# A, B, line, AB_VOL, AB_BRDA, AB_XITB, FREQ, SEQ
+DELAY_ASSIGNMENT = [(1, 2, "MUNTI", 20000, 120, 0, 10.0, 1),
+                    (2, 3, "MUNTI", 300, 45, 60, 10.0, 2),
+                    (3, 11, "MUNTI", 200, 10, 25, 10.0, 3),
+                    (11, 4, "MUNTI", 200, 0, 200, 10.0, 4),
+                    (5, 6, "MUN30I", 80, 40, 5, 7.5, 1),
+                    (6, 7, "MUN30I", 70, 5, 70, 7.5, 2)]
+
+def writeNodeNames(filename, names):
+    """
+    Writes the list of (node number, name) *names* as a minimal xlsx workbook, like CHAMP_node_names.
+    """
+    rows = "".join(['<row r="%d"><c r="A%d"><v>%d</v></c><c r="B%d" t="inlineStr"><is><t>%s</t></is></c></row>' %
+                    (rownum+1, rownum+1, node, rownum+1, name) for (rownum, (node, name)) in enumerate(names)])
+    workbook = zipfile.ZipFile(filename, 'w')
+    workbook.writestr("[Content_Types].xml",
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>')
+    workbook.writestr("xl/workbook.xml",
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="nodes" sheetId="1" r:id="rId1"/></sheets></workbook>')
+    workbook.writestr("xl/_rels/workbook.xml.rels",
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/></Relationships>')
+    workbook.writestr("xl/worksheets/sheet1.xml",
+        '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>%s</sheetData></worksheet>' % rows)
+    workbook.close()
+
+class LogCapture(logging.Handler):
+    """
+    Remembers the (level name, message) of each log record.
+    """
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append((record.levelname, record.getMessage()))
 
 class TestTransitNetwork(unittest.TestCase):
 
     def setUp(self):
         """ Initialize the TransitNetwork and read in the unittests dir
         """
-        self.tn = Wrangler.TransitNetwork()
+        self.tn = Wrangler.TransitNetwork(5.0)
         thisdir = os.path.dirname(os.path.realpath(__file__))
 
         self.tn.mergeDir(thisdir)
@@ -59,8 +137,483 @@ class TestTransitNetwork(unittest.TestCase):
 
         # test doing an extend at the beginning
 
+    def test_transit_line_findSequence(self):
+        line = self.tn.line("TEST_A")
+        self.assertTrue(line.hasSequence([2,3,4]))
+        self.assertFalse(line.hasSequence([2,4]))
+        self.assertEqual(line.findSequence([3,4]), [2])
+
+        line.setNodes([1,2,1,2,1,2,3])
+        self.assertEqual(line.findSequence([1,2,1]), [0,2])
+        self.assertTrue(line.replaceSequence([1,2], [7,8], replaceAll=True))
+        self.assertEqual(line.listNodeIds(), [7,8,7,8,7,8,3])
+
+        # batch rewrites match against the line as it was
+        line.setNodes([1,2,3,4,5,6])
+        self.assertEqual(line.replaceSequences([([3,4],[3,9,4]), ([2,3],[2,10,3]), ([5],[11])]), 2)
+        self.assertEqual(line.listNodeIds(), [1,2,10,3,4,11,6])
+
     def test_transit_line_index(self):
         self.assertEqual(self.tn.line("TEST_A").n.index(4), 3)
 
+    def test_transit_line_compactNodes(self):
+        line = self.tn.line("TEST_A")
+        expected = repr(line)
+        nodeids = line.listNodeIds(ignoreStops=False)
+
+        self.assertEqual(self.tn.compactLines(), 0)
+        self.assertTrue(isinstance(line.n, Wrangler.NodeSequence))
+        self.assertEqual(repr(line), expected)
+        self.assertEqual(line.listNodeIds(ignoreStops=False), nodeids)
+        self.assertTrue(line.hasLink(-2,-3))
+        self.assertFalse(line.hasLink(3,2))
+        self.assertTrue(line.hasSequence([abs(nodeid) for nodeid in nodeids[1:4]]))
+        self.assertFalse(line.hasSequence([3,2]))
+        self.assertEqual(line.findSequence([3,4]), [2])
+        self.assertEqual(sequenceMatches(line.n.ids, [2,3,4], ignoreStops=True).next(), 1)
+        compacted = Wrangler.NodeSequence([1,-2,1,2,-1,2])
+        self.assertEqual(compacted.findSequence([1,2,1]), [0,2])
+        self.assertEqual(compacted.findSequence([1,2]), [0,2,4])
+        self.assertEqual(compacted.findSequence([2,1,2,1]), [1])
+        self.assertEqual(compacted.findSequence([1,2,2]), [])
+        self.assertEqual(line.n.index(4), 3)
+
+        # nodes are views that write through to the columns
+        line.n[3]["DELAY"] = "0.5"
+        line.n[3].setStop(False)
+        self.assertEqual(line.n[3].num, "-4")
+        self.assertEqual(line.n.columns["DELAY"][3], "0.5")
+        line.insertNode(4, 99, stop=True)
+        self.assertEqual(line.listNodeIds(ignoreStops=False)[3:5], [-4, 99])
+
+        line.expandNodes()
+        self.assertTrue(isinstance(line.n, list))
+        self.assertEqual(line.n[3].attr, {"DELAY":"0.5"})
+
+        # sequences are matched and replaced the same way in compacted lines
+        line.compactNodes()
+        self.assertEqual(line.replaceSequences([([-8,9],[8,104,9]), ([5,6],[5,105])]), 1)
+        self.assertEqual(line.listNodeIds(), [1,2,3,4,99,5,105,7,8,9,10])
+
+    def test_transit_network_line_index(self):
+        thisdir = os.path.dirname(os.path.realpath(__file__))
+        self.assertEqual(self.tn.line("TEST_B").name, "TEST_B")
+        self.assertRaises(Wrangler.NetworkException, self.tn.line, "TEST_C")
+
+        # insert_replace replaces the lines in place
+        old_test_b_idx = self.tn.lines.index(self.tn.line("TEST_B"))
+        self.tn.mergeDir(thisdir, insert_replace=True)
+        self.assertEqual(len([line for line in self.tn.lines if isinstance(line,Wrangler.TransitLine)]), 2)
+        self.assertEqual(self.tn.lines.index(self.tn.line("TEST_B")), old_test_b_idx)
+
+        # otherwise the old lines are removed and the new ones added at the end
+        self.tn.mergeDir(thisdir)
+        self.assertEqual(len([line for line in self.tn.lines if isinstance(line,Wrangler.TransitLine)]), 2)
+        self.assertTrue(self.tn.lines.index(self.tn.line("TEST_B")) > old_test_b_idx)
+        for name in ["TEST_A", "TEST_B"]:
+            self.assertTrue(self.tn.line(name) is self.tn.lines[self.tn.lines.index(name)])
+
+        # lines added or renamed directly are found too
+        self.tn.lines.append(Wrangler.TransitLine(name="TEST_C"))
+        self.assertEqual(self.tn.line("TEST_C").name, "TEST_C")
+        self.tn.line("TEST_C").name = "TEST_D"
+        self.assertEqual(self.tn.line("TEST_D").name, "TEST_D")
+        self.assertRaises(Wrangler.NetworkException, self.tn.line, "TEST_C")
+
+        # misses and 'all' don't redo the index
+        version = self.tn.lineVersion
+        self.assertRaises(Wrangler.NetworkException, self.tn.line, "TEST_E")
+        self.assertEqual(self.tn.line("all"), self.tn.lines)
+        self.assertEqual(self.tn.lineVersion, version)
+
+        self.tn.clearLines()
+        self.assertRaises(Wrangler.NetworkException, self.tn.line, "TEST_A")
+
+    def test_transit_network_matchLines(self):
+        patterns = [re.compile("TEST_"), re.compile("TEST_[AC]"), re.compile("test", re.IGNORECASE), "TEST_B$", "X"]
+        matches = self.tn.matchLines(patterns)
+        self.assertEqual([line.name for line in matches[patterns[0]]], ["TEST_A", "TEST_B"])
+        self.assertEqual([line.name for line in matches[patterns[1]]], ["TEST_A"])
+        self.assertEqual([line.name for line in matches[patterns[2]]], ["TEST_A", "TEST_B"])
+        self.assertEqual([line.name for line in matches["TEST_B$"]], ["TEST_B"])
+        self.assertEqual(matches["X"], [])
+        self.assertEqual([line.name for line in self.tn.line(re.compile("TEST_B"))], ["TEST_B"])
+        self.assertEqual(self.tn.getCombinedFreq("TEST_", lines=matches[patterns[0]]), [3.33, 6.67, 10.0, 13.33, 16.67])
+        self.tn.verifyTransitLineFrequencies({"TEST":   ["TEST_", "",       [3.33, 6.67, 10.0, 13.33, 16.67]],
+                                              "TEST_A": ["TEST_A", "TEST_A", [10, 20, 30, 40, 50]]}, coverage="TEST")
+
+        # remembered results don't outlive changes to the lines
+        self.tn.lines.append(Wrangler.TransitLine(name="TEST_C"))
+        self.assertEqual([line.name for line in self.tn.line(patterns[1])], ["TEST_A", "TEST_C"])
+
+    def test_transit_network_node_index(self):
+        indexed = Wrangler.TransitNetwork(5.0)
+        indexed.mergeDir(os.path.dirname(os.path.realpath(__file__)))
+        indexed.buildNodeIndex()
+        self.assertEqual(indexed.nodeIndex[3], [(indexed.line("TEST_A"), 2)])
+        self.assertEqual(indexed.linkIndex[(2,3)], [(indexed.line("TEST_A"), 1)])
+
+        for net in [self.tn, indexed]:
+            net.splitLinkInTransitLines(2, 3, 100)
+            net.splitLinkInTransitLines(12, 13, 101, stop=True)
+            net.replaceSegmentInTransitLines(5, 8, [5, 102, 8])
+            net.line("TEST_B").n.append(Wrangler.Node(103))
+        self.assertEqual(repr(self.tn.line("TEST_A")), repr(indexed.line("TEST_A")))
+        self.assertEqual(repr(self.tn.line("TEST_B")), repr(indexed.line("TEST_B")))
+
+        # the index was kept up to date
+        self.assertEqual(indexed.linesWithNodes([103]), [indexed.line("TEST_B")])
+        self.assertEqual(indexed.nodeIndex[8], [(indexed.line("TEST_A"), 7)])
+        self.assertFalse(6 in indexed.nodeIndex)
+        self.assertEqual(indexed.linkIndex[(100,3)], [(indexed.line("TEST_A"), 2)])
+
+        # including for equal-length edits made with the line's own methods
+        self.assertTrue(indexed.line("TEST_A").replaceSequence([8,9], [97,98]))
+        self.assertEqual(indexed.linesWithNodes([97]), [indexed.line("TEST_A")])
+        self.assertEqual(indexed.linesWithNodes([8]), [])
+        indexed.splitLinkInTransitLines(97, 98, 99)
+        self.assertEqual(indexed.line("TEST_A").listNodeIds()[-4:], [97, 99, 98, 10])
+
+    def test_msa_state(self):
+        self.tn.line("TEST_A").n[1].attr["DELAY"] = "0.25"
+        self.tn.line("TEST_A").n[3].attr["DELAY"] = "1.5"
+        state = Wrangler.MSAState(self.tn)
+        self.assertEqual(len(state), 2)
+        (nodeIds, delays) = state.lineDelays("TEST_A")
+        self.assertEqual(list(nodeIds), self.tn.line("TEST_A").listNodeIds(ignoreStops=False))
+        self.assertEqual((delays[1], delays[3]), (0.25, 1.5))
+        self.assertTrue(math.isnan(delays[0]))
+        self.assertRaises(Wrangler.NetworkException, state.lineDelays, "TEST_C")
+
+        tempdir = tempfile.mkdtemp()
+        try:
+            statefile = os.path.join(tempdir, "msa.state")
+            state.write(statefile)
+            read = Wrangler.MSAState.read(statefile)
+        finally:
+            shutil.rmtree(tempdir)
+        for name in ["TEST_A", "TEST_B"]:
+            self.assertEqual(list(read.nodeIds[name]), list(state.nodeIds[name]))
+            self.assertEqual(repr(read.delays[name]), repr(state.delays[name]))
+
+    def test_transit_network_write(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            written = []
+            for threads in [1, 3]:
+                Wrangler.TransitNetwork.writerThreads = threads
+                outdir = os.path.join(tempdir, "out%d" % threads)
+                self.tn.write(path=outdir, name="test", suppressQuery=True, suppressValidation=True)
+                # overwriting is fine too
+                self.tn.write(path=outdir, name="test", suppressQuery=True, suppressValidation=True)
+                files = {}
+                for filename in sorted(os.listdir(outdir)):
+                    f = open(os.path.join(outdir, filename), 'r')
+                    files[filename] = f.read()
+                    f.close()
+                written.append(files)
+        finally:
+            Wrangler.TransitNetwork.writerThreads = 1
+            shutil.rmtree(tempdir)
+
+        self.assertEqual(written[0], written[1])
+        self.assertFalse([filename for filename in written[0] if filename.endswith(".tmp")])
+        self.assertEqual(written[0]["test.lin"],
+                         ";;<<Trnbuild>>;;\n" + "".join([line if isinstance(line, str) else repr(line)+"\n"
+                                                          for line in self.tn.lines]))
+
+    def test_transit_network_write_skipUnchanged(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            self.tn.write(path=tempdir, name="test", suppressQuery=True, suppressValidation=True, skipUnchanged=True)
+            manifest = Wrangler.TransitNetwork.readManifest(tempdir)
+            self.assertEqual(manifest["test.lin"], Wrangler.TransitNetwork.hashFile(os.path.join(tempdir, "test.lin")))
+            self.assertEqual(sorted(manifest.keys()),
+                             sorted([filename for filename in os.listdir(tempdir)
+                                     if filename != Wrangler.TransitNetwork.MANIFEST_FILENAME]))
+
+            # make everything look old, then write again with one line changed
+            for filename in os.listdir(tempdir):
+                os.utime(os.path.join(tempdir, filename), (1000000000, 1000000000))
+            self.tn.line("TEST_B").attr["FREQ[1]"] = 6
+            self.tn.write(path=tempdir, name="test", suppressQuery=True, suppressValidation=True, skipUnchanged=True)
+
+            changed = [filename for filename in os.listdir(tempdir)
+                       if os.path.getmtime(os.path.join(tempdir, filename)) != 1000000000]
+            self.assertEqual(sorted(changed), ["test.lin", Wrangler.TransitNetwork.MANIFEST_FILENAME])
+            self.assertNotEqual(Wrangler.TransitNetwork.readManifest(tempdir)["test.lin"], manifest["test.lin"])
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_transit_network_doMerge(self):
+        linfile = os.path.join(os.path.dirname(os.path.realpath(__file__)), "test.lin")
+        self.assertEqual(self.tn.mergeStats[-1][0], linfile)
+        self.assertEqual(self.tn.mergeStats[-1][1]["lines appended"], 2)
+
+        testA = self.tn.line("TEST_A")
+        self.tn.parseFile(linfile, insert_replace=True)
+        (path, stats) = self.tn.mergeStats[-1]
+        self.assertEqual((stats["lines"], stats["lines replaced"], stats["lines appended"]), (2, 2, 0))
+        self.assertEqual([line.name for line in self.tn], ["TEST_A", "TEST_B"])
+        self.assertFalse(self.tn.line("TEST_A") is testA)
+
+        self.tn.parseFile(linfile, insert_replace=False)
+        (path, stats) = self.tn.mergeStats[-1]
+        self.assertEqual((stats["lines removed"], stats["lines appended"]), (2, 2))
+        self.assertEqual([line.name for line in self.tn], ["TEST_A", "TEST_B"])
+
+    def test_transit_network_mergeRecords(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            linkfile = os.path.join(tempdir, "test.link")
+            f = open(linkfile, 'w')
+            f.write("LINK NODES=1-2, DIST=50\nLINK NODES=2-3, DIST=60\n")
+            f.close()
+            accessfile = os.path.join(tempdir, "test.access")
+            f = open(accessfile, 'w')
+            f.write("15001 1 wnr 0.25\n")
+            f.close()
+
+            self.tn.parseFile(linkfile)
+            self.tn.parseFile(accessfile)
+            self.tn.parseFile(accessfile)
+            self.assertEqual(len([li for li in self.tn.accessli if isinstance(li, Wrangler.Linki)]), 1)
+            self.assertEqual(self.tn.mergeStats[-1][1]["accesslinks replaced"], 1)
+
+            f = open(linkfile, 'w')
+            f.write("LINK NODES=2-3, DIST=70\nLINK NODES=3-4, DIST=80\n")
+            f.close()
+            self.tn.parseFile(linkfile, insert_replace=True)
+            self.assertEqual([(link.id, link["DIST"]) for link in self.tn.links if isinstance(link, Wrangler.TransitLink)],
+                             [("1-2", "50"), ("2-3", "70"), ("3-4", "80")])
+
+            f = open(linkfile, 'w')
+            f.write("LINK NODES=1-2, DIST=90\n")
+            f.close()
+            self.tn.parseFile(linkfile, insert_replace=False)
+            self.assertEqual([(link.id, link["DIST"]) for link in self.tn.links if isinstance(link, Wrangler.TransitLink)],
+                             [("2-3", "70"), ("3-4", "80"), ("1-2", "90")])
+            self.assertEqual(self.tn.mergeStats[-1][1]["links removed"], 1)
+            self.assertEqual(self.tn.links[self.tn.findRecord("links", (3,4))]["DIST"], "80")
+            self.assertEqual(self.tn.findRecord("links", (4,5)), None)
+
+            # records replaced outside of a merge are found by the next one
+            idx = self.tn.findRecord("links", (3,4))
+            self.tn.links[idx] = Wrangler.TransitLink()
+            self.tn.links[idx].setId("7-8")
+            link = Wrangler.TransitLink()
+            link.setId("7-8")
+            link["DIST"] = "100"
+            self.assertEqual(self.tn.mergeRecords("links", [link], linkfile, insert_replace=True), (1, 0))
+            self.assertEqual([(link.id, link["DIST"]) for link in self.tn.links if isinstance(link, Wrangler.TransitLink)],
+                             [("2-3", "70"), ("7-8", "100"), ("1-2", "90")])
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_transit_network_validateWnrsAndPnrs(self):
+        tempdir = tempfile.mkdtemp()
+        nodenames = os.environ.get("CHAMP_node_names")
+        level     = Wrangler.WranglerLogger.level
+        capture   = LogCapture()
+        try:
+            net = Wrangler.TransitNetwork(5.0)
+            for filename in sorted(OFFSTREET_FILES.keys()):
+                f = open(os.path.join(tempdir, filename), 'w')
+                f.write(OFFSTREET_FILES[filename])
+                f.close()
+                net.parseFile(os.path.join(tempdir, filename))
+            os.environ["CHAMP_node_names"] = os.path.join(tempdir, "nodenames.xlsx")
+            writeNodeNames(os.environ["CHAMP_node_names"], [(100, "Embarcadero BART"), (101, "Montgomery BART"),
+                                                            (200, "Market and Main")])
+
+            Wrangler.WranglerLogger.setLevel(logging.DEBUG)
+            Wrangler.WranglerLogger.addHandler(capture)
+            net.validateWnrsAndPnrs()
+        finally:
+            Wrangler.WranglerLogger.removeHandler(capture)
+            Wrangler.WranglerLogger.setLevel(level)
+            if nodenames is None: del os.environ["CHAMP_node_names"]
+            else:                 os.environ["CHAMP_node_names"] = nodenames
+            shutil.rmtree(tempdir)
+
+        header = "%-30s %10s %10s %10s %10s" % ("stopname", "stop", "xfer", "wnr", "pnr")
+        self.assertEqual(capture.messages, [
+            ("DEBUG",    "Validating Off Street Transit Node Connections"),
+            ("WARNING",  "Invalid access link found in BART lineset BAR (incl offstreet) stopNode 100 -- Missing xfer?  " +
+                         "A=2100 B=9999, xfernodes=['1100'] wnrNodes=set([2100]) pnrNodes=set([])"),
+            ("DEBUG",    "--------------- Line set MUN ['Local'] -- hasOffstreet? False------------------"),
+            ("DEBUG",    header),
+            ("DEBUG",    "Embarcadero BART                      100       1100       2100          -"),
+            ("DEBUG",    "--------------- Line set BAR ['BART'] -- hasOffstreet? True------------------"),
+            ("DEBUG",    header),
+            ("DEBUG",    "Embarcadero BART                      100       1100       2100          -"),
+            ("DEBUG",    "Montgomery BART                       101       1101          -       3101"),
+            ("CRITICAL", "Zero wnrNodes or onstreetxfers for stop 101!"),
+            ("DEBUG",    "Unknown stop name                     102       1102       2102          -")])
+
+    def test_transit_network_checkValidityOfLinks(self):
+        import Cube.CubeNet
+        net = Wrangler.TransitNetwork(5.0)
+        for (name, nodes) in [("LINE_1", [1,2,-3,4,5]), ("LINE_2", [3,2]), ("LINE_3", [5,4,6])]:
+            line = Wrangler.TransitLine(name=name)
+            line.setNodes(nodes)
+            net.lines.append(line)
+        for (nodes, oneway) in [("2-3", None), ("5-4", "N"), ("4-6", "Y")]:
+            link = Wrangler.TransitLink()
+            link.setId(nodes)
+            if oneway: link["ONEWAY"] = oneway
+            net.links.append(link)
+
+        tempdir = tempfile.mkdtemp()
+        cwd = os.getcwd()
+        export = Cube.CubeNet.export_cubenet_to_csvs
+        try:
+            # Cube isn't available to export the roadway network, so use csvs as if it had
+            os.chdir(tempdir)
+            for (filename, text) in [("cubenet_validate_nodes.csv", "1,0,0\n2,1,0\n"),
+                                     ("cubenet_validate_links.csv", "1,2,0.1,MAIN ST\n")]:
+                f = open(filename, 'w')
+                f.write(text)
+                f.close()
+            Cube.CubeNet.export_cubenet_to_csvs = lambda *args, **kwargs: None
+            invalid_links = net.checkValidityOfLinks("roadway.net")
+        finally:
+            Cube.CubeNet.export_cubenet_to_csvs = export
+            os.chdir(cwd)
+            shutil.rmtree(tempdir)
+
+        # 2-3 and 4-6 are one-way off-road links; 5-4 is two-way
+        self.assertEqual(invalid_links, [(3, 4, "LINE_1"), (3, 2, "LINE_2")])
+
+    def test_transit_network_addDelay(self):
+        tempdir = tempfile.mkdtemp()
+        cwd = os.getcwd()
+        (capacity, alltripmodes) = (Wrangler.TransitNetwork.capacity, os.environ.get("ALLTRIPMODES"))
+        level   = Wrangler.WranglerLogger.level
+        capture = LogCapture()
+        try:
+            for (filename, text) in DELAY_FILES.items():
+                f = open(os.path.join(tempdir, filename), 'w')
+                f.write(text)
+                f.close()
+            f = open(os.path.join(tempdir, "SFWBWAM.csv"), 'w')
+            f.write("A,B,TIME,MODE,PLOT,STOP_A,STOP_B,DIST,NAME,OWNER," +
+                    "AB_VOL,AB_BRDA,AB_XITA,AB_BRDB,AB_XITB,BA_VOL,BA_BRDA,BA_XITA,BA_BRDB,BA_XITB\n")
+            for record in DELAY_ASSIGNMENT:
+                f.write("%d,%d,1.5,11,1,1,1,0.25,%s,SFMUNI,%d,%d,0,0,%d,0,0,0,0,0\n" % record[:6])
+            f.close()
+            dbf = DataTable(len(DELAY_ASSIGNMENT), header=(FieldType("A",    "N", 7, 0),
+                                                           FieldType("B",    "N", 7, 0),
+                                                           FieldType("FREQ", "F", 6, 2),
+                                                           FieldType("SEQ",  "N", 3, 0)))
+            for (rownum, record) in enumerate(DELAY_ASSIGNMENT): dbf[rownum] = record[:2] + record[6:]
+            dbf.writeAsDbf(os.path.join(tempdir, "SFWBWAM.dbf"))
+
+            os.environ["ALLTRIPMODES"] = "WBW"
+            Wrangler.TransitNetwork.initializeTransitCapacity(directory=tempdir)
+            tad = Wrangler.TransitAssignmentData(directory=tempdir, timeperiod="AM",
+                                                 transitCapacity=Wrangler.TransitNetwork.capacity)
+            (net, previous, failing) = (Wrangler.TransitNetwork(5.0), Wrangler.TransitNetwork(5.0), Wrangler.TransitNetwork(5.0))
+            for transitnet in [net, previous, failing]:
+                transitnet.parseFile(os.path.join(tempdir, "delay.lin"))
+            previous.line("MUNTI").n[0].attr["DELAY"] = "0.4"
+            previous.line("MUNTI").n[2].attr["DELAY"] = "0.25"
+
+            # the complex delays need a real time period, which is checked before anything changes
+            os.chdir(tempdir)
+            self.assertRaises(Wrangler.NetworkException, failing.addDelay, timeperiod="Simple",
+                              complexDelayModes=[15], transitAssignmentData=tad)
+            self.assertEqual(failing.line("MUNTI").attr["RUNTIME"], "20")
+            self.assertFalse([node for line in failing for node in line.n if "DELAY" in node.attr])
+
+            Wrangler.WranglerLogger.setLevel(logging.DEBUG)
+            Wrangler.WranglerLogger.addHandler(capture)
+            net.addDelay(timeperiod="AM", complexDelayModes=[15], complexAccessModes=[15], transitAssignmentData=tad,
+                         MSAweight=0.5, previousNet=previous, logPrefix="iter1")
+            Wrangler.WranglerLogger.removeHandler(capture)
+
+            outfiles = {}
+            for filename in ["lineStatsAM.csv", "dwellbucketAM.csv"]:
+                f = open(filename, 'r')
+                outfiles[filename] = f.read()
+                f.close()
+        finally:
+            Wrangler.WranglerLogger.removeHandler(capture)
+            Wrangler.WranglerLogger.setLevel(level)
+            os.chdir(cwd)
+            Wrangler.TransitNetwork.capacity = capacity
+            if alltripmodes is None: del os.environ["ALLTRIPMODES"]
+            else:                    os.environ["ALLTRIPMODES"] = alltripmodes
+            shutil.rmtree(tempdir)
+
+        # MUNTI's stops get complex delays blended with the previous ones, and stop 2 is closed
+        # since the link into it is over capacity; MUN5I has no boards and exempts the link nodes
+        delays = dict((line.name, [(node.num, node.attr.get("DELAY"), node.attr.get("ACCESS")) for node in line.n])
+                      for line in net)
+        self.assertEqual(delays["MUNTI"],  [("1", "0.400", None), ("2", "0.138", 2), ("3", "0.258", None),
+                                            ("-11", None, None), ("4", None, None)])
+        self.assertEqual(delays["MUN30I"], [("5", "0.2", None), ("6", "0.2", None), ("7", None, None)])
+        self.assertEqual(delays["MUN5I"],  [("8", "0.025", None), ("9", None, None), ("10", None, None), ("12", None, None)])
+        self.assertEqual(delays["MUN6I"],  [("5", None, None), ("6", None, None), ("7", None, None)])
+        self.assertFalse("RUNTIME" in net.line("MUNTI").attr or "TIMEFAC" in net.line("MUN30I").attr)
+
+        self.assertEqual(outfiles["lineStatsAM.csv"], "iter1,MUNTI,0.795833,1\niter1,MUN30I,0.400000,0\niter1,MUN5I,0.025000,0\n")
+        self.assertEqual(outfiles["dwellbucketAM.csv"], "iter1,0,1\niter1,1,3\niter1,2,1\niter1,4,1\n")
+
+        complexLog = "line name=MUNTI, timeperiod=AM, delay_const,perboard,peralight=0.200, 0.030, 0.015"
+        self.assertEqual(capture.messages, [
+            ("INFO",    "addDelay: Size of linkset = 2"),
+            ("DEBUG",   "Stripping RUNTIME from MUNTI"),
+            ("DEBUG",   complexLog),
+            ("DEBUG",   "No delay found for line MUNTI node 2 -- using 0"),
+            ("DEBUG",   complexLog),
+            ("DEBUG",   complexLog),
+            ("DEBUG",   "Stripping TIMEFAC from MUN30I"),
+            ("WARNING", "Failed to get boards for (MUN5I, A=8 B=9 SEQ=1); assuming 0"),
+            ("DEBUG",   "No delay found for line MUN5I node 8 -- using 0"),
+            ("DEBUG",   "line name=MUN5I, timeperiod=AM, delay_const,perboard,peralight=0.050, 0.040, 0.020")])
+
+    def test_transit_network_bulk_delete(self):
+        for (nodeA, nodeB) in [(1,2), (2,1), (2,3), (3,4), (1,2)]:
+            link = Wrangler.TransitLink()
+            link.setId("%d-%d" % (nodeA, nodeB))
+            self.tn.links.append(link)
+        for (listname, nodes) in [("accessli", [(15001,1), (15002,2), (15003,3)]), ("xferli", [(1,2), (3,4)])]:
+            for (nodeA, nodeB) in nodes:
+                linki = Wrangler.Linki()
+                (linki.A, linki.B) = (str(nodeA), str(nodeB))
+                getattr(self.tn, listname).append(linki)
+
+        self.assertEqual(self.tn.deleteLinksForNodePairs([(1,2), (3,4)], include_reverse=False), 3)
+        self.assertEqual([link.id for link in self.tn.links], ["2-1", "2-3"])
+        self.assertEqual(self.tn.deleteLinksForNodePairs([(3,2), (5,6)]), 1)
+        self.assertEqual(self.tn.deleteLinkForNodes(1, 2), 1)
+        self.assertEqual(self.tn.links, [])
+
+        self.assertEqual(self.tn.deleteAccessXferLinksForNodes(set([1,3]), xfer_links=False), 2)
+        self.assertEqual([(li.A, li.B) for li in self.tn.accessli], [("15002", "2")])
+        self.assertEqual(self.tn.deleteAccessXferLinksForNodes([2, 4]), 3)
+        self.assertEqual(self.tn.accessli + self.tn.xferli, [])
+
+        # links edited in place since the last delete are still found, and they're logged last to first
+        for linkid in ["1-2", "3-4", "5-6"]:
+            link = Wrangler.TransitLink()
+            link.setId(linkid)
+            self.tn.links.append(link)
+        self.assertEqual(self.tn.deleteLinkForNodes(9, 9), 0)
+        self.tn.links[1].setId("7-8")
+        level   = Wrangler.WranglerLogger.level
+        capture = LogCapture()
+        try:
+            Wrangler.WranglerLogger.setLevel(logging.DEBUG)
+            Wrangler.WranglerLogger.addHandler(capture)
+            self.assertEqual(self.tn.deleteLinksForNodePairs([(7,8), (5,6)]), 2)
+        finally:
+            Wrangler.WranglerLogger.removeHandler(capture)
+            Wrangler.WranglerLogger.setLevel(level)
+        self.assertEqual([link.id for link in self.tn.links], ["1-2"])
+        self.assertEqual([message[1][:len("Removing link LINK nodes=5-6")] for message in capture.messages],
+                         ["Removing link LINK nodes=5-6", "Removing link LINK nodes=7-8"])
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -1,4 +1,4 @@
-import os, sys, unittest
+import copy, cPickle, os, sys, unittest
 
 # test this version of Wrangler
 curdir = os.path.dirname(__file__)
@@ -25,6 +25,30 @@ class TestTransitNode(unittest.TestCase):
         self.assertEqual(self.embarc.boardsDisallowed(), True)
         self.assertEqual(self.invalid.boardsDisallowed(), False)
 
+    def test_transit_node_num(self):
+        node = Wrangler.Node("-24322")
+        self.assertEqual(node.num, "-24322")
+        self.assertEqual(node.number, 24322)
+        self.assertEqual(node.stop, False)
+        self.assertEqual(node.isStop(), False)
+        self.assertEqual(node.lineFileRepr(), "   -24322,\n")
+
+        node.setStop(True)
+        self.assertEqual(node.num, "24322")
+        self.assertEqual(node.isStop(), True)
+        self.assertEqual(node, 24322)
+        node["DELAY"] = "0.5"
+        node.comment = "; stop"
+        self.assertEqual(node.lineFileRepr(prependNEquals=True, lastNode=True), " N= 24322, DELAY=0.5 ; stop\n")
+
+        # numbers are written back the way they were read
+        self.assertEqual(Wrangler.Node("+24322").lineFileRepr(), "    +24322,\n")
+        self.assertEqual(Wrangler.Node(-5).num, "-5")
+
+        for clone in [copy.deepcopy(node), cPickle.loads(cPickle.dumps(node)),
+                      cPickle.loads(cPickle.dumps(node, cPickle.HIGHEST_PROTOCOL))]:
+            self.assertEqual(clone.lineFileRepr(), node.lineFileRepr())
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
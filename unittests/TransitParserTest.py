@@ -0,0 +1,209 @@
+import os, shutil, StringIO, sys, tempfile, unittest
+
+# test this version of Wrangler
+curdir = os.path.dirname(__file__)
+sys.path.insert(1, os.path.normpath(os.path.join(curdir, "..", "..")))
+
+import Wrangler
+from Wrangler.TransitParser import transit_file_def
+
+LINK_TEXT = r""";;<<Trnbuild>>;;
+; fixed guideway
+LINK NODES=13264-13265, SPEED=30, ONEWAY=N ; tunnel
+LINK nodes=13265,13266 modes=11,12
+/* c comment */
+LINK NODES=13266-13267, DIST=50
+"""
+
+PNR_TEXT = r"""; park and ride lots
+PNR NODE=13253-2525 ZONES=1-981 ; Daly City
+PNR NODE=13254 TIME=3, COST=10.5
+"""
+
+ZAC_TEXT = r"""ZONEACCESS LINK=1-15001 MODE=5 ; zone 1
+ZONEACCESS link=2-15002 MODE=5
+"""
+
+SUPPLINK_TEXT = r"""SUPPLINK N=15001-13264 MODE=1 SPEED=3 ONEWAY=Y ; walk
+SUPPLINK N=15002-13265 MODE=2 DIST=12
+"""
+
+ACCESS_TEXT = r"""; access links
+15001 13264 wnr 0.25 ; walk
+15002 13265 pnr
+15003 13266 7
+"""
+
+class TestTransitParser(unittest.TestCase):
+    """
+    Conformance tests: the :py:class:`Wrangler.TransitTokenizer` should produce exactly what
+    the simpleparse-based :py:class:`Wrangler.TransitParser` does.
+    """
+
+    def parseWith(self, parser, trntxt, liType):
+        success, children, nextcharacter = parser.parse(trntxt, production="transit_file")
+        self.assertEqual(nextcharacter, len(trntxt))
+        return [parser.convertLineData(), parser.convertLinkData(), parser.convertPNRData(),
+                parser.convertZACData(), parser.convertSupplinksData(),
+                parser.convertLinkiData("access"), parser.convertLinkiData("xfer")]
+
+    def assertSameObjects(self, expected, actual):
+        self.assertEqual(len(expected), len(actual))
+        for (exp, act) in zip(expected, actual):
+            self.assertEqual(type(exp), type(act))
+            if isinstance(exp, str):
+                self.assertEqual(exp, act)
+            elif isinstance(exp, Wrangler.TransitLine):
+                self.assertEqual(exp.name, act.name)
+                self.assertEqual(exp.attr, act.attr)
+                self.assertEqual(exp.comment, act.comment)
+                self.assertEqual(len(exp.n), len(act.n))
+                for (expnode, actnode) in zip(exp.n, act.n):
+                    self.assertEqual(expnode.num, actnode.num)
+                    self.assertEqual(expnode.stop, actnode.stop)
+                    self.assertEqual(expnode.attr, actnode.attr)
+                    self.assertEqual(expnode.comment, actnode.comment)
+                self.assertEqual(repr(exp), repr(act))
+            else:
+                self.assertEqual(dict(exp), dict(act))
+                self.assertEqual(exp.__dict__, act.__dict__)
+                self.assertEqual(repr(exp), repr(act))
+
+    def assertConforms(self, trntxt, liType=''):
+        parser = Wrangler.TransitParser(transit_file_def, verbosity=0)
+        parser.tfp.liType = liType
+        tokenizer = Wrangler.TransitTokenizer(verbosity=0)
+        tokenizer.liType = liType
+
+        expected = self.parseWith(parser, trntxt, liType)
+        actual   = self.parseWith(tokenizer, trntxt, liType)
+        for (exp, act) in zip(expected, actual):
+            self.assertSameObjects(exp, act)
+        return actual
+
+    def test_lin(self):
+        thisdir = os.path.dirname(os.path.realpath(__file__))
+        f = open(os.path.join(thisdir, "test.lin"), 'r')
+        lines = self.assertConforms(f.read())[0]
+        f.close()
+        self.assertEqual(len([line for line in lines if isinstance(line, Wrangler.TransitLine)]), 2)
+
+    def test_link(self):
+        links = self.assertConforms(LINK_TEXT)[1]
+        self.assertEqual(len([link for link in links if isinstance(link, Wrangler.TransitLink)]), 3)
+
+    def test_pnr(self):
+        pnrs = self.assertConforms(PNR_TEXT)[2]
+        self.assertEqual(len([pnr for pnr in pnrs if isinstance(pnr, Wrangler.PNRLink)]), 2)
+
+    def test_zac(self):
+        self.assertConforms(ZAC_TEXT)
+
+    def test_supplink(self):
+        supplinks = self.assertConforms(SUPPLINK_TEXT)[4]
+        self.assertEqual(len(supplinks), 2)
+
+    def test_accessli(self):
+        accesslis = self.assertConforms(ACCESS_TEXT, "access")[5]
+        self.assertEqual(len([li for li in accesslis if isinstance(li, Wrangler.Linki)]), 3)
+        self.assertConforms(ACCESS_TEXT, "xfer")
+
+    def test_unclassified_accessli(self):
+        tokenizer = Wrangler.TransitTokenizer(verbosity=0)
+        self.assertRaises(Wrangler.NetworkException, tokenizer.parse, ACCESS_TEXT)
+
+    def test_iterparse(self):
+        thisdir = os.path.dirname(os.path.realpath(__file__))
+        f = open(os.path.join(thisdir, "test.lin"), 'r')
+        lintext = f.read()
+        f.close()
+
+        for (trntxt, liType) in [(lintext, ''), (LINK_TEXT + PNR_TEXT + ZAC_TEXT + SUPPLINK_TEXT, ''),
+                                 (ACCESS_TEXT, 'access'), (ACCESS_TEXT, 'xfer')]:
+            tokenizer = Wrangler.TransitTokenizer(verbosity=0)
+            tokenizer.liType = liType
+            expected = self.parseWith(tokenizer, trntxt, liType)
+
+            # tiny chunks to exercise records split across reads
+            for chunksize in [1, 10, 65536]:
+                parsed = dict((listname, []) for listname in ['lines','links','pnrs','zacs','supplinks','accessli','xferli'])
+                for (listname, item) in tokenizer.iterparse(StringIO.StringIO(trntxt), chunksize=chunksize):
+                    parsed[listname].append(item)
+                actual = [parsed['lines'], parsed['links'], parsed['pnrs'], parsed['zacs'],
+                          parsed['supplinks'], parsed['accessli'], parsed['xferli']]
+                for (exp, act) in zip(expected, actual):
+                    self.assertSameObjects(exp, act)
+
+        # the simpleparse parser hands off to the tokenizer
+        parser = Wrangler.TransitParser(transit_file_def, verbosity=0)
+        lines = [item for (listname, item) in parser.iterparse(StringIO.StringIO(lintext))]
+        self.assertEqual(len([line for line in lines if isinstance(line, Wrangler.TransitLine)]), 2)
+
+        tokenizer = Wrangler.TransitTokenizer(verbosity=0)
+        self.assertRaises(Wrangler.NetworkException, list, tokenizer.iterparse(StringIO.StringIO(LINK_TEXT + "foo")))
+
+    def test_parallel_mergeDir(self):
+        thisdir = os.path.dirname(os.path.realpath(__file__))
+        tempdir = tempfile.mkdtemp()
+        try:
+            shutil.copy(os.path.join(thisdir, "test.lin"), tempdir)
+            for (filename, trntxt) in [("test.link", LINK_TEXT), ("test.pnr", PNR_TEXT), ("test.zac", ZAC_TEXT),
+                                       ("test.access", ACCESS_TEXT), ("test.xfer", ACCESS_TEXT)]:
+                f = open(os.path.join(tempdir, filename), 'w')
+                f.write(trntxt)
+                f.close()
+
+            networks = []
+            for processes in [1, 3]:
+                Wrangler.TransitNetwork.parserProcesses = processes
+                networks.append(Wrangler.TransitNetwork(5.0))
+                networks[-1].mergeDir(tempdir)
+        finally:
+            Wrangler.TransitNetwork.parserProcesses = 1
+            shutil.rmtree(tempdir)
+
+        for listname in ['lines', 'links', 'pnrs', 'zacs', 'accessli', 'xferli']:
+            serial   = [repr(item) for item in getattr(networks[0], listname)]
+            parallel = [repr(item) for item in getattr(networks[1], listname)]
+            self.assertTrue(len(serial) > 0)
+            self.assertEqual(serial, parallel)
+
+    def test_snapshot(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            Wrangler.TransitNetwork.snapshotDir = os.path.join(tempdir, "snapshots")
+            linkfile = os.path.join(tempdir, "test.link")
+            f = open(linkfile, 'w')
+            f.write(LINK_TEXT)
+            f.close()
+
+            parsed = Wrangler.TransitNetwork(5.0).readTransitFile(linkfile, "link")
+            (snapshotfile, snapshotkey) = Wrangler.TransitNetwork.getSnapshotFileAndKey(linkfile, "link")
+            self.assertTrue(os.path.exists(snapshotfile))
+
+            # a warm start gets the same objects from the snapshot
+            cached = Wrangler.TransitNetwork.readSnapshot(snapshotfile, snapshotkey)
+            self.assertEqual([repr(link) for link in parsed[1]], [repr(link) for link in cached[1]])
+            self.assertEqual([repr(link) for link in parsed[1]],
+                             [repr(link) for link in Wrangler.TransitNetwork(5.0).readTransitFile(linkfile, "link")[1]])
+
+            # editing the file invalidates the snapshot
+            f = open(linkfile, 'a')
+            f.write("LINK NODES=13267-13268, DIST=10\n")
+            f.close()
+            self.assertEqual(Wrangler.TransitNetwork.readSnapshot(*Wrangler.TransitNetwork.getSnapshotFileAndKey(linkfile, "link")), None)
+            links = Wrangler.TransitNetwork(5.0).readTransitFile(linkfile, "link")[1]
+            self.assertEqual(len([link for link in links if isinstance(link, Wrangler.TransitLink)]), 4)
+        finally:
+            Wrangler.TransitNetwork.snapshotDir = None
+            shutil.rmtree(tempdir)
+
+    def test_partial_parse(self):
+        trntxt = LINK_TEXT + "foo"
+        parser = Wrangler.TransitParser(transit_file_def, verbosity=0)
+        tokenizer = Wrangler.TransitTokenizer(verbosity=0)
+        self.assertEqual(parser.parse(trntxt, production="transit_file")[2],
+                         tokenizer.parse(trntxt, production="transit_file")[2])
+
+if __name__ == '__main__':
+    unittest.main()